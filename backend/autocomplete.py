@@ -0,0 +1,146 @@
+"""
+Индекс автодополнения имён пользователей (для @упоминаний и выбора людей)
+Держит в памяти процесса отсортированный массив username активных (не забаненных)
+пользователей и отвечает на запросы по префиксу без обращения к БД.
+"""
+import asyncio
+import logging
+import os
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from database import get_db, get_db_type
+
+logger = logging.getLogger(__name__)
+
+# Как часто перечитывать индекс из БД: обновления из других воркеров видны только после перезагрузки
+AUTOCOMPLETE_RELOAD_SECONDS = int(os.getenv("AUTOCOMPLETE_RELOAD_SECONDS", "300"))
+
+
+class UsernameIndex:
+    """Отсортированный по нижнему регистру массив (key, user_id, username).
+
+    Поиск по префиксу — bisect + последовательный проход, O(log n + limit).
+    Вставка/удаление — O(n) сдвиг массива, что для одиночных событий
+    (регистрация, смена имени, бан) дешевле, чем поддержка дерева.
+    """
+
+    def __init__(self):
+        self._entries: List[Tuple[str, int, str]] = []
+        self._by_id: Dict[int, Tuple[str, int, str]] = {}
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def replace_all(self, users: List[Tuple[int, str]]) -> None:
+        """Полностью пересобрать индекс из пар (id, username)."""
+        entries = sorted((name.lower(), uid, name) for uid, name in users if name)
+        self._entries = entries
+        self._by_id = {e[1]: e for e in entries}
+        self.loaded = True
+
+    def add(self, user_id: int, username: str) -> None:
+        """Добавить пользователя или обновить его имя."""
+        self.remove(user_id)
+        if not username:
+            return
+        entry = (username.lower(), user_id, username)
+        insort(self._entries, entry)
+        self._by_id[user_id] = entry
+
+    def remove(self, user_id: int) -> None:
+        entry = self._by_id.pop(user_id, None)
+        if entry is None:
+            return
+        i = bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+
+    def search(self, prefix: str, limit: int = 10, exclude_id: Optional[int] = None) -> List[dict]:
+        """Пользователи, чьё имя начинается с prefix (без учёта регистра), по алфавиту."""
+        key = (prefix or "").strip().lstrip("@").lower()
+        if not key:
+            return []
+        out = []
+        entries = self._entries
+        i = bisect_left(entries, (key,))
+        while i < len(entries) and len(out) < limit:
+            k, uid, name = entries[i]
+            if not k.startswith(key):
+                break
+            if uid != exclude_id:
+                out.append({"id": uid, "username": name})
+            i += 1
+        return out
+
+
+username_index = UsernameIndex()
+
+
+async def load_username_index() -> None:
+    """Загрузить всех не забаненных пользователей из БД в индекс."""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            rows = await conn.fetch(
+                "SELECT id, username FROM users WHERE is_banned IS NOT TRUE"
+            )
+            users = [(r["id"], r["username"]) for r in rows]
+        else:
+            async with conn.execute(
+                "SELECT id, username FROM users WHERE is_banned = 0 OR is_banned IS NULL"
+            ) as cursor:
+                users = [(r[0], r[1]) for r in await cursor.fetchall()]
+    username_index.replace_all(users)
+    logger.info("Индекс автодополнения загружен: %d пользователей", len(username_index))
+
+
+async def refresh_user_in_index(conn, db_type: str, user_id: int) -> None:
+    """Перечитать одного пользователя (после разбана и т.п.) и синхронизировать индекс."""
+    if db_type == 'postgresql':
+        r = await conn.fetchrow("SELECT username, is_banned FROM users WHERE id = $1", user_id)
+        row = (r["username"], r["is_banned"]) if r else None
+    else:
+        async with conn.execute("SELECT username, is_banned FROM users WHERE id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+    if row and not row[1]:
+        username_index.add(user_id, row[0])
+    else:
+        username_index.remove(user_id)
+
+
+async def search_usernames_db(
+    conn, db_type: str, prefix: str, limit: int = 10, exclude_id: Optional[int] = None
+) -> List[dict]:
+    """То же, что UsernameIndex.search, запросом к БД — пока индекс ещё не загружен после старта."""
+    key = (prefix or "").strip().lstrip("@").lower()
+    if not key:
+        return []
+    pattern = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    if db_type == 'postgresql':
+        rows = await conn.fetch(
+            """SELECT id, username FROM users
+               WHERE LOWER(username) LIKE $1 ESCAPE '\\' AND is_banned IS NOT TRUE AND id <> $2
+               ORDER BY LOWER(username), id LIMIT $3""",
+            pattern, exclude_id or 0, limit
+        )
+        return [{"id": r["id"], "username": r["username"]} for r in rows]
+    async with conn.execute(
+        """SELECT id, username FROM users
+           WHERE LOWER(username) LIKE ? ESCAPE '\\' AND (is_banned = 0 OR is_banned IS NULL) AND id <> ?
+           ORDER BY LOWER(username), id LIMIT ?""",
+        (pattern, exclude_id or 0, limit)
+    ) as cursor:
+        return [{"id": r[0], "username": r[1]} for r in await cursor.fetchall()]
+
+
+async def run_username_index_reload() -> None:
+    """Первая загрузка в фоне (старт воркера её не ждёт), затем периодически перечитывать индекс,
+    чтобы подхватывать изменения из других воркеров."""
+    while True:
+        try:
+            await load_username_index()
+        except Exception as e:
+            logger.warning("Не удалось перезагрузить индекс автодополнения: %s", e)
+        await asyncio.sleep(AUTOCOMPLETE_RELOAD_SECONDS)
@@ -0,0 +1,58 @@
+"""
+Singleton-задачи: то, что должно работать в одном процессе, а не в каждом воркере
+- polling Telegram-бота (второй getUpdates с тем же токеном получает 409 Conflict);
+- пересчёт статистики (одинаковая работа и запись в БД из каждого воркера).
+Кэши и буферы процесса (индекс автодополнения, граф, присутствие, метрики, рекомендации) по-прежнему в каждом воркере.
+
+Задачи запускает воркер, взявший файловую блокировку BACKGROUND_LOCK_PATH; остальные раз в
+BACKGROUND_LEADER_RETRY_SECONDS пробуют её взять и подхватывают задачи, если держатель упал
+(ОС снимает flock вместе с процессом).
+BACKGROUND_TASKS: auto — по блокировке; on — всегда (назначенный воркер или отдельный процесс);
+off — никогда. Блокировка действует в пределах одного хоста: при нескольких машинах auto/on
+оставляют на одной, на остальных — off.
+"""
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+from process_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_TASKS = os.getenv("BACKGROUND_TASKS", "auto").strip().lower()
+BACKGROUND_LOCK_PATH = os.getenv("BACKGROUND_LOCK_PATH", "").strip() or str(
+    Path(__file__).parent / "data" / "background.lock"
+)
+BACKGROUND_LEADER_RETRY_SECONDS = int(os.getenv("BACKGROUND_LEADER_RETRY_SECONDS", "30"))
+
+_leader_lock = FileLock(BACKGROUND_LOCK_PATH)
+
+
+def _try_lead() -> bool:
+    if BACKGROUND_TASKS in ("on", "1", "true"):
+        return True
+    os.makedirs(os.path.dirname(BACKGROUND_LOCK_PATH), exist_ok=True)
+    return _leader_lock.acquire(blocking=False)
+
+
+async def run_singleton_tasks(tasks: List[Callable[[], Awaitable[None]]]) -> None:
+    """Дождаться роли ведущего воркера и запустить задачи (корутинные функции без аргументов)."""
+    if BACKGROUND_TASKS in ("off", "0", "false"):
+        return
+    while True:
+        try:
+            if _try_lead():
+                break
+        except OSError as e:
+            logger.warning("Не удалось взять блокировку фоновых задач %s: %s", BACKGROUND_LOCK_PATH, e)
+        await asyncio.sleep(BACKGROUND_LEADER_RETRY_SECONDS)
+    logger.info("Воркер %s запускает singleton-задачи: %s", os.getpid(), ", ".join(t.__name__ for t in tasks))
+    for task in tasks:
+        asyncio.create_task(task())
+
+
+def release_leadership() -> None:
+    """Отдать блокировку при остановке — другой воркер подхватит задачи, не дожидаясь выхода процесса."""
+    _leader_lock.release()
@@ -0,0 +1,68 @@
+"""
+Кэш в памяти процесса с TTL
+Используется для горячих данных, которые дорого пересчитывать на каждый запрос.
+У каждого воркера свой экземпляр, поэтому TTL задаёт и предел рассинхронизации между воркерами.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Словарь с временем жизни записей и LRU-вытеснением при превышении maxsize.
+
+    ttl — сколько запись считается свежей; stale_ttl — сколько ещё после этого её можно
+    отдавать как устаревшую (stale-while-revalidate), пока идёт пересчёт.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000, stale_ttl: float = 0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def get_entry(self, key) -> Optional[Tuple[Any, float]]:
+        """(значение, возраст в секундах) или None, если записи нет или она старше ttl + stale_ttl."""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        age = time.monotonic() - item[0]
+        if age > self.ttl + self.stale_ttl:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item[1], age
+
+    def get(self, key, default=None):
+        """Только свежее значение."""
+        entry = self.get_entry(key)
+        if entry is None or entry[1] > self.ttl:
+            return default
+        return entry[0]
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def age(self, key) -> Optional[float]:
+        item = self._data.get(key)
+        return None if item is None else time.monotonic() - item[0]
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        for key in [k for k in self._data if predicate(k)]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        self._data.clear()
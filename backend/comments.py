@@ -0,0 +1,176 @@
+"""
+Ветки комментариев
+Ответ хранит parent_id, root_id (корневой комментарий ветки; у корня NULL), depth и path —
+материализованный путь из id предков и своего id (см. COMMENT_PATH_WIDTH в database.py).
+Поддерево комментария — диапазон path по индексу (root_id, path), поэтому ветка любого размера
+читается страницами без рекурсивных запросов. reply_count — число ответов во всём поддереве,
+увеличивается у всех предков одним UPDATE по id из path.
+Та же схема у group_post_comments (комментарии к постам групп) — функции принимают таблицу
+параметром table (одна из COMMENT_TABLES).
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import COMMENT_PATH_WIDTH
+
+# Глубже ответы не вкладываются: ответ на комментарий глубины COMMENT_MAX_DEPTH
+# становится ответом его предка на этой глубине
+COMMENT_MAX_DEPTH = int(os.getenv("COMMENT_MAX_DEPTH", "6"))
+THREAD_REPLIES_MAX = 20
+COMMENT_TABLES = ("post_comments", "group_post_comments")
+
+_COLUMNS = """c.id, c.post_id, c.user_id, u.username, u.avatar_url, c.content, c.created_at,
+              c.parent_id, c.depth, c.reply_count, c.path"""
+_FIELDS = ["id", "post_id", "user_id", "username", "avatar_url", "content", "created_at",
+           "parent_id", "depth", "reply_count", "path"]
+
+
+def comment_path(ancestors: List[int], comment_id: int) -> str:
+    return ".".join(str(i).zfill(COMMENT_PATH_WIDTH) for i in ancestors + [comment_id])
+
+
+def _rows(db_type: str, rows) -> List[Dict[str, Any]]:
+    if db_type == 'postgresql':
+        return [dict(r) for r in rows]
+    return [dict(zip(_FIELDS, r)) for r in rows]
+
+
+async def insert_comment(
+    conn, db_type: str, post_id: int, user_id: int, content: str, parent_id: Optional[int],
+    table: str = "post_comments",
+) -> Tuple[int, Optional[int], int]:
+    """Вставить комментарий или ответ (внутри транзакции вызывающего).
+    Результат: (id, parent_id, depth) — как сохранено: ответ глубже COMMENT_MAX_DEPTH
+    прикрепляется к предку на предельной глубине, а не к запрошенному parent_id.
+    LookupError — parent_id не найден среди комментариев этого поста."""
+    ancestors: List[int] = []
+    if parent_id:
+        if db_type == 'postgresql':
+            parent_path = await conn.fetchval(
+                f"SELECT path FROM {table} WHERE id = $1 AND post_id = $2", parent_id, post_id
+            )
+        else:
+            async with conn.execute(
+                f"SELECT path FROM {table} WHERE id = ? AND post_id = ?", (parent_id, post_id)
+            ) as cur:
+                r = await cur.fetchone()
+                parent_path = r[0] if r else None
+        if parent_path is None:
+            raise LookupError(parent_id)
+        ancestors = [int(x) for x in parent_path.split(".")][:COMMENT_MAX_DEPTH]
+    parent = ancestors[-1] if ancestors else None
+    root = ancestors[0] if ancestors else None
+    if db_type == 'postgresql':
+        cid = await conn.fetchval(
+            f"""INSERT INTO {table} (post_id, user_id, content, parent_id, root_id, depth)
+               VALUES ($1, $2, $3, $4, $5, $6) RETURNING id""",
+            post_id, user_id, content, parent, root, len(ancestors)
+        )
+        await conn.execute(f"UPDATE {table} SET path = $1 WHERE id = $2", comment_path(ancestors, cid), cid)
+        if ancestors:
+            await conn.execute(
+                f"UPDATE {table} SET reply_count = reply_count + 1 WHERE id = ANY($1::int[])", ancestors
+            )
+    else:
+        cur = await conn.execute(
+            f"""INSERT INTO {table} (post_id, user_id, content, parent_id, root_id, depth)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (post_id, user_id, content, parent, root, len(ancestors))
+        )
+        cid = cur.lastrowid
+        await conn.execute(f"UPDATE {table} SET path = ? WHERE id = ?", (comment_path(ancestors, cid), cid))
+        if ancestors:
+            await conn.execute(
+                f"UPDATE {table} SET reply_count = reply_count + 1 WHERE id IN ({','.join('?' * len(ancestors))})",
+                ancestors
+            )
+    return cid, parent, len(ancestors)
+
+
+async def load_threads(
+    conn, db_type: str, post_id: int, after_id: int, limit: int, replies: int,
+    table: str = "post_comments",
+) -> Tuple[List[dict], bool]:
+    """Страница корневых комментариев (по id) и первые replies ответов каждой ветки в порядке
+    обхода дерева — два запроса на страницу. Второй элемент — есть ли следующая страница."""
+    if db_type == 'postgresql':
+        roots = _rows(db_type, await conn.fetch(
+            f"""SELECT {_COLUMNS} FROM {table} c JOIN users u ON u.id = c.user_id
+                WHERE c.post_id = $1 AND c.root_id IS NULL AND c.id > $2 ORDER BY c.id LIMIT $3""",
+            post_id, after_id, limit + 1
+        ))
+    else:
+        async with conn.execute(
+            f"""SELECT {_COLUMNS} FROM {table} c JOIN users u ON u.id = c.user_id
+                WHERE c.post_id = ? AND c.root_id IS NULL AND c.id > ? ORDER BY c.id LIMIT ?""",
+            (post_id, after_id, limit + 1)
+        ) as cur:
+            roots = _rows(db_type, await cur.fetchall())
+    has_more = len(roots) > limit
+    roots = roots[:limit]
+    with_replies = [r["id"] for r in roots if r["reply_count"]]
+    children: Dict[int, List[dict]] = {rid: [] for rid in with_replies}
+    if with_replies and replies:
+        # По replies строк на ветку через индекс (root_id, path), а не вся ветка целиком
+        if db_type == 'postgresql':
+            rows = _rows(db_type, await conn.fetch(
+                f"""SELECT r.id AS thread_id, {_COLUMNS}
+                    FROM unnest($1::int[]) AS r(id)
+                    CROSS JOIN LATERAL (
+                        SELECT * FROM {table} x WHERE x.root_id = r.id ORDER BY x.path LIMIT $2
+                    ) c
+                    JOIN users u ON u.id = c.user_id
+                    ORDER BY c.path""",
+                with_replies, replies
+            ))
+        else:
+            picks = " UNION ALL ".join(
+                [f"SELECT * FROM (SELECT id FROM {table} WHERE root_id = ? ORDER BY path LIMIT ?)"] * len(with_replies)
+            )
+            params = [p for rid in with_replies for p in (rid, replies)]
+            async with conn.execute(
+                f"""SELECT {_COLUMNS}, c.root_id FROM {table} c JOIN users u ON u.id = c.user_id
+                    WHERE c.id IN ({picks}) ORDER BY c.path""",
+                params
+            ) as cur:
+                rows = [dict(zip(_FIELDS + ["thread_id"], r)) for r in await cur.fetchall()]
+        for r in rows:
+            children[r.pop("thread_id")].append(r)
+    for root in roots:
+        root["replies"] = children.get(root["id"], [])
+    return roots, has_more
+
+
+async def load_replies(
+    conn, db_type: str, comment_id: int, after_path: Optional[str], limit: int,
+    table: str = "post_comments", post_id: Optional[int] = None,
+) -> Tuple[List[dict], bool]:
+    """Страница поддерева комментария в порядке обхода в глубину, начиная после after_path.
+    LookupError — комментария нет (или он не к посту post_id, если тот указан)."""
+    if db_type == 'postgresql':
+        row = await conn.fetchrow(f"SELECT id, root_id, path, post_id FROM {table} WHERE id = $1", comment_id)
+        row = (row["id"], row["root_id"], row["path"], row["post_id"]) if row else None
+    else:
+        async with conn.execute(f"SELECT id, root_id, path, post_id FROM {table} WHERE id = ?", (comment_id,)) as cur:
+            row = await cur.fetchone()
+    if row is None or (post_id is not None and row[3] != post_id):
+        raise LookupError(comment_id)
+    cid, root_id, path, _ = row
+    root_id = root_id or cid
+    # Поддерево — path от "<path>." до "<path>/" ('/' следует за '.' в ASCII; в PostgreSQL path — COLLATE "C")
+    low = max(path + ".", after_path) if after_path else path + "."
+    high = path + "/"
+    if db_type == 'postgresql':
+        rows = _rows(db_type, await conn.fetch(
+            f"""SELECT {_COLUMNS} FROM {table} c JOIN users u ON u.id = c.user_id
+                WHERE c.root_id = $1 AND c.path > $2 AND c.path < $3 ORDER BY c.path LIMIT $4""",
+            root_id, low, high, limit + 1
+        ))
+    else:
+        async with conn.execute(
+            f"""SELECT {_COLUMNS} FROM {table} c JOIN users u ON u.id = c.user_id
+                WHERE c.root_id = ? AND c.path > ? AND c.path < ? ORDER BY c.path LIMIT ?""",
+            (root_id, low, high, limit + 1)
+        ) as cur:
+            rows = _rows(db_type, await cur.fetchall())
+    return rows[:limit], len(rows) > limit
@@ -3,6 +3,8 @@
 Поддерживает PostgreSQL (продакшн) и SQLite (разработка)
 """
 import os
+import re
+import json
 import logging
 from pathlib import Path
 from typing import Optional, AsyncGenerator
@@ -31,6 +33,89 @@ _postgres_pool: Optional[asyncpg.Pool] = None
 _sqlite_path: Optional[str] = None
 _db_type: Optional[str] = None
 
+# Счётчики для админской статистики (таблица stats_counters), поддерживаются триггерами.
+# name -> (таблица, условие для PostgreSQL, условие для SQLite); {r} — строка (NEW / OLD / алиас)
+STATS_COUNTERS = {
+    "users_total": ("users", "TRUE", "1"),
+    "users_banned": ("users", "{r}.is_banned", "{r}.is_banned = 1"),
+    "users_admin": ("users", "{r}.is_admin", "{r}.is_admin = 1"),
+    "users_communities": ("users", "{r}.community_name IS NOT NULL AND {r}.community_name <> ''",
+                          "{r}.community_name IS NOT NULL AND {r}.community_name <> ''"),
+    "posts_total": ("posts", "TRUE", "1"),
+    "messages_total": ("messages", "TRUE", "1"),
+    "friendships_accepted": ("friendships", "{r}.status = 'accepted'", "{r}.status = 'accepted'"),
+    "notifications_total": ("notifications", "TRUE", "1"),
+    "notifications_unread": ("notifications", "NOT {r}.is_read", "{r}.is_read = 0"),
+}
+# PostgreSQL: триггеры пишут приращения не в строку stats_counters (на ней выстраивались бы все
+# параллельные вставки постов / сообщений / уведомлений), а в один из STATS_COUNTER_SHARDS слотов
+# stats_counter_shards — по pid бэкенда. Значение счётчика = stats_counters.value + сумма слотов.
+STATS_COUNTER_SHARDS = 16
+STATS_COUNTER_VALUE_PG = (
+    "c.value + COALESCE((SELECT SUM(s.value) FROM stats_counter_shards s WHERE s.name = c.name), 0)"
+)
+# Колонки, при изменении которых счётчик таблицы может сдвинуться (триггер на UPDATE OF ...)
+STATS_UPDATE_COLUMNS = {
+    "users": ("is_banned", "is_admin", "community_name"),
+    "friendships": ("status",),
+    "notifications": ("is_read",),
+}
+
+# Очередь жалоб: вес жалобы по причине (после report_reason_key). Приоритет цели — сумма весов
+# жалоб от разных пользователей; неизвестная причина весит REPORT_DEFAULT_WEIGHT.
+REPORT_REASON_WEIGHTS = {
+    "спам": 1, "spam": 1,
+    "оскорбление": 3, "травля": 3, "harassment": 3, "abuse": 3,
+    "мошенничество": 4, "fraud": 4, "scam": 4,
+    "насилие": 5, "violence": 5,
+    "незаконный контент": 8, "illegal": 8,
+}
+REPORT_DEFAULT_WEIGHT = 1
+REPORT_REASON_MAX_LEN = 64
+
+
+def report_reason_key(reason: Optional[str]) -> str:
+    """Причина жалобы для гистограммы: нижний регистр, без лишних пробелов, не длиннее REPORT_REASON_MAX_LEN."""
+    key = " ".join((reason or "").lower().split())[:REPORT_REASON_MAX_LEN]
+    return key or "other"
+
+
+def report_weight(reason_key: str) -> int:
+    return REPORT_REASON_WEIGHTS.get(reason_key, REPORT_DEFAULT_WEIGHT)
+
+# Превью комментариев в posts.comments_preview: COMMENTS_PREVIEW_SIZE последних, текст обрезан.
+# Имя и аватар автора в превью не хранятся — их подставляют из users при чтении ленты
+COMMENTS_PREVIEW_SIZE = 3
+COMMENT_PREVIEW_CHARS = 200
+
+
+def build_comments_preview(rows) -> str:
+    """JSON для posts.comments_preview из строк (id, user_id, content, created_at), новые первыми."""
+    return json.dumps([
+        {
+            "id": r[0], "user_id": r[1],
+            "content": (r[2] or "")[:COMMENT_PREVIEW_CHARS],
+            "created_at": r[3].isoformat() if hasattr(r[3], "isoformat") else r[3],
+        }
+        for r in rows[:COMMENTS_PREVIEW_SIZE]
+    ], ensure_ascii=False)
+
+# Ветки комментариев: path — id предков и самого комментария через «.», каждый дополнен нулями
+# до COMMENT_PATH_WIDTH знаков, поэтому сортировка по path даёт обход дерева в глубину
+COMMENT_PATH_WIDTH = 10
+
+# slug группы = slug_base или slug_base-slug_suffix; следующий свободный номер для имени —
+# MAX(slug_suffix) по индексу (slug_base, slug_suffix). Основа обрезается, чтобы с номером
+# slug влезал в VARCHAR(100)
+GROUP_SLUG_BASE_MAX = 90
+_SLUG_SUFFIX_RE = re.compile(r"^(.+)-(\d{1,9})$")
+
+
+def split_group_slug(slug: str):
+    """(slug_base, slug_suffix) существующего slug; без числового хвоста — (slug, 0)."""
+    m = _SLUG_SUFFIX_RE.match(slug)
+    return (m.group(1), int(m.group(2))) if m else (slug, 0)
+
 
 def get_db_type() -> str:
     """Определяет тип БД для использования"""
@@ -199,207 +284,398 @@ def convert_sql_to_sqlite(sql: str) -> str:
 
 
 async def init_db():
-    """Инициализация базы данных - создание таблиц"""
-    db_type = get_db_type()
-    
-    async with get_db() as conn:
-        if db_type == 'postgresql':
-            # PostgreSQL таблицы
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    avatar_url VARCHAR(1024) NULL,
-                    cover_photo VARCHAR(1024) NULL,
-                    theme_mode VARCHAR(20) DEFAULT 'light',
-                    theme_palette VARCHAR(50) DEFAULT 'blue',
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    is_banned BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS status_checks (
-                    id VARCHAR(36) PRIMARY KEY,
-                    client_name VARCHAR(255) NOT NULL,
-                    timestamp TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS friendships (
-                    id SERIAL PRIMARY KEY,
-                    requester_id INTEGER NOT NULL,
-                    addressee_id INTEGER NOT NULL,
-                    status VARCHAR(50) NOT NULL DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW(),
-                    UNIQUE(requester_id, addressee_id),
-                    FOREIGN KEY (requester_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (addressee_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id SERIAL PRIMARY KEY,
-                    is_group BOOLEAN NOT NULL DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversation_participants (
-                    conversation_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    joined_at TIMESTAMP DEFAULT NOW(),
-                    PRIMARY KEY (conversation_id, user_id),
-                    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id SERIAL PRIMARY KEY,
-                    conversation_id INTEGER NOT NULL,
-                    sender_id INTEGER NOT NULL,
-                    content TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
-                    FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            """)
-            
-            # Таблица уведомлений
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    type VARCHAR(50) NOT NULL,
-                    actor_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                    target_id INTEGER,
-                    target_type VARCHAR(50),
-                    content TEXT,
-                    is_read BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            # Индексы PostgreSQL
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_friendships_status ON friendships(status)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_created ON messages(conversation_id, created_at)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_status_checks_timestamp ON status_checks(timestamp)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications(user_id, is_read)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_at)")
-            
-            # Таблица постов
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS posts (
-                    id SERIAL PRIMARY KEY,
-                    author_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    content TEXT NOT NULL,
-                    images TEXT DEFAULT '[]',
-                    likes_count INTEGER DEFAULT 0,
-                    comments_count INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            
-            # Таблица лайков постов
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS post_likes (
-                    id SERIAL PRIMARY KEY,
-                    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    UNIQUE(post_id, user_id)
-                )
-            """)
-            # Таблица комментариев к постам
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS post_comments (
-                    id SERIAL PRIMARY KEY,
-                    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    content TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_post ON post_comments(post_id)")
-            
-            # Дополнительные поля пользователя
-            try:
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bio TEXT")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS location VARCHAR(255)")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS birth_date VARCHAR(50)")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS cover_photo VARCHAR(1024)")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(50)")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS work_hours VARCHAR(255)")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_accent VARCHAR(50)")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS community_name VARCHAR(255)")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS community_description TEXT")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN DEFAULT FALSE")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_banned BOOLEAN DEFAULT FALSE")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP NULL")
-                # Основа для подтверждения почты: после реализации — отправлять письмо и ставить email_verified_at при переходе по ссылке
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email_verified_at TIMESTAMP NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email_verification_token VARCHAR(255) NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email_verification_sent_at TIMESTAMP NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_official BOOLEAN DEFAULT FALSE")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_moderator BOOLEAN DEFAULT FALSE")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_verified_at TIMESTAMP NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_chat_id BIGINT NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_verification_token VARCHAR(64) NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_token_created_at TIMESTAMP NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token VARCHAR(64) NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token_created_at TIMESTAMP NULL")
-            except Exception:
-                pass
-
-            # Устройства безопасности: список доверенных устройств/сессий, можно отзывать
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_devices (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    name VARCHAR(255) NOT NULL DEFAULT 'Устройство',
-                    user_agent TEXT NULL,
-                    last_used_at TIMESTAMP DEFAULT NOW(),
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """)
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_devices_user ON user_devices(user_id)")
+    """Привести схему БД к актуальной версии: выполнить недостающие шаги migrations.MIGRATIONS
+    (если схема актуальна — один запрос)."""
+    from migrations import migrate
+    await migrate()
 
-            # Таблицы для системы рекомендаций: теги и подписки
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS tags (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(100) UNIQUE NOT NULL
-                )
-            """)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS post_tags (
-                    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
-                    tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
-                    PRIMARY KEY (post_id, tag_id)
-                )
-            """)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_tag_subscriptions (
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    PRIMARY KEY (user_id, tag_id)
-                )
-            """)
 
-            # Жалобы
+async def baseline_schema(conn, db_type: str):
+    """Шаг 1 версионированных миграций: исходная схема и все миграции, накопленные до версий.
+    Идемпотентен (IF NOT EXISTS, отметки в applied_migrations) — приводит к версии 1 и пустую, и старую БД."""
+    if db_type == 'postgresql':
+        # PostgreSQL таблицы
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                email VARCHAR(255) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                avatar_url VARCHAR(1024) NULL,
+                cover_photo VARCHAR(1024) NULL,
+                theme_mode VARCHAR(20) DEFAULT 'light',
+                theme_palette VARCHAR(50) DEFAULT 'blue',
+                is_admin BOOLEAN DEFAULT FALSE,
+                is_banned BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT NOW(),
+                updated_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS status_checks (
+                id VARCHAR(36) PRIMARY KEY,
+                client_name VARCHAR(255) NOT NULL,
+                timestamp TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS friendships (
+                id SERIAL PRIMARY KEY,
+                requester_id INTEGER NOT NULL,
+                addressee_id INTEGER NOT NULL,
+                status VARCHAR(50) NOT NULL DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT NOW(),
+                updated_at TIMESTAMP DEFAULT NOW(),
+                UNIQUE(requester_id, addressee_id),
+                FOREIGN KEY (requester_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (addressee_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id SERIAL PRIMARY KEY,
+                is_group BOOLEAN NOT NULL DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_participants (
+                conversation_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                joined_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (conversation_id, user_id),
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id SERIAL PRIMARY KEY,
+                conversation_id INTEGER NOT NULL,
+                sender_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW(),
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
+                FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Таблица уведомлений
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS notifications (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                type VARCHAR(50) NOT NULL,
+                actor_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                target_id INTEGER,
+                target_type VARCHAR(50),
+                content TEXT,
+                is_read BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        # Индексы PostgreSQL
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_friendships_status ON friendships(status)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_created ON messages(conversation_id, created_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_status_checks_timestamp ON status_checks(timestamp)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications(user_id, is_read)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_at)")
+        
+        # Таблица постов
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id SERIAL PRIMARY KEY,
+                author_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                content TEXT NOT NULL,
+                images TEXT DEFAULT '[]',
+                likes_count INTEGER DEFAULT 0,
+                comments_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        # Таблица лайков постов
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_likes (
+                id SERIAL PRIMARY KEY,
+                post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT NOW(),
+                UNIQUE(post_id, user_id)
+            )
+        """)
+        # Таблица комментариев к постам
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_comments (
+                id SERIAL PRIMARY KEY,
+                post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_post ON post_comments(post_id)")
+        
+        # Дополнительные поля пользователя
+        try:
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bio TEXT")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS location VARCHAR(255)")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS birth_date VARCHAR(50)")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS cover_photo VARCHAR(1024)")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(50)")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS work_hours VARCHAR(255)")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_accent VARCHAR(50)")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS community_name VARCHAR(255)")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS community_description TEXT")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN DEFAULT FALSE")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_banned BOOLEAN DEFAULT FALSE")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP NULL")
+            # Основа для подтверждения почты: после реализации — отправлять письмо и ставить email_verified_at при переходе по ссылке
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email_verified_at TIMESTAMP NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email_verification_token VARCHAR(255) NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email_verification_sent_at TIMESTAMP NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_official BOOLEAN DEFAULT FALSE")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_moderator BOOLEAN DEFAULT FALSE")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_verified_at TIMESTAMP NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_chat_id BIGINT NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_verification_token VARCHAR(64) NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_token_created_at TIMESTAMP NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token VARCHAR(64) NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token_created_at TIMESTAMP NULL")
+        except Exception:
+            pass
+
+        # Устройства безопасности: список доверенных устройств/сессий, можно отзывать
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_devices (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                name VARCHAR(255) NOT NULL DEFAULT 'Устройство',
+                user_agent TEXT NULL,
+                last_used_at TIMESTAMP DEFAULT NOW(),
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_devices_user ON user_devices(user_id)")
+
+        # Таблицы для системы рекомендаций: теги и подписки
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS tags (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) UNIQUE NOT NULL
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_tags (
+                post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+                tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+                PRIMARY KEY (post_id, tag_id)
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_tag_subscriptions (
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (user_id, tag_id)
+            )
+        """)
+
+        # Жалобы
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id SERIAL PRIMARY KEY,
+                reporter_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                target_type VARCHAR(20) NOT NULL DEFAULT 'post',
+                target_id INTEGER NOT NULL,
+                reason TEXT,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                reviewed_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                reviewed_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+
+        # История банов
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS ban_history (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                admin_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                action VARCHAR(20) NOT NULL DEFAULT 'ban',
+                reason TEXT,
+                expires_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+
+        # Группы/сообщества
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS groups (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                slug VARCHAR(100) UNIQUE NOT NULL,
+                description TEXT,
+                avatar_url TEXT,
+                cover_url TEXT,
+                is_private BOOLEAN NOT NULL DEFAULT FALSE,
+                owner_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS group_members (
+                group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                role VARCHAR(20) NOT NULL DEFAULT 'member',
+                joined_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (group_id, user_id)
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS group_join_requests (
+                id SERIAL PRIMARY KEY,
+                group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT NOW(),
+                UNIQUE (group_id, user_id)
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS group_posts (
+                id SERIAL PRIMARY KEY,
+                group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+                author_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                content TEXT,
+                media_url TEXT,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+
+        # Индексы для постов
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_author ON posts(author_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_created ON posts(created_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_post ON post_likes(post_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_user ON post_likes(user_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_post ON post_tags(post_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags(tag_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_user ON user_tag_subscriptions(user_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_tag ON user_tag_subscriptions(tag_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_joined ON group_members(group_id, joined_at, user_id) INCLUDE (role)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_posts_feed ON group_posts(group_id, created_at, id)")
+        
+        # Триггеры для updated_at
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION update_updated_at_column()
+            RETURNS TRIGGER AS $$
+            BEGIN
+                NEW.updated_at = NOW();
+                RETURN NEW;
+            END;
+            $$ language 'plpgsql';
+        """)
+        
+        await conn.execute("""
+            DROP TRIGGER IF EXISTS update_users_updated_at ON users;
+            CREATE TRIGGER update_users_updated_at
+            BEFORE UPDATE ON users
+            FOR EACH ROW
+            EXECUTE FUNCTION update_updated_at_column();
+        """)
+        
+        await conn.execute("""
+            DROP TRIGGER IF EXISTS update_friendships_updated_at ON friendships;
+            CREATE TRIGGER update_friendships_updated_at
+            BEFORE UPDATE ON friendships
+            FOR EACH ROW
+            EXECUTE FUNCTION update_updated_at_column();
+        """)
+
+        await conn.execute("CREATE TABLE IF NOT EXISTS applied_migrations (name TEXT PRIMARY KEY)")
+        # Одноразовая миграция: выдать админку пользователю durov (hohol@hsahdshd.rf)
+        done_admin = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "admin_durov")
+        if done_admin is None:
+            await conn.execute(
+                "UPDATE users SET is_admin = TRUE WHERE username = $1 AND email = $2",
+                "durov", "hohol@hsahdshd.rf"
+            )
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "admin_durov")
+            logger.info("Миграция admin_durov: is_admin=true для durov (hohol@hsahdshd.rf)")
+
+        # avatar_url и cover_photo — TEXT (base64/длинные URL не влезают в VARCHAR(1024))
+        done2 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "avatar_cover_to_text")
+        if done2 is None:
+            await conn.execute("ALTER TABLE users ALTER COLUMN avatar_url TYPE TEXT")
+            await conn.execute("ALTER TABLE users ALTER COLUMN cover_photo TYPE TEXT")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "avatar_cover_to_text")
+            logger.info("Миграция avatar_cover_to_text применена: avatar_url, cover_photo — TEXT")
+
+        # Приватность: скрытие телефона и почты в профиле
+        done3 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "privacy_hide_phone_email")
+        if done3 is None:
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS hide_phone BOOLEAN DEFAULT FALSE")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS hide_email BOOLEAN DEFAULT FALSE")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "privacy_hide_phone_email")
+            logger.info("Миграция privacy_hide_phone_email применена: hide_phone, hide_email")
+
+        # Голосовые сообщения в чатах
+        done4 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "messages_voice_url")
+        if done4 is None:
+            await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS voice_url TEXT")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "messages_voice_url")
+            logger.info("Миграция messages_voice_url применена")
+
+        # Длительность голосовых и транскрипция
+        done5 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "messages_voice_duration_transcription")
+        if done5 is None:
+            await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS voice_duration_seconds REAL")
+            await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS voice_transcription TEXT")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "messages_voice_duration_transcription")
+            logger.info("Миграция messages_voice_duration_transcription применена")
+
+        # Приветствие в пустом чате (настраивается в настройках → Чат)
+        done6 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "chat_welcome_settings")
+        if done6 is None:
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS chat_welcome_text TEXT")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS chat_welcome_media_url TEXT")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "chat_welcome_settings")
+            logger.info("Миграция chat_welcome_settings применена")
+
+        # IP в устройствах (для отображения в настройках)
+        done7 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "user_devices_last_ip")
+        if done7 is None:
+            await conn.execute("ALTER TABLE user_devices ADD COLUMN IF NOT EXISTS last_ip VARCHAR(45)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "user_devices_last_ip")
+            logger.info("Миграция user_devices_last_ip применена")
+
+        # Доставлено / прочитано в ЛС (как в Telegram)
+        done8 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "messages_delivered_read")
+        if done8 is None:
+            await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMP")
+            await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS read_at TIMESTAMP")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "messages_delivered_read")
+            logger.info("Миграция messages_delivered_read применена")
+
+        # pending_token для верификации без JWT
+        done9 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "users_pending_token")
+        if done9 is None:
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token VARCHAR(64) NULL")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token_created_at TIMESTAMP NULL")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "users_pending_token")
+            logger.info("Миграция users_pending_token применена")
+
+        # Жалобы, история банов, группы
+        done10 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "reports_ban_groups")
+        if done10 is None:
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS reports (
                     id SERIAL PRIMARY KEY,
@@ -413,8 +689,6 @@ async def init_db():
                     created_at TIMESTAMP DEFAULT NOW()
                 )
             """)
-
-            # История банов
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS ban_history (
                     id SERIAL PRIMARY KEY,
@@ -426,8 +700,6 @@ async def init_db():
                     created_at TIMESTAMP DEFAULT NOW()
                 )
             """)
-
-            # Группы/сообщества
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS groups (
                     id SERIAL PRIMARY KEY,
@@ -470,601 +742,1135 @@ async def init_db():
                     created_at TIMESTAMP DEFAULT NOW()
                 )
             """)
-
-            # Индексы для постов
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_author ON posts(author_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_created ON posts(created_at)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_post ON post_likes(post_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_user ON post_likes(user_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_post ON post_tags(post_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags(tag_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_user ON user_tag_subscriptions(user_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_tag ON user_tag_subscriptions(tag_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_group ON group_members(group_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_posts_group ON group_posts(group_id)")
-            
-            # Триггеры для updated_at
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_joined ON group_members(group_id, joined_at, user_id) INCLUDE (role)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_posts_feed ON group_posts(group_id, created_at, id)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "reports_ban_groups")
+            logger.info("Миграция reports_ban_groups применена")
+        # Полнотекстовый поиск по постам и постам групп (русская и английская конфигурации)
+        done11 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "posts_fulltext")
+        if not done11:
+            for table in ("posts", "group_posts"):
+                await conn.execute(f"""
+                    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_tsv tsvector
+                    GENERATED ALWAYS AS (
+                        setweight(to_tsvector('russian', COALESCE(content, '')), 'A') ||
+                        setweight(to_tsvector('english', COALESCE(content, '')), 'B')
+                    ) STORED
+                """)
+                await conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_search ON {table} USING GIN(search_tsv)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "posts_fulltext")
+            logger.info("Миграция posts_fulltext применена")
+        # Поиск по сообщениям: индекс по выражению (без перезаписи большой таблицы) + keyset по id
+        done12 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "messages_fulltext")
+        if not done12:
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN(to_tsvector('russian', content))")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_id ON messages(conversation_id, id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_participants_user ON conversation_participants(user_id, conversation_id)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "messages_fulltext")
+            logger.info("Миграция messages_fulltext применена")
+        # Выборка активных пользователей (планировщик рекомендаций)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen)")
+        # Симметричные рёбра дружбы: две строки на пару, поддерживаются триггером на friendships
+        done13 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "friend_edges")
+        if not done13:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS friend_edges (
+                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    friend_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    since TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (user_id, friend_id)
+                )
+            """)
             await conn.execute("""
-                CREATE OR REPLACE FUNCTION update_updated_at_column()
-                RETURNS TRIGGER AS $$
+                CREATE OR REPLACE FUNCTION sync_friend_edges() RETURNS trigger AS $$
                 BEGIN
-                    NEW.updated_at = NOW();
-                    RETURN NEW;
+                    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.status <> 'accepted') THEN
+                        DELETE FROM friend_edges
+                        WHERE (user_id = OLD.requester_id AND friend_id = OLD.addressee_id)
+                           OR (user_id = OLD.addressee_id AND friend_id = OLD.requester_id);
+                    END IF;
+                    IF TG_OP <> 'DELETE' AND NEW.status = 'accepted' THEN
+                        INSERT INTO friend_edges (user_id, friend_id, since)
+                        VALUES (NEW.requester_id, NEW.addressee_id, NOW()), (NEW.addressee_id, NEW.requester_id, NOW())
+                        ON CONFLICT DO NOTHING;
+                    END IF;
+                    RETURN NULL;
                 END;
-                $$ language 'plpgsql';
+                $$ LANGUAGE plpgsql
             """)
-            
+            await conn.execute("DROP TRIGGER IF EXISTS friendships_friend_edges ON friendships")
             await conn.execute("""
-                DROP TRIGGER IF EXISTS update_users_updated_at ON users;
-                CREATE TRIGGER update_users_updated_at
-                BEFORE UPDATE ON users
-                FOR EACH ROW
-                EXECUTE FUNCTION update_updated_at_column();
+                CREATE TRIGGER friendships_friend_edges
+                AFTER INSERT OR UPDATE OF status OR DELETE ON friendships
+                FOR EACH ROW EXECUTE FUNCTION sync_friend_edges()
             """)
-            
             await conn.execute("""
-                DROP TRIGGER IF EXISTS update_friendships_updated_at ON friendships;
-                CREATE TRIGGER update_friendships_updated_at
-                BEFORE UPDATE ON friendships
-                FOR EACH ROW
-                EXECUTE FUNCTION update_updated_at_column();
+                INSERT INTO friend_edges (user_id, friend_id, since)
+                SELECT requester_id, addressee_id, COALESCE(updated_at, created_at, NOW()) FROM friendships WHERE status = 'accepted'
+                UNION ALL
+                SELECT addressee_id, requester_id, COALESCE(updated_at, created_at, NOW()) FROM friendships WHERE status = 'accepted'
+                ON CONFLICT DO NOTHING
             """)
-
-            await conn.execute("CREATE TABLE IF NOT EXISTS applied_migrations (name TEXT PRIMARY KEY)")
-            # Одноразовая миграция: выдать админку пользователю durov (hohol@hsahdshd.rf)
-            done_admin = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "admin_durov")
-            if done_admin is None:
-                await conn.execute(
-                    "UPDATE users SET is_admin = TRUE WHERE username = $1 AND email = $2",
-                    "durov", "hohol@hsahdshd.rf"
-                )
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "admin_durov")
-                logger.info("Миграция admin_durov: is_admin=true для durov (hohol@hsahdshd.rf)")
-
-            # avatar_url и cover_photo — TEXT (base64/длинные URL не влезают в VARCHAR(1024))
-            done2 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "avatar_cover_to_text")
-            if done2 is None:
-                await conn.execute("ALTER TABLE users ALTER COLUMN avatar_url TYPE TEXT")
-                await conn.execute("ALTER TABLE users ALTER COLUMN cover_photo TYPE TEXT")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "avatar_cover_to_text")
-                logger.info("Миграция avatar_cover_to_text применена: avatar_url, cover_photo — TEXT")
-
-            # Приватность: скрытие телефона и почты в профиле
-            done3 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "privacy_hide_phone_email")
-            if done3 is None:
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS hide_phone BOOLEAN DEFAULT FALSE")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS hide_email BOOLEAN DEFAULT FALSE")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "privacy_hide_phone_email")
-                logger.info("Миграция privacy_hide_phone_email применена: hide_phone, hide_email")
-
-            # Голосовые сообщения в чатах
-            done4 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "messages_voice_url")
-            if done4 is None:
-                await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS voice_url TEXT")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "messages_voice_url")
-                logger.info("Миграция messages_voice_url применена")
-
-            # Длительность голосовых и транскрипция
-            done5 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "messages_voice_duration_transcription")
-            if done5 is None:
-                await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS voice_duration_seconds REAL")
-                await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS voice_transcription TEXT")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "messages_voice_duration_transcription")
-                logger.info("Миграция messages_voice_duration_transcription применена")
-
-            # Приветствие в пустом чате (настраивается в настройках → Чат)
-            done6 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "chat_welcome_settings")
-            if done6 is None:
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS chat_welcome_text TEXT")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS chat_welcome_media_url TEXT")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "chat_welcome_settings")
-                logger.info("Миграция chat_welcome_settings применена")
-
-            # IP в устройствах (для отображения в настройках)
-            done7 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "user_devices_last_ip")
-            if done7 is None:
-                await conn.execute("ALTER TABLE user_devices ADD COLUMN IF NOT EXISTS last_ip VARCHAR(45)")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "user_devices_last_ip")
-                logger.info("Миграция user_devices_last_ip применена")
-
-            # Доставлено / прочитано в ЛС (как в Telegram)
-            done8 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "messages_delivered_read")
-            if done8 is None:
-                await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMP")
-                await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS read_at TIMESTAMP")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "messages_delivered_read")
-                logger.info("Миграция messages_delivered_read применена")
-
-            # pending_token для верификации без JWT
-            done9 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "users_pending_token")
-            if done9 is None:
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token VARCHAR(64) NULL")
-                await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_token_created_at TIMESTAMP NULL")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "users_pending_token")
-                logger.info("Миграция users_pending_token применена")
-
-            # Жалобы, история банов, группы
-            done10 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "reports_ban_groups")
-            if done10 is None:
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS reports (
-                        id SERIAL PRIMARY KEY,
-                        reporter_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        target_type VARCHAR(20) NOT NULL DEFAULT 'post',
-                        target_id INTEGER NOT NULL,
-                        reason TEXT,
-                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
-                        reviewed_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
-                        reviewed_at TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    )
-                """)
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS ban_history (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        admin_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
-                        action VARCHAR(20) NOT NULL DEFAULT 'ban',
-                        reason TEXT,
-                        expires_at TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    )
-                """)
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS groups (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR(255) NOT NULL,
-                        slug VARCHAR(100) UNIQUE NOT NULL,
-                        description TEXT,
-                        avatar_url TEXT,
-                        cover_url TEXT,
-                        is_private BOOLEAN NOT NULL DEFAULT FALSE,
-                        owner_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    )
-                """)
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS group_members (
-                        group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
-                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        role VARCHAR(20) NOT NULL DEFAULT 'member',
-                        joined_at TIMESTAMP DEFAULT NOW(),
-                        PRIMARY KEY (group_id, user_id)
-                    )
-                """)
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS group_join_requests (
-                        id SERIAL PRIMARY KEY,
-                        group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
-                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
-                        created_at TIMESTAMP DEFAULT NOW(),
-                        UNIQUE (group_id, user_id)
-                    )
-                """)
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS group_posts (
-                        id SERIAL PRIMARY KEY,
-                        group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
-                        author_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        content TEXT,
-                        media_url TEXT,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    )
-                """)
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_group ON group_members(group_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_posts_group ON group_posts(group_id)")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "reports_ban_groups")
-                logger.info("Миграция reports_ban_groups применена")
-
-        else:  # SQLite
-            # SQLite таблицы
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "friend_edges")
+            logger.info("Миграция friend_edges применена")
+        # Статистика админки: счётчики на триггерах и дневные бакеты
+        done14 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "stats_rollups")
+        if not done14:
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    avatar_url VARCHAR(1024) NULL,
-                    cover_photo VARCHAR(1024) NULL,
-                    bio TEXT NULL,
-                    location VARCHAR(255) NULL,
-                    birth_date VARCHAR(50) NULL,
-                    theme_mode VARCHAR(20) DEFAULT 'light',
-                    theme_palette VARCHAR(50) DEFAULT 'blue',
-                    is_admin BOOLEAN DEFAULT 0,
-                    is_banned BOOLEAN DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    name VARCHAR(64) PRIMARY KEY,
+                    value BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT NOW()
                 )
             """)
-            
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS status_checks (
-                    id VARCHAR(36) PRIMARY KEY,
-                    client_name VARCHAR(255) NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS stats_daily (
+                    day DATE NOT NULL,
+                    metric VARCHAR(32) NOT NULL,
+                    value BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, metric)
                 )
             """)
-            
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at)")
+            await _create_stats_counters(conn, 'postgresql')
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "stats_rollups")
+            logger.info("Миграция stats_rollups применена")
+        # Очередь жалоб: одна строка на цель, повторная жалоба того же пользователя не пишется
+        done15 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "report_targets")
+        if not done15:
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS friendships (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    requester_id INTEGER NOT NULL,
-                    addressee_id INTEGER NOT NULL,
-                    status VARCHAR(50) NOT NULL DEFAULT 'pending',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(requester_id, addressee_id),
-                    FOREIGN KEY (requester_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (addressee_id) REFERENCES users(id) ON DELETE CASCADE
+                CREATE TABLE IF NOT EXISTS report_targets (
+                    id SERIAL PRIMARY KEY,
+                    target_type VARCHAR(20) NOT NULL,
+                    target_id INTEGER NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                    reporters_count INTEGER NOT NULL DEFAULT 0,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    first_reported_at TIMESTAMP,
+                    last_reported_at TIMESTAMP,
+                    reviewed_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                    reviewed_at TIMESTAMP,
+                    UNIQUE (target_type, target_id)
                 )
             """)
-            
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    is_group BOOLEAN NOT NULL DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS report_target_reasons (
+                    report_target_id INTEGER NOT NULL REFERENCES report_targets(id) ON DELETE CASCADE,
+                    reason VARCHAR(64) NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (report_target_id, reason)
                 )
             """)
-            
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_report_targets_queue ON report_targets(status, priority, id)")
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversation_participants (
-                    conversation_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (conversation_id, user_id),
-                    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                DELETE FROM reports WHERE id NOT IN (
+                    SELECT MIN(id) FROM reports GROUP BY reporter_id, target_type, target_id
                 )
             """)
-            
+            await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_reporter_target ON reports(reporter_id, target_type, target_id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_reporter_created ON reports(reporter_id, created_at)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_target ON reports(target_type, target_id)")
+            await _backfill_report_targets(conn, 'postgresql')
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "report_targets")
+            logger.info("Миграция report_targets применена")
+        # Превью последних комментариев в posts — лента встраивает его без отдельного запроса
+        done16 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "comments_preview")
+        if not done16:
+            await conn.execute("ALTER TABLE posts ADD COLUMN IF NOT EXISTS comments_preview TEXT")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_post_id ON post_comments(post_id, id)")
+            await _backfill_comments_preview(conn, 'postgresql')
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "comments_preview")
+            logger.info("Миграция comments_preview применена")
+        # Ответы на комментарии: материализованный путь, корень ветки, глубина, число ответов в поддереве
+        done17 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "comment_threads")
+        if not done17:
+            await conn.execute("ALTER TABLE post_comments ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES post_comments(id) ON DELETE CASCADE")
+            await conn.execute("ALTER TABLE post_comments ADD COLUMN IF NOT EXISTS root_id INTEGER")
+            await conn.execute("ALTER TABLE post_comments ADD COLUMN IF NOT EXISTS depth INTEGER NOT NULL DEFAULT 0")
+            # COLLATE "C": диапазон поддерева в comments.load_replies опирается на порядок байтов ('.' < '/')
+            await conn.execute('ALTER TABLE post_comments ADD COLUMN IF NOT EXISTS path TEXT COLLATE "C"')
+            await conn.execute("ALTER TABLE post_comments ADD COLUMN IF NOT EXISTS reply_count INTEGER NOT NULL DEFAULT 0")
+            await conn.execute(f"UPDATE post_comments SET path = lpad(id::text, {COMMENT_PATH_WIDTH}, '0') WHERE path IS NULL")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_roots ON post_comments(post_id, root_id, id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_thread ON post_comments(root_id, path)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "comment_threads")
+            logger.info("Миграция comment_threads применена")
+        # Число участников группы хранится в groups (обновляют эндпоинты вступления / выхода)
+        done18 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "groups_members_count")
+        if not done18:
+            await conn.execute("ALTER TABLE groups ADD COLUMN IF NOT EXISTS members_count INTEGER NOT NULL DEFAULT 0")
+            await conn.execute("UPDATE groups g SET members_count = (SELECT COUNT(*) FROM group_members gm WHERE gm.group_id = g.id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_created ON groups(created_at)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "groups_members_count")
+            logger.info("Миграция groups_members_count применена")
+        # Лайки и комментарии (с ветками, как у post_comments) к постам групп
+        done19 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "group_post_engagement")
+        if not done19:
+            await conn.execute("ALTER TABLE group_posts ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0")
+            await conn.execute("ALTER TABLE group_posts ADD COLUMN IF NOT EXISTS comments_count INTEGER NOT NULL DEFAULT 0")
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    conversation_id INTEGER NOT NULL,
-                    sender_id INTEGER NOT NULL,
-                    content TEXT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
-                    FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE
+                CREATE TABLE IF NOT EXISTS group_post_likes (
+                    id SERIAL PRIMARY KEY,
+                    post_id INTEGER NOT NULL REFERENCES group_posts(id) ON DELETE CASCADE,
+                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    UNIQUE(post_id, user_id)
                 )
             """)
-            
-            # Таблица постов SQLite
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS posts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    author_id INTEGER NOT NULL,
+                CREATE TABLE IF NOT EXISTS group_post_comments (
+                    id SERIAL PRIMARY KEY,
+                    post_id INTEGER NOT NULL REFERENCES group_posts(id) ON DELETE CASCADE,
+                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
                     content TEXT NOT NULL,
-                    images TEXT DEFAULT '[]',
-                    likes_count INTEGER DEFAULT 0,
-                    comments_count INTEGER DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE CASCADE
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    parent_id INTEGER REFERENCES group_post_comments(id) ON DELETE CASCADE,
+                    root_id INTEGER,
+                    depth INTEGER NOT NULL DEFAULT 0,
+                    path TEXT COLLATE "C",
+                    reply_count INTEGER NOT NULL DEFAULT 0
                 )
             """)
-            
-            # Таблица лайков постов SQLite
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_post_likes_user ON group_post_likes(user_id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_post_comments_roots ON group_post_comments(post_id, root_id, id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_post_comments_thread ON group_post_comments(root_id, path)")
+            await conn.execute("DROP INDEX IF EXISTS idx_group_posts_group")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "group_post_engagement")
+            logger.info("Миграция group_post_engagement применена")
+        # Список участников группы страницами: индексы (group_id, joined_at, ...) вместо (group_id)
+        done20 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "group_members_paging")
+        if not done20:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_group_members_role ON group_members(group_id, role, joined_at, user_id)"
+            )
+            await conn.execute("DROP INDEX IF EXISTS idx_group_members_group")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "group_members_paging")
+            logger.info("Миграция group_members_paging применена")
+        # Подбор свободного slug группы одним запросом к индексу (slug_base, slug_suffix)
+        done21 = await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", "group_slug_parts")
+        if not done21:
+            await conn.execute("ALTER TABLE groups ADD COLUMN IF NOT EXISTS slug_base VARCHAR(100)")
+            await conn.execute("ALTER TABLE groups ADD COLUMN IF NOT EXISTS slug_suffix INTEGER NOT NULL DEFAULT 0")
+            await _backfill_group_slug_parts(conn, 'postgresql')
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_slug_base ON groups(slug_base, slug_suffix)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", "group_slug_parts")
+            logger.info("Миграция group_slug_parts применена")
+        # Keyset-пагинация админских списков
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_status_created ON reports(status, created_at, id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ban_history_user_created ON ban_history(user_id, created_at, id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ban_history_created ON ban_history(created_at, id)")
+        # Временные ряды активности: resolution — 60 (минута) или 3600 (час), bucket — начало в epoch
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS metrics_series (
+                resolution INTEGER NOT NULL,
+                metric VARCHAR(32) NOT NULL,
+                bucket BIGINT NOT NULL,
+                value BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (resolution, metric, bucket)
+            )
+        """)
+
+    else:  # SQLite
+        # SQLite таблицы
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                email VARCHAR(255) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                avatar_url VARCHAR(1024) NULL,
+                cover_photo VARCHAR(1024) NULL,
+                bio TEXT NULL,
+                location VARCHAR(255) NULL,
+                birth_date VARCHAR(50) NULL,
+                theme_mode VARCHAR(20) DEFAULT 'light',
+                theme_palette VARCHAR(50) DEFAULT 'blue',
+                is_admin BOOLEAN DEFAULT 0,
+                is_banned BOOLEAN DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS status_checks (
+                id VARCHAR(36) PRIMARY KEY,
+                client_name VARCHAR(255) NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS friendships (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                requester_id INTEGER NOT NULL,
+                addressee_id INTEGER NOT NULL,
+                status VARCHAR(50) NOT NULL DEFAULT 'pending',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(requester_id, addressee_id),
+                FOREIGN KEY (requester_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (addressee_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                is_group BOOLEAN NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_participants (
+                conversation_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (conversation_id, user_id),
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id INTEGER NOT NULL,
+                sender_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
+                FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Таблица постов SQLite
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                author_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                images TEXT DEFAULT '[]',
+                likes_count INTEGER DEFAULT 0,
+                comments_count INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Таблица лайков постов SQLite
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_likes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                post_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(post_id, user_id),
+                FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        # Таблица комментариев к постам SQLite
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_comments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                post_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_post ON post_comments(post_id)")
+        
+        # Миграция: добавляем недостающие колонки в users (для существующих БД)
+        try:
+            async with conn.execute("PRAGMA table_info(users)") as cursor:
+                columns = [row[1] for row in await cursor.fetchall()]
+            if 'bio' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN bio TEXT NULL")
+            if 'location' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN location VARCHAR(255) NULL")
+            if 'birth_date' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN birth_date VARCHAR(50) NULL")
+            if 'cover_photo' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN cover_photo VARCHAR(1024) NULL")
+            if 'phone' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN phone VARCHAR(50) NULL")
+            if 'work_hours' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN work_hours VARCHAR(255) NULL")
+            if 'profile_accent' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN profile_accent VARCHAR(50) NULL")
+            if 'community_name' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN community_name VARCHAR(255) NULL")
+            if 'community_description' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN community_description TEXT NULL")
+            if 'is_admin' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0")
+            if 'is_banned' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN is_banned BOOLEAN DEFAULT 0")
+            if 'last_seen' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN last_seen DATETIME NULL")
+            # Основа для подтверждения почты
+            if 'email_verified_at' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN email_verified_at DATETIME NULL")
+            if 'email_verification_token' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN email_verification_token VARCHAR(255) NULL")
+            if 'email_verification_sent_at' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN email_verification_sent_at DATETIME NULL")
+            if 'hide_phone' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN hide_phone BOOLEAN DEFAULT 0")
+            if 'hide_email' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN hide_email BOOLEAN DEFAULT 0")
+            if 'is_official' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN is_official BOOLEAN DEFAULT 0")
+            if 'is_moderator' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN is_moderator BOOLEAN DEFAULT 0")
+            if 'telegram_verified_at' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN telegram_verified_at DATETIME NULL")
+            if 'telegram_chat_id' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN telegram_chat_id INTEGER NULL")
+            if 'telegram_verification_token' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN telegram_verification_token VARCHAR(64) NULL")
+            if 'telegram_token_created_at' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN telegram_token_created_at DATETIME NULL")
+            if 'pending_token' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN pending_token VARCHAR(64) NULL")
+            if 'pending_token_created_at' not in columns:
+                await conn.execute("ALTER TABLE users ADD COLUMN pending_token_created_at DATETIME NULL")
+        except Exception as e:
+            logger.warning(f"Миграция колонок users: {e}")
+
+        # Устройства безопасности (SQLite)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_devices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name VARCHAR(255) NOT NULL DEFAULT 'Устройство',
+                user_agent TEXT NULL,
+                last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_devices_user ON user_devices(user_id)")
+        
+        # Таблица уведомлений SQLite
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                type VARCHAR(50) NOT NULL,
+                actor_id INTEGER,
+                target_id INTEGER,
+                target_type VARCHAR(50),
+                content TEXT,
+                is_read BOOLEAN DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (actor_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Миграция: голосовые сообщения в чатах (SQLite)
+        try:
+            async with conn.execute("PRAGMA table_info(messages)") as cursor:
+                msg_cols = [row[1] for row in await cursor.fetchall()]
+            if 'voice_url' not in msg_cols:
+                await conn.execute("ALTER TABLE messages ADD COLUMN voice_url TEXT NULL")
+                await conn.commit()
+                logger.info("Миграция SQLite: messages.voice_url добавлена")
+            if 'voice_duration_seconds' not in msg_cols:
+                await conn.execute("ALTER TABLE messages ADD COLUMN voice_duration_seconds REAL NULL")
+                await conn.commit()
+            if 'voice_transcription' not in msg_cols:
+                await conn.execute("ALTER TABLE messages ADD COLUMN voice_transcription TEXT NULL")
+                await conn.commit()
+            if 'delivered_at' not in msg_cols:
+                await conn.execute("ALTER TABLE messages ADD COLUMN delivered_at DATETIME NULL")
+                await conn.commit()
+            if 'read_at' not in msg_cols:
+                await conn.execute("ALTER TABLE messages ADD COLUMN read_at DATETIME NULL")
+                await conn.commit()
+        except Exception as e:
+            logger.warning(f"Миграция messages (SQLite): {e}")
+
+        # Индексы SQLite
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_friendships_status ON friendships(status)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_created ON messages(conversation_id, created_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_status_checks_timestamp ON status_checks(timestamp)")
+        # Таблицы для системы рекомендаций: теги и подписки (SQLite)
+        # Миграция: пересоздать post_tags/user_tag_subscriptions, если схема старая (нет tag_id)
+        try:
+            async with conn.execute("PRAGMA table_info(post_tags)") as cursor:
+                cols = [row[1] for row in await cursor.fetchall()]
+            if cols and 'tag_id' not in cols:
+                await conn.execute("DROP TABLE IF EXISTS post_tags")
+                await conn.execute("DROP TABLE IF EXISTS user_tag_subscriptions")
+        except Exception:
+            pass
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name VARCHAR(100) UNIQUE NOT NULL
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_tags (
+                post_id INTEGER NOT NULL,
+                tag_id INTEGER NOT NULL,
+                PRIMARY KEY (post_id, tag_id),
+                FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
+                FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_tag_subscriptions (
+                user_id INTEGER NOT NULL,
+                tag_id INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, tag_id),
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+            )
+        """)
+
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_author ON posts(author_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_created ON posts(created_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_post ON post_likes(post_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_user ON post_likes(user_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_post ON post_tags(post_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags(tag_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_user ON user_tag_subscriptions(user_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_tag ON user_tag_subscriptions(tag_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications(user_id, is_read)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_at)")
+
+        # Жалобы (SQLite)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                reporter_id INTEGER NOT NULL,
+                target_type VARCHAR(20) NOT NULL DEFAULT 'post',
+                target_id INTEGER NOT NULL,
+                reason TEXT,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                reviewed_by INTEGER,
+                reviewed_at DATETIME,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (reporter_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+
+        # История банов (SQLite)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS ban_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                admin_id INTEGER,
+                action VARCHAR(20) NOT NULL DEFAULT 'ban',
+                reason TEXT,
+                expires_at DATETIME,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+
+        # Группы (SQLite)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name VARCHAR(255) NOT NULL,
+                slug VARCHAR(100) UNIQUE NOT NULL,
+                description TEXT,
+                avatar_url TEXT,
+                cover_url TEXT,
+                is_private INTEGER NOT NULL DEFAULT 0,
+                owner_id INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS group_members (
+                group_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                role VARCHAR(20) NOT NULL DEFAULT 'member',
+                joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (group_id, user_id),
+                FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS group_join_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (group_id, user_id),
+                FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS group_posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id INTEGER NOT NULL,
+                author_id INTEGER NOT NULL,
+                content TEXT,
+                media_url TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+                FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_joined ON group_members(group_id, joined_at, user_id, role)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_posts_feed ON group_posts(group_id, created_at, id)")
+
+        await conn.execute("CREATE TABLE IF NOT EXISTS applied_migrations (name TEXT PRIMARY KEY)")
+
+        # Одноразовая миграция: выдать админку пользователю durov (hohol@hsahdshd.rf)
+        async with conn.execute(
+            "SELECT 1 FROM applied_migrations WHERE name = ?", ("admin_durov",)
+        ) as cur:
+            done_admin = await cur.fetchone()
+        if done_admin is None:
+            await conn.execute(
+                "UPDATE users SET is_admin = 1 WHERE username = ? AND email = ?",
+                ("durov", "hohol@hsahdshd.rf")
+            )
+            await conn.execute(
+                "INSERT INTO applied_migrations (name) VALUES (?)", ("admin_durov",)
+            )
+            logger.info("Миграция admin_durov: is_admin=true для durov (hohol@hsahdshd.rf)")
+        # Приветствие в пустом чате (SQLite не поддерживает ADD COLUMN IF NOT EXISTS)
+        async with conn.execute(
+            "SELECT 1 FROM applied_migrations WHERE name = ?", ("chat_welcome_settings",)
+        ) as cur:
+            done_chat = await cur.fetchone()
+        if done_chat is None:
+            async with conn.execute("PRAGMA table_info(users)") as cur:
+                cols = [r[1] for r in await cur.fetchall()]
+            if "chat_welcome_text" not in cols:
+                await conn.execute("ALTER TABLE users ADD COLUMN chat_welcome_text TEXT")
+            if "chat_welcome_media_url" not in cols:
+                await conn.execute("ALTER TABLE users ADD COLUMN chat_welcome_media_url TEXT")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("chat_welcome_settings",))
+            logger.info("Миграция chat_welcome_settings применена")
+        # IP в устройствах
+        async with conn.execute(
+            "SELECT 1 FROM applied_migrations WHERE name = ?", ("user_devices_last_ip",)
+        ) as cur:
+            done_ip = await cur.fetchone()
+        if done_ip is None:
+            async with conn.execute("PRAGMA table_info(user_devices)") as cur:
+                cols = [r[1] for r in await cur.fetchall()]
+            if "last_ip" not in cols:
+                await conn.execute("ALTER TABLE user_devices ADD COLUMN last_ip VARCHAR(45)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("user_devices_last_ip",))
+            logger.info("Миграция user_devices_last_ip применена")
+        # Полнотекстовый поиск: FTS5 external-content таблицы, синхронизируемые триггерами
+        async with conn.execute(
+            "SELECT 1 FROM applied_migrations WHERE name = ?", ("posts_fulltext",)
+        ) as cur:
+            done_fts = await cur.fetchone()
+        if done_fts is None:
+            try:
+                for table in ("posts", "group_posts"):
+                    await _create_sqlite_fts(conn, table)
+                await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("posts_fulltext",))
+                logger.info("Миграция posts_fulltext применена")
+            except Exception as e:
+                logger.warning(f"FTS5 недоступен, поиск по постам будет работать через LIKE: {e}")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen)")
+        async with conn.execute(
+            "SELECT 1 FROM applied_migrations WHERE name = ?", ("messages_fulltext",)
+        ) as cur:
+            done_msg_fts = await cur.fetchone()
+        if done_msg_fts is None:
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_id ON messages(conversation_id, id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_participants_user ON conversation_participants(user_id, conversation_id)")
+            try:
+                await _create_sqlite_fts(conn, "messages")
+                await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("messages_fulltext",))
+                logger.info("Миграция messages_fulltext применена")
+            except Exception as e:
+                logger.warning(f"FTS5 недоступен, поиск по сообщениям будет работать через LIKE: {e}")
+        async with conn.execute(
+            "SELECT 1 FROM applied_migrations WHERE name = ?", ("friend_edges",)
+        ) as cur:
+            done_edges = await cur.fetchone()
+        if done_edges is None:
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS post_likes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    post_id INTEGER NOT NULL,
+                CREATE TABLE IF NOT EXISTS friend_edges (
                     user_id INTEGER NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(post_id, user_id),
-                    FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
+                    friend_id INTEGER NOT NULL,
+                    since DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, friend_id),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                    FOREIGN KEY (friend_id) REFERENCES users(id) ON DELETE CASCADE
+                ) WITHOUT ROWID
             """)
-            # Таблица комментариев к постам SQLite
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS post_comments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    post_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    content TEXT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
+                CREATE TRIGGER IF NOT EXISTS friendships_edges_ai AFTER INSERT ON friendships
+                WHEN NEW.status = 'accepted' BEGIN
+                    INSERT OR IGNORE INTO friend_edges (user_id, friend_id) VALUES (NEW.requester_id, NEW.addressee_id);
+                    INSERT OR IGNORE INTO friend_edges (user_id, friend_id) VALUES (NEW.addressee_id, NEW.requester_id);
+                END
             """)
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_post ON post_comments(post_id)")
-            
-            # Миграция: добавляем недостающие колонки в users (для существующих БД)
-            try:
-                async with conn.execute("PRAGMA table_info(users)") as cursor:
-                    columns = [row[1] for row in await cursor.fetchall()]
-                if 'bio' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN bio TEXT NULL")
-                if 'location' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN location VARCHAR(255) NULL")
-                if 'birth_date' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN birth_date VARCHAR(50) NULL")
-                if 'cover_photo' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN cover_photo VARCHAR(1024) NULL")
-                if 'phone' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN phone VARCHAR(50) NULL")
-                if 'work_hours' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN work_hours VARCHAR(255) NULL")
-                if 'profile_accent' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN profile_accent VARCHAR(50) NULL")
-                if 'community_name' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN community_name VARCHAR(255) NULL")
-                if 'community_description' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN community_description TEXT NULL")
-                if 'is_admin' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0")
-                if 'is_banned' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN is_banned BOOLEAN DEFAULT 0")
-                if 'last_seen' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN last_seen DATETIME NULL")
-                # Основа для подтверждения почты
-                if 'email_verified_at' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN email_verified_at DATETIME NULL")
-                if 'email_verification_token' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN email_verification_token VARCHAR(255) NULL")
-                if 'email_verification_sent_at' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN email_verification_sent_at DATETIME NULL")
-                if 'hide_phone' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN hide_phone BOOLEAN DEFAULT 0")
-                if 'hide_email' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN hide_email BOOLEAN DEFAULT 0")
-                if 'is_official' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN is_official BOOLEAN DEFAULT 0")
-                if 'is_moderator' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN is_moderator BOOLEAN DEFAULT 0")
-                if 'telegram_verified_at' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN telegram_verified_at DATETIME NULL")
-                if 'telegram_chat_id' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN telegram_chat_id INTEGER NULL")
-                if 'telegram_verification_token' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN telegram_verification_token VARCHAR(64) NULL")
-                if 'telegram_token_created_at' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN telegram_token_created_at DATETIME NULL")
-                if 'pending_token' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN pending_token VARCHAR(64) NULL")
-                if 'pending_token_created_at' not in columns:
-                    await conn.execute("ALTER TABLE users ADD COLUMN pending_token_created_at DATETIME NULL")
-            except Exception as e:
-                logger.warning(f"Миграция колонок users: {e}")
-
-            # Устройства безопасности (SQLite)
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_devices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    name VARCHAR(255) NOT NULL DEFAULT 'Устройство',
-                    user_agent TEXT NULL,
-                    last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
+                CREATE TRIGGER IF NOT EXISTS friendships_edges_au AFTER UPDATE OF status ON friendships BEGIN
+                    DELETE FROM friend_edges WHERE NEW.status <> 'accepted'
+                        AND ((user_id = OLD.requester_id AND friend_id = OLD.addressee_id)
+                          OR (user_id = OLD.addressee_id AND friend_id = OLD.requester_id));
+                    INSERT OR IGNORE INTO friend_edges (user_id, friend_id)
+                        SELECT NEW.requester_id, NEW.addressee_id WHERE NEW.status = 'accepted';
+                    INSERT OR IGNORE INTO friend_edges (user_id, friend_id)
+                        SELECT NEW.addressee_id, NEW.requester_id WHERE NEW.status = 'accepted';
+                END
             """)
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_devices_user ON user_devices(user_id)")
-            
-            # Таблица уведомлений SQLite
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    type VARCHAR(50) NOT NULL,
-                    actor_id INTEGER,
-                    target_id INTEGER,
-                    target_type VARCHAR(50),
-                    content TEXT,
-                    is_read BOOLEAN DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (actor_id) REFERENCES users(id) ON DELETE CASCADE
-                )
+                CREATE TRIGGER IF NOT EXISTS friendships_edges_ad AFTER DELETE ON friendships BEGIN
+                    DELETE FROM friend_edges
+                    WHERE (user_id = OLD.requester_id AND friend_id = OLD.addressee_id)
+                       OR (user_id = OLD.addressee_id AND friend_id = OLD.requester_id);
+                END
             """)
-            
-            # Миграция: голосовые сообщения в чатах (SQLite)
-            try:
-                async with conn.execute("PRAGMA table_info(messages)") as cursor:
-                    msg_cols = [row[1] for row in await cursor.fetchall()]
-                if 'voice_url' not in msg_cols:
-                    await conn.execute("ALTER TABLE messages ADD COLUMN voice_url TEXT NULL")
-                    await conn.commit()
-                    logger.info("Миграция SQLite: messages.voice_url добавлена")
-                if 'voice_duration_seconds' not in msg_cols:
-                    await conn.execute("ALTER TABLE messages ADD COLUMN voice_duration_seconds REAL NULL")
-                    await conn.commit()
-                if 'voice_transcription' not in msg_cols:
-                    await conn.execute("ALTER TABLE messages ADD COLUMN voice_transcription TEXT NULL")
-                    await conn.commit()
-                if 'delivered_at' not in msg_cols:
-                    await conn.execute("ALTER TABLE messages ADD COLUMN delivered_at DATETIME NULL")
-                    await conn.commit()
-                if 'read_at' not in msg_cols:
-                    await conn.execute("ALTER TABLE messages ADD COLUMN read_at DATETIME NULL")
-                    await conn.commit()
-            except Exception as e:
-                logger.warning(f"Миграция messages (SQLite): {e}")
-
-            # Индексы SQLite
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_friendships_status ON friendships(status)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_created ON messages(conversation_id, created_at)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_status_checks_timestamp ON status_checks(timestamp)")
-            # Таблицы для системы рекомендаций: теги и подписки (SQLite)
-            # Миграция: пересоздать post_tags/user_tag_subscriptions, если схема старая (нет tag_id)
-            try:
-                async with conn.execute("PRAGMA table_info(post_tags)") as cursor:
-                    cols = [row[1] for row in await cursor.fetchall()]
-                if cols and 'tag_id' not in cols:
-                    await conn.execute("DROP TABLE IF EXISTS post_tags")
-                    await conn.execute("DROP TABLE IF EXISTS user_tag_subscriptions")
-            except Exception:
-                pass
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS tags (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name VARCHAR(100) UNIQUE NOT NULL
-                )
+                INSERT OR IGNORE INTO friend_edges (user_id, friend_id, since)
+                SELECT requester_id, addressee_id, COALESCE(updated_at, created_at, CURRENT_TIMESTAMP) FROM friendships WHERE status = 'accepted'
+                UNION ALL
+                SELECT addressee_id, requester_id, COALESCE(updated_at, created_at, CURRENT_TIMESTAMP) FROM friendships WHERE status = 'accepted'
             """)
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("friend_edges",))
+            logger.info("Миграция friend_edges применена")
+        async with conn.execute(
+            "SELECT 1 FROM applied_migrations WHERE name = ?", ("stats_rollups",)
+        ) as cur:
+            done_stats = await cur.fetchone()
+        if done_stats is None:
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS post_tags (
-                    post_id INTEGER NOT NULL,
-                    tag_id INTEGER NOT NULL,
-                    PRIMARY KEY (post_id, tag_id),
-                    FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
-                    FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    name VARCHAR(64) PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_tag_subscriptions (
-                    user_id INTEGER NOT NULL,
-                    tag_id INTEGER NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (user_id, tag_id),
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
-                )
+                CREATE TABLE IF NOT EXISTS stats_daily (
+                    day TEXT NOT NULL,
+                    metric VARCHAR(32) NOT NULL,
+                    value INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, metric)
+                ) WITHOUT ROWID
             """)
-
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_author ON posts(author_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_created ON posts(created_at)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_post ON post_likes(post_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_likes_user ON post_likes(user_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_post ON post_tags(post_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags(tag_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_user ON user_tag_subscriptions(user_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tag_subscriptions_tag ON user_tag_subscriptions(tag_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications(user_id, is_read)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_at)")
-
-            # Жалобы (SQLite)
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at)")
+            await _create_stats_counters(conn, 'sqlite')
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("stats_rollups",))
+            logger.info("Миграция stats_rollups применена")
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", ("report_targets",)) as cur:
+            done_reports = await cur.fetchone()
+        if done_reports is None:
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS reports (
+                CREATE TABLE IF NOT EXISTS report_targets (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    reporter_id INTEGER NOT NULL,
-                    target_type VARCHAR(20) NOT NULL DEFAULT 'post',
+                    target_type VARCHAR(20) NOT NULL,
                     target_id INTEGER NOT NULL,
-                    reason TEXT,
                     status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                    reporters_count INTEGER NOT NULL DEFAULT 0,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    first_reported_at DATETIME,
+                    last_reported_at DATETIME,
                     reviewed_by INTEGER,
                     reviewed_at DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (reporter_id) REFERENCES users(id) ON DELETE CASCADE
+                    UNIQUE (target_type, target_id),
+                    FOREIGN KEY (reviewed_by) REFERENCES users(id) ON DELETE SET NULL
                 )
             """)
-
-            # История банов (SQLite)
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS ban_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    admin_id INTEGER,
-                    action VARCHAR(20) NOT NULL DEFAULT 'ban',
-                    reason TEXT,
-                    expires_at DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
+                CREATE TABLE IF NOT EXISTS report_target_reasons (
+                    report_target_id INTEGER NOT NULL,
+                    reason VARCHAR(64) NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (report_target_id, reason),
+                    FOREIGN KEY (report_target_id) REFERENCES report_targets(id) ON DELETE CASCADE
+                ) WITHOUT ROWID
             """)
-
-            # Группы (SQLite)
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_report_targets_queue ON report_targets(status, priority, id)")
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS groups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name VARCHAR(255) NOT NULL,
-                    slug VARCHAR(100) UNIQUE NOT NULL,
-                    description TEXT,
-                    avatar_url TEXT,
-                    cover_url TEXT,
-                    is_private INTEGER NOT NULL DEFAULT 0,
-                    owner_id INTEGER NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE CASCADE
+                DELETE FROM reports WHERE id NOT IN (
+                    SELECT MIN(id) FROM reports GROUP BY reporter_id, target_type, target_id
                 )
             """)
+            await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_reporter_target ON reports(reporter_id, target_type, target_id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_reporter_created ON reports(reporter_id, created_at)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_target ON reports(target_type, target_id)")
+            await _backfill_report_targets(conn, 'sqlite')
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("report_targets",))
+            logger.info("Миграция report_targets применена")
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", ("comments_preview",)) as cur:
+            done_preview = await cur.fetchone()
+        if done_preview is None:
+            async with conn.execute("PRAGMA table_info(posts)") as cur:
+                cols = [r[1] for r in await cur.fetchall()]
+            if "comments_preview" not in cols:
+                await conn.execute("ALTER TABLE posts ADD COLUMN comments_preview TEXT")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_post_id ON post_comments(post_id, id)")
+            await _backfill_comments_preview(conn, 'sqlite')
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("comments_preview",))
+            logger.info("Миграция comments_preview применена")
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", ("comment_threads",)) as cur:
+            done_threads = await cur.fetchone()
+        if done_threads is None:
+            async with conn.execute("PRAGMA table_info(post_comments)") as cur:
+                cols = [r[1] for r in await cur.fetchall()]
+            if "parent_id" not in cols:
+                await conn.execute("ALTER TABLE post_comments ADD COLUMN parent_id INTEGER REFERENCES post_comments(id) ON DELETE CASCADE")
+            if "root_id" not in cols:
+                await conn.execute("ALTER TABLE post_comments ADD COLUMN root_id INTEGER")
+            if "depth" not in cols:
+                await conn.execute("ALTER TABLE post_comments ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+            if "path" not in cols:
+                await conn.execute("ALTER TABLE post_comments ADD COLUMN path TEXT")
+            if "reply_count" not in cols:
+                await conn.execute("ALTER TABLE post_comments ADD COLUMN reply_count INTEGER NOT NULL DEFAULT 0")
+            await conn.execute(
+                f"UPDATE post_comments SET path = substr('{'0' * COMMENT_PATH_WIDTH}' || id, -{COMMENT_PATH_WIDTH}) WHERE path IS NULL"
+            )
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_roots ON post_comments(post_id, root_id, id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_post_comments_thread ON post_comments(root_id, path)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("comment_threads",))
+            logger.info("Миграция comment_threads применена")
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", ("groups_members_count",)) as cur:
+            done_members = await cur.fetchone()
+        if done_members is None:
+            async with conn.execute("PRAGMA table_info(groups)") as cur:
+                cols = [r[1] for r in await cur.fetchall()]
+            if "members_count" not in cols:
+                await conn.execute("ALTER TABLE groups ADD COLUMN members_count INTEGER NOT NULL DEFAULT 0")
+            await conn.execute("UPDATE groups SET members_count = (SELECT COUNT(*) FROM group_members gm WHERE gm.group_id = groups.id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_created ON groups(created_at)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("groups_members_count",))
+            logger.info("Миграция groups_members_count применена")
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", ("group_post_engagement",)) as cur:
+            done_gp_engagement = await cur.fetchone()
+        if done_gp_engagement is None:
+            async with conn.execute("PRAGMA table_info(group_posts)") as cur:
+                cols = [r[1] for r in await cur.fetchall()]
+            if "likes_count" not in cols:
+                await conn.execute("ALTER TABLE group_posts ADD COLUMN likes_count INTEGER NOT NULL DEFAULT 0")
+            if "comments_count" not in cols:
+                await conn.execute("ALTER TABLE group_posts ADD COLUMN comments_count INTEGER NOT NULL DEFAULT 0")
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS group_members (
-                    group_id INTEGER NOT NULL,
+                CREATE TABLE IF NOT EXISTS group_post_likes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    post_id INTEGER NOT NULL,
                     user_id INTEGER NOT NULL,
-                    role VARCHAR(20) NOT NULL DEFAULT 'member',
-                    joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (group_id, user_id),
-                    FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(post_id, user_id),
+                    FOREIGN KEY (post_id) REFERENCES group_posts(id) ON DELETE CASCADE,
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
                 )
             """)
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS group_join_requests (
+                CREATE TABLE IF NOT EXISTS group_post_comments (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id INTEGER NOT NULL,
+                    post_id INTEGER NOT NULL,
                     user_id INTEGER NOT NULL,
-                    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                    content TEXT NOT NULL,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE (group_id, user_id),
-                    FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+                    parent_id INTEGER REFERENCES group_post_comments(id) ON DELETE CASCADE,
+                    root_id INTEGER,
+                    depth INTEGER NOT NULL DEFAULT 0,
+                    path TEXT,
+                    reply_count INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY (post_id) REFERENCES group_posts(id) ON DELETE CASCADE,
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
                 )
             """)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS group_posts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id INTEGER NOT NULL,
-                    author_id INTEGER NOT NULL,
-                    content TEXT,
-                    media_url TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
-                    FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE CASCADE
-                )
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_post_likes_user ON group_post_likes(user_id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_post_comments_roots ON group_post_comments(post_id, root_id, id)")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_post_comments_thread ON group_post_comments(root_id, path)")
+            await conn.execute("DROP INDEX IF EXISTS idx_group_posts_group")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("group_post_engagement",))
+            logger.info("Миграция group_post_engagement применена")
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", ("group_members_paging",)) as cur:
+            done_members_paging = await cur.fetchone()
+        if done_members_paging is None:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_group_members_role ON group_members(group_id, role, joined_at, user_id)"
+            )
+            await conn.execute("DROP INDEX IF EXISTS idx_group_members_group")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("group_members_paging",))
+            logger.info("Миграция group_members_paging применена")
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", ("group_slug_parts",)) as cur:
+            done_slug_parts = await cur.fetchone()
+        if done_slug_parts is None:
+            async with conn.execute("PRAGMA table_info(groups)") as cur:
+                cols = [r[1] for r in await cur.fetchall()]
+            if "slug_base" not in cols:
+                await conn.execute("ALTER TABLE groups ADD COLUMN slug_base VARCHAR(100)")
+            if "slug_suffix" not in cols:
+                await conn.execute("ALTER TABLE groups ADD COLUMN slug_suffix INTEGER NOT NULL DEFAULT 0")
+            await _backfill_group_slug_parts(conn, 'sqlite')
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_slug_base ON groups(slug_base, slug_suffix)")
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("group_slug_parts",))
+            logger.info("Миграция group_slug_parts применена")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_status_created ON reports(status, created_at, id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ban_history_user_created ON ban_history(user_id, created_at, id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ban_history_created ON ban_history(created_at, id)")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS metrics_series (
+                resolution INTEGER NOT NULL,
+                metric VARCHAR(32) NOT NULL,
+                bucket INTEGER NOT NULL,
+                value INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (resolution, metric, bucket)
+            ) WITHOUT ROWID
+        """)
+        await conn.commit()
+
+
+async def _create_sqlite_fts(conn, table: str, column: str = "content"):
+    """Создаёт FTS5-индекс {table}_fts по колонке column, триггеры синхронизации и заполняет его."""
+    fts = f"{table}_fts"
+    await conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{column}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    await conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});
+        END
+    """)
+    await conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+        END
+    """)
+    await conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+            INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});
+        END
+    """)
+    await conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+async def _create_stats_counters(conn, db_type: str):
+    """Триггеры, поддерживающие STATS_COUNTERS, и начальные значения счётчиков точным подсчётом."""
+    if db_type == 'postgresql':
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counter_shards (
+                name VARCHAR(64) NOT NULL,
+                slot SMALLINT NOT NULL,
+                value BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (name, slot)
+            )
+        """)
+    by_table = {}
+    for name, (table, pg_cond, sqlite_cond) in STATS_COUNTERS.items():
+        by_table.setdefault(table, []).append((name, pg_cond if db_type == 'postgresql' else sqlite_cond))
+
+    for table, counters in by_table.items():
+        columns = STATS_UPDATE_COLUMNS.get(table)
+        if db_type == 'postgresql':
+            declare = "\n".join(f"d_{name} INTEGER := 0;" for name, _ in counters)
+            on_new = "\n".join(f"IF {cond.format(r='NEW')} THEN d_{name} := d_{name} + 1; END IF;" for name, cond in counters)
+            on_old = "\n".join(f"IF {cond.format(r='OLD')} THEN d_{name} := d_{name} - 1; END IF;" for name, cond in counters)
+            apply = "\n".join(
+                f"IF d_{name} <> 0 THEN INSERT INTO stats_counter_shards (name, slot, value) "
+                f"VALUES ('{name}', pg_backend_pid() % {STATS_COUNTER_SHARDS}, d_{name}) "
+                f"ON CONFLICT (name, slot) DO UPDATE SET value = stats_counter_shards.value + EXCLUDED.value; END IF;"
+                for name, _ in counters
+            )
+            await conn.execute(f"""
+                CREATE OR REPLACE FUNCTION stats_{table}_count() RETURNS trigger AS $$
+                DECLARE
+                {declare}
+                BEGIN
+                    IF TG_OP <> 'DELETE' THEN
+                        {on_new}
+                    END IF;
+                    IF TG_OP <> 'INSERT' THEN
+                        {on_old}
+                    END IF;
+                    {apply}
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
             """)
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_group ON group_members(group_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_group_posts_group ON group_posts(group_id)")
-
-            # Одноразовая миграция: выдать админку пользователю durov (hohol@hsahdshd.rf)
-            async with conn.execute(
-                "SELECT 1 FROM applied_migrations WHERE name = ?", ("admin_durov",)
-            ) as cur:
-                done_admin = await cur.fetchone()
-            if done_admin is None:
-                await conn.execute(
-                    "UPDATE users SET is_admin = 1 WHERE username = ? AND email = ?",
-                    ("durov", "hohol@hsahdshd.rf")
+            events = "INSERT OR DELETE" + (f" OR UPDATE OF {', '.join(columns)}" if columns else "")
+            await conn.execute(f"DROP TRIGGER IF EXISTS stats_{table}_count ON {table}")
+            await conn.execute(
+                f"CREATE TRIGGER stats_{table}_count AFTER {events} ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION stats_{table}_count()"
+            )
+        else:
+            inc = "\n".join(
+                f"UPDATE stats_counters SET value = value + 1, updated_at = CURRENT_TIMESTAMP "
+                f"WHERE name = '{name}' AND ({cond.format(r='NEW')});"
+                for name, cond in counters
+            )
+            dec = "\n".join(
+                f"UPDATE stats_counters SET value = value - 1, updated_at = CURRENT_TIMESTAMP "
+                f"WHERE name = '{name}' AND ({cond.format(r='OLD')});"
+                for name, cond in counters
+            )
+            await conn.execute(f"CREATE TRIGGER IF NOT EXISTS stats_{table}_ai AFTER INSERT ON {table} BEGIN\n{inc}\nEND")
+            await conn.execute(f"CREATE TRIGGER IF NOT EXISTS stats_{table}_ad AFTER DELETE ON {table} BEGIN\n{dec}\nEND")
+            if columns:
+                upd = "\n".join(
+                    f"UPDATE stats_counters SET value = value "
+                    f"+ (CASE WHEN {cond.format(r='NEW')} THEN 1 ELSE 0 END) "
+                    f"- (CASE WHEN {cond.format(r='OLD')} THEN 1 ELSE 0 END), updated_at = CURRENT_TIMESTAMP "
+                    f"WHERE name = '{name}';"
+                    for name, cond in counters
                 )
                 await conn.execute(
-                    "INSERT INTO applied_migrations (name) VALUES (?)", ("admin_durov",)
+                    f"CREATE TRIGGER IF NOT EXISTS stats_{table}_au AFTER UPDATE OF {', '.join(columns)} ON {table} "
+                    f"BEGIN\n{upd}\nEND"
                 )
-                logger.info("Миграция admin_durov: is_admin=true для durov (hohol@hsahdshd.rf)")
-            # Приветствие в пустом чате (SQLite не поддерживает ADD COLUMN IF NOT EXISTS)
-            async with conn.execute(
-                "SELECT 1 FROM applied_migrations WHERE name = ?", ("chat_welcome_settings",)
-            ) as cur:
-                done_chat = await cur.fetchone()
-            if done_chat is None:
-                async with conn.execute("PRAGMA table_info(users)") as cur:
-                    cols = [r[1] for r in await cur.fetchall()]
-                if "chat_welcome_text" not in cols:
-                    await conn.execute("ALTER TABLE users ADD COLUMN chat_welcome_text TEXT")
-                if "chat_welcome_media_url" not in cols:
-                    await conn.execute("ALTER TABLE users ADD COLUMN chat_welcome_media_url TEXT")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("chat_welcome_settings",))
-                logger.info("Миграция chat_welcome_settings применена")
-            # IP в устройствах
-            async with conn.execute(
-                "SELECT 1 FROM applied_migrations WHERE name = ?", ("user_devices_last_ip",)
-            ) as cur:
-                done_ip = await cur.fetchone()
-            if done_ip is None:
-                async with conn.execute("PRAGMA table_info(user_devices)") as cur:
-                    cols = [r[1] for r in await cur.fetchall()]
-                if "last_ip" not in cols:
-                    await conn.execute("ALTER TABLE user_devices ADD COLUMN last_ip VARCHAR(45)")
-                await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", ("user_devices_last_ip",))
-                logger.info("Миграция user_devices_last_ip применена")
-            await conn.commit()
-    
-    logger.info("База данных инициализирована")
+
+    for name, (table, pg_cond, sqlite_cond) in STATS_COUNTERS.items():
+        cond = (pg_cond if db_type == 'postgresql' else sqlite_cond).format(r="r")
+        if db_type == 'postgresql':
+            await conn.execute("DELETE FROM stats_counter_shards WHERE name = $1", name)
+            await conn.execute(
+                f"INSERT INTO stats_counters (name, value) SELECT $1, COUNT(*) FROM {table} r WHERE {cond} "
+                f"ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()",
+                name
+            )
+        else:
+            await conn.execute(
+                f"INSERT OR REPLACE INTO stats_counters (name, value) SELECT ?, COUNT(*) FROM {table} r WHERE {cond}",
+                (name,)
+            )
+
+
+async def shard_stats_counters(conn, db_type: str):
+    """Шаг миграции: перевести триггеры счётчиков PostgreSQL на stats_counter_shards (SQLite — без изменений,
+    там запись и так последовательная)."""
+    if db_type == 'postgresql':
+        await _create_stats_counters(conn, db_type)
+
+
+async def _backfill_report_targets(conn, db_type: str):
+    """Собрать report_targets и гистограммы причин из существующих жалоб (после дедупликации).
+    Группировка по (цель, причина) идёт в SQL; причины нормализуются как и при подаче жалобы."""
+    sql = """
+        SELECT target_type, target_id, reason, COUNT(*), MIN(created_at), MAX(created_at),
+               SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END), MIN(status)
+        FROM reports GROUP BY target_type, target_id, reason
+    """
+    if db_type == 'postgresql':
+        rows = [tuple(r) for r in await conn.fetch(sql)]
+    else:
+        async with conn.execute(sql) as cur:
+            rows = await cur.fetchall()
+    targets = {}
+    for target_type, target_id, reason, count, first, last, pending, min_status in rows:
+        t = targets.setdefault((target_type, target_id), {
+            "count": 0, "priority": 0, "first": first, "last": last, "pending": 0, "status": min_status, "reasons": {},
+        })
+        key = report_reason_key(reason)
+        t["count"] += count
+        t["priority"] += count * report_weight(key)
+        t["first"] = min(t["first"], first) if t["first"] and first else (t["first"] or first)
+        t["last"] = max(t["last"], last) if t["last"] and last else (t["last"] or last)
+        t["pending"] += pending
+        # Рассмотренная цель: actioned важнее dismissed (MIN по алфавиту)
+        t["status"] = min(t["status"], min_status)
+        t["reasons"][key] = t["reasons"].get(key, 0) + count
+    for (target_type, target_id), t in targets.items():
+        status = "pending" if t["pending"] else t["status"]
+        if db_type == 'postgresql':
+            rid = await conn.fetchval(
+                """INSERT INTO report_targets (target_type, target_id, status, reporters_count, priority, first_reported_at, last_reported_at)
+                   VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id""",
+                target_type, target_id, status, t["count"], t["priority"], t["first"], t["last"]
+            )
+            await conn.executemany(
+                "INSERT INTO report_target_reasons (report_target_id, reason, count) VALUES ($1, $2, $3)",
+                [(rid, key, n) for key, n in t["reasons"].items()]
+            )
+        else:
+            cur = await conn.execute(
+                """INSERT INTO report_targets (target_type, target_id, status, reporters_count, priority, first_reported_at, last_reported_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (target_type, target_id, status, t["count"], t["priority"], t["first"], t["last"])
+            )
+            await conn.executemany(
+                "INSERT INTO report_target_reasons (report_target_id, reason, count) VALUES (?, ?, ?)",
+                [(cur.lastrowid, key, n) for key, n in t["reasons"].items()]
+            )
+
+
+async def _backfill_comments_preview(conn, db_type: str):
+    """Заполнить posts.comments_preview: по COMMENTS_PREVIEW_SIZE последних комментариев каждого поста."""
+    sql = f"""
+        SELECT post_id, id, user_id, content, created_at FROM (
+            SELECT c.post_id, c.id, c.user_id, c.content, c.created_at,
+                   ROW_NUMBER() OVER (PARTITION BY c.post_id ORDER BY c.id DESC) AS rn
+            FROM post_comments c
+        ) t WHERE rn <= {COMMENTS_PREVIEW_SIZE} ORDER BY post_id, id DESC
+    """
+    if db_type == 'postgresql':
+        rows = [tuple(r) for r in await conn.fetch(sql)]
+    else:
+        async with conn.execute(sql) as cur:
+            rows = await cur.fetchall()
+    by_post = {}
+    for r in rows:
+        by_post.setdefault(r[0], []).append(r[1:])
+    updates = [(build_comments_preview(items), post_id) for post_id, items in by_post.items()]
+    if db_type == 'postgresql':
+        await conn.executemany("UPDATE posts SET comments_preview = $1 WHERE id = $2", updates)
+    else:
+        await conn.executemany("UPDATE posts SET comments_preview = ? WHERE id = ?", updates)
+
+
+async def slim_comments_preview(conn, db_type: str):
+    """Шаг миграции: пересобрать posts.comments_preview без username / avatar_url авторов."""
+    await _backfill_comments_preview(conn, db_type)
+
+
+async def comment_paths_collate_c(conn, db_type: str):
+    """Шаг миграции: path комментариев в PostgreSQL сравнивается побайтно (COLLATE "C"), как в SQLite.
+    Диапазон поддерева в comments.load_replies и порядок веток опираются на '.' < '/'; правила локали
+    базы могут игнорировать пунктуацию и терять ответы. Индексы (root_id, path) перестраиваются вместе с колонкой."""
+    if db_type == 'postgresql':
+        for table in ("post_comments", "group_post_comments"):
+            await conn.execute(f'ALTER TABLE {table} ALTER COLUMN path TYPE TEXT COLLATE "C"')
+
+
+async def resplit_group_slugs(conn, db_type: str):
+    """Шаг миграции: заново разобрать slug групп, созданных с slug_base = slug целиком (например «room-1», 0)."""
+    await _backfill_group_slug_parts(conn, db_type)
+
+
+async def _backfill_group_slug_parts(conn, db_type: str):
+    """Заполнить groups.slug_base / slug_suffix разбором существующих slug (см. split_group_slug)."""
+    if db_type == 'postgresql':
+        rows = [tuple(r) for r in await conn.fetch("SELECT id, slug FROM groups")]
+    else:
+        async with conn.execute("SELECT id, slug FROM groups") as cur:
+            rows = await cur.fetchall()
+    updates = [(*split_group_slug(slug), gid) for gid, slug in rows]
+    if db_type == 'postgresql':
+        await conn.executemany("UPDATE groups SET slug_base = $1, slug_suffix = $2 WHERE id = $3", updates)
+    else:
+        await conn.executemany("UPDATE groups SET slug_base = ?, slug_suffix = ? WHERE id = ?", updates)
 
 
 async def close_db():
@@ -0,0 +1,167 @@
+"""
+Потоковая выгрузка данных для админки (CSV / NDJSON)
+Строки читаются порциями и сразу отдаются клиенту, поэтому память не зависит от размера таблицы:
+PostgreSQL — серверный курсор asyncpg внутри транзакции (один согласованный снимок),
+SQLite — порции по EXPORT_CHUNK_SIZE строк с продолжением по id (keyset).
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from database import STATS_COUNTER_VALUE_PG, get_db, get_db_type
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+# kind -> описание выгрузки:
+#   columns — имена колонок в файле (в порядке SELECT), key — колонка id для продолжения,
+#   filters — параметр запроса -> условие с {} на месте плейсхолдера,
+#   counter — счётчик stats_counters с общим числом строк (для выгрузки без фильтров)
+EXPORTS: Dict[str, dict] = {
+    "users": {
+        "select": """SELECT u.id, u.username, u.email, u.is_admin, u.is_banned, u.is_official, u.is_moderator,
+                            u.community_name, u.created_at, u.last_seen
+                     FROM users u""",
+        "columns": ["id", "username", "email", "is_admin", "is_banned", "is_official", "is_moderator",
+                    "community_name", "created_at", "last_seen"],
+        "key": "u.id",
+        "created": "u.created_at",
+        "filters": {"is_banned": "u.is_banned = {}", "is_admin": "u.is_admin = {}"},
+        "counter": "users_total",
+    },
+    "posts": {
+        "select": """SELECT p.id, p.author_id, u.username, p.content, p.likes_count, p.created_at
+                     FROM posts p JOIN users u ON u.id = p.author_id""",
+        "columns": ["id", "author_id", "author_username", "content", "likes_count", "created_at"],
+        "key": "p.id",
+        "created": "p.created_at",
+        "filters": {"user_id": "p.author_id = {}"},
+        "counter": "posts_total",
+    },
+    "reports": {
+        "select": """SELECT r.id, r.reporter_id, r.target_type, r.target_id, r.reason, r.status, r.created_at
+                     FROM reports r""",
+        "columns": ["id", "reporter_id", "target_type", "target_id", "reason", "status", "created_at"],
+        "key": "r.id",
+        "created": "r.created_at",
+        "filters": {"status": "r.status = {}", "user_id": "r.reporter_id = {}"},
+        "counter": None,
+    },
+    "ban_history": {
+        "select": """SELECT bh.id, bh.user_id, bh.admin_id, bh.action, bh.reason, bh.expires_at, bh.created_at
+                     FROM ban_history bh""",
+        "columns": ["id", "user_id", "admin_id", "action", "reason", "expires_at", "created_at"],
+        "key": "bh.id",
+        "created": "bh.created_at",
+        "filters": {"user_id": "bh.user_id = {}"},
+        "counter": None,
+    },
+}
+
+
+def _db_time(value: datetime, db_type: str):
+    """Время фильтра: без пояса — UTC; для SQLite — текст в формате CURRENT_TIMESTAMP."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value if db_type == 'postgresql' else value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def build_filters(
+    kind: str, filters: Dict[str, Any], since: Optional[datetime], until: Optional[datetime], db_type: str
+) -> Tuple[List[str], List[Any]]:
+    """Условия WHERE и параметры (плейсхолдеры $1.. для PostgreSQL, ? для SQLite).
+    Параметры, которых нет у данной выгрузки, — ValueError."""
+    spec = EXPORTS[kind]
+    where: List[str] = []
+    params: List[Any] = []
+
+    def add(template: str, value: Any) -> None:
+        params.append(value)
+        where.append(template.format(f"${len(params)}" if db_type == 'postgresql' else "?"))
+
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in spec["filters"]:
+            raise ValueError(f"Фильтр {name} недоступен для выгрузки {kind}")
+        add(spec["filters"][name], value)
+    if since:
+        add(spec["created"] + " >= {}", _db_time(since, db_type))
+    if until:
+        add(spec["created"] + " < {}", _db_time(until, db_type))
+    return where, params
+
+
+async def total_rows(kind: str, filtered: bool) -> Optional[int]:
+    """Сколько строк будет в выгрузке — только если это известно без COUNT(*) (счётчик, нет фильтров)."""
+    counter = EXPORTS[kind]["counter"]
+    if filtered or not counter:
+        return None
+    async with get_db() as conn:
+        if get_db_type() == 'postgresql':
+            return await conn.fetchval(
+                f"SELECT {STATS_COUNTER_VALUE_PG} FROM stats_counters c WHERE c.name = $1", counter
+            )
+        async with conn.execute("SELECT value FROM stats_counters WHERE name = ?", (counter,)) as cur:
+            row = await cur.fetchone()
+            return row[0] if row else None
+
+
+async def _iter_rows(kind: str, where: List[str], params: List[Any]) -> AsyncIterator[List[tuple]]:
+    """Порции строк выгрузки в порядке id."""
+    spec = EXPORTS[kind]
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            sql = spec["select"] + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {spec['key']}"
+            # Курсор asyncpg живёт только внутри транзакции; prefetch — размер порции с сервера
+            async with conn.transaction(readonly=True):
+                chunk = []
+                async for record in conn.cursor(sql, *params, prefetch=EXPORT_CHUNK_SIZE):
+                    chunk.append(tuple(record))
+                    if len(chunk) >= EXPORT_CHUNK_SIZE:
+                        yield chunk
+                        chunk = []
+                if chunk:
+                    yield chunk
+        else:
+            # Короткий запрос на каждую порцию: не держим читающую транзакцию SQLite на всё время выгрузки
+            sql = (spec["select"] + " WHERE " + " AND ".join(where + [f"{spec['key']} > ?"])
+                   + f" ORDER BY {spec['key']} LIMIT ?")
+            last_id = 0
+            while True:
+                async with conn.execute(sql, (*params, last_id, EXPORT_CHUNK_SIZE)) as cur:
+                    chunk = await cur.fetchall()
+                if not chunk:
+                    break
+                yield chunk
+                if len(chunk) < EXPORT_CHUNK_SIZE:
+                    break
+                last_id = chunk[-1][0]
+
+
+def _plain(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def stream_export(kind: str, fmt: str, where: List[str], params: List[Any]) -> AsyncIterator[bytes]:
+    """Тело ответа: CSV с заголовком или NDJSON (объект на строку), по куску на порцию строк."""
+    columns = EXPORTS[kind]["columns"]
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        yield buf.getvalue().encode("utf-8")
+    async for chunk in _iter_rows(kind, where, params):
+        if fmt == "csv":
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows([_plain(v) for v in row] for row in chunk)
+            yield buf.getvalue().encode("utf-8")
+        else:
+            yield "".join(
+                json.dumps(dict(zip(columns, map(_plain, row))), ensure_ascii=False) + "\n" for row in chunk
+            ).encode("utf-8")
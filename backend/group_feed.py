@@ -0,0 +1,137 @@
+"""
+Посты групп: страница группы и общая лента «мои группы»
+Посты группы читаются по индексу (group_id, created_at, id) от новых к старым, следующая страница —
+по курсору [created_at, id] (keyset, без OFFSET).
+Лента групп — k-way merge: из индекса каждой группы берётся не больше limit + 1 ключей после курсора
+(только ключи — их отдаёт сам индекс), heapq.merge сливает уже отсортированные списки,
+а полные строки читаются одним запросом только для постов, попавших на страницу.
+"""
+import heapq
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+from pagination import cursor_datetime, keyset_condition
+
+# SQLite ограничивает число SELECT в одном составном запросе (SQLITE_MAX_COMPOUND_SELECT, по умолчанию 500)
+SQLITE_UNION_GROUPS = 100
+
+_COLUMNS = """gp.id, gp.group_id, gp.content, gp.media_url, gp.created_at, gp.likes_count, gp.comments_count,
+              u.id AS author_id, u.username AS author_username, u.avatar_url AS author_avatar,
+              g.name AS group_name, g.slug AS group_slug"""
+_FIELDS = ["id", "group_id", "content", "media_url", "created_at", "likes_count", "comments_count",
+           "author_id", "author_username", "author_avatar", "group_name", "group_slug", "liked"]
+_ORDER = "ORDER BY gp.created_at DESC, gp.id DESC"
+
+
+def _select(liked_ph: str) -> str:
+    liked = f"EXISTS(SELECT 1 FROM group_post_likes l WHERE l.post_id = gp.id AND l.user_id = {liked_ph}) AS liked"
+    return f"""SELECT {_COLUMNS}, {liked}
+               FROM group_posts gp JOIN users u ON u.id = gp.author_id JOIN groups g ON g.id = gp.group_id"""
+
+
+def _rows(db_type: str, rows) -> List[Dict[str, Any]]:
+    if db_type == 'postgresql':
+        return [dict(r) for r in rows]
+    return [dict(zip(_FIELDS, r)) for r in rows]
+
+
+def _after(after: Optional[List[Any]], db_type: str) -> Optional[List[Any]]:
+    return [cursor_datetime(after[0], db_type), after[1]] if after else None
+
+
+def next_key(rows: List[dict], limit: int) -> Optional[List[Any]]:
+    """Ключ следующей страницы [created_at, id] — если строк больше limit."""
+    if len(rows) <= limit:
+        return None
+    return [rows[limit - 1]["created_at"], rows[limit - 1]["id"]]
+
+
+async def load_group_posts(
+    conn, db_type: str, group_id: int, after: Optional[List[Any]], limit: int, user_id: Optional[int]
+) -> List[dict]:
+    """До limit + 1 постов группы после курсора (лишний — признак следующей страницы)."""
+    after = _after(after, db_type)
+    pg = db_type == 'postgresql'
+    params: List[Any] = [user_id or 0, group_id]
+    where = ["gp.group_id = " + ("$2" if pg else "?")]
+    if after:
+        cond, cond_params = keyset_condition(["gp.created_at", "gp.id"], after, db_type, 3, desc=True)
+        where.append(cond)
+        params += cond_params
+    params.append(limit + 1)
+    sql = (_select("$1" if pg else "?") + f" WHERE {' AND '.join(where)} {_ORDER} LIMIT "
+           + (f"${len(params)}" if pg else "?"))
+    if pg:
+        return _rows(db_type, await conn.fetch(sql, *params))
+    async with conn.execute(sql, params) as cur:
+        return _rows(db_type, await cur.fetchall())
+
+
+async def _group_heads(
+    conn, db_type: str, group_ids: List[int], after: Optional[List[Any]], n: int
+) -> List[List[tuple]]:
+    """Для каждой группы — до n ключей (created_at, id) после курсора, от новых к старым."""
+    heads: Dict[int, List[tuple]] = {gid: [] for gid in group_ids}
+    if db_type == 'postgresql':
+        params: List[Any] = [group_ids]
+        cond = "TRUE"
+        if after:
+            cond, cond_params = keyset_condition(["gp.created_at", "gp.id"], after, db_type, 2, desc=True)
+            params += cond_params
+        params.append(n)
+        rows = await conn.fetch(
+            f"""SELECT h.group_id, h.created_at, h.id
+                FROM unnest($1::int[]) AS grp(id)
+                CROSS JOIN LATERAL (
+                    SELECT gp.group_id, gp.created_at, gp.id FROM group_posts gp
+                    WHERE gp.group_id = grp.id AND {cond} {_ORDER} LIMIT ${len(params)}
+                ) h""",
+            *params
+        )
+        rows = [tuple(r) for r in rows]
+    else:
+        cond, cond_params = ("1", []) if not after else keyset_condition(
+            ["gp.created_at", "gp.id"], after, db_type, desc=True
+        )
+        pick = (f"SELECT * FROM (SELECT gp.group_id, gp.created_at, gp.id FROM group_posts gp "
+                f"WHERE gp.group_id = ? AND {cond} {_ORDER} LIMIT ?)")
+        rows = []
+        for i in range(0, len(group_ids), SQLITE_UNION_GROUPS):
+            batch = group_ids[i:i + SQLITE_UNION_GROUPS]
+            params = [p for gid in batch for p in (gid, *cond_params, n)]
+            async with conn.execute(" UNION ALL ".join([pick] * len(batch)), params) as cur:
+                rows += await cur.fetchall()
+    for gid, created_at, pid in rows:
+        heads[gid].append((created_at, pid))
+    # Порядок строк между подзапросами не гарантирован — внутри группы упорядочиваем сами
+    return [sorted(h, reverse=True) for h in heads.values() if h]
+
+
+async def load_group_feed(
+    conn, db_type: str, user_id: int, after: Optional[List[Any]], limit: int
+) -> List[dict]:
+    """До limit + 1 постов из всех групп пользователя после курсора, от новых к старым."""
+    if db_type == 'postgresql':
+        group_ids = [r["group_id"] for r in await conn.fetch(
+            "SELECT group_id FROM group_members WHERE user_id = $1", user_id
+        )]
+    else:
+        async with conn.execute("SELECT group_id FROM group_members WHERE user_id = ?", (user_id,)) as cur:
+            group_ids = [r[0] for r in await cur.fetchall()]
+    if not group_ids:
+        return []
+    heads = await _group_heads(conn, db_type, group_ids, _after(after, db_type), limit + 1)
+    page = [pid for _, pid in islice(heapq.merge(*heads, reverse=True), limit + 1)]
+    if not page:
+        return []
+    if db_type == 'postgresql':
+        rows = _rows(db_type, await conn.fetch(
+            _select("$1") + " WHERE gp.id = ANY($2::int[])", user_id, page
+        ))
+    else:
+        async with conn.execute(
+            _select("?") + f" WHERE gp.id IN ({','.join('?' * len(page))})", (user_id, *page)
+        ) as cur:
+            rows = _rows(db_type, await cur.fetchall())
+    by_id = {r["id"]: r for r in rows}
+    return [by_id[pid] for pid in page if pid in by_id]
@@ -0,0 +1,58 @@
+"""
+Лайки постов и постов групп
+Переключение лайка — DELETE, а если удалять было нечего — INSERT ... ON CONFLICT DO NOTHING,
+поэтому параллельные запросы одного пользователя не дают двойного лайка и не ломают likes_count:
+счётчик меняется только на то, что реально изменилось в таблице лайков.
+Уведомление автору вызывающий создаёт после коммита — create_notification открывает своё соединение,
+и в SQLite оно ждало бы блокировку записи, которую держит незакоммиченная транзакция лайка.
+"""
+from typing import Optional, Tuple
+
+# таблица постов -> таблица лайков
+LIKE_TABLES = {"posts": "post_likes", "group_posts": "group_post_likes"}
+
+
+async def toggle_like(
+    conn, db_type: str, post_id: int, user_id: int, table: str = "posts"
+) -> Optional[Tuple[bool, bool, int, int]]:
+    """Поставить / убрать лайк (внутри транзакции вызывающего).
+    Результат: (liked, changed, likes_count, author_id); changed — лайк действительно добавлен или снят.
+    None — поста нет."""
+    likes_table = LIKE_TABLES[table]
+    if db_type == 'postgresql':
+        author_id = await conn.fetchval(f"SELECT author_id FROM {table} WHERE id = $1", post_id)
+        if author_id is None:
+            return None
+        removed = await conn.fetchval(
+            f"DELETE FROM {likes_table} WHERE post_id = $1 AND user_id = $2 RETURNING 1", post_id, user_id
+        )
+        if removed:
+            liked, delta = False, -1
+        else:
+            added = await conn.fetchval(
+                f"INSERT INTO {likes_table} (post_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING RETURNING 1",
+                post_id, user_id
+            )
+            liked, delta = True, 1 if added else 0
+        likes = await conn.fetchval(
+            f"UPDATE {table} SET likes_count = likes_count + $2 WHERE id = $1 RETURNING likes_count", post_id, delta
+        )
+    else:
+        async with conn.execute(f"SELECT author_id FROM {table} WHERE id = ?", (post_id,)) as cur:
+            row = await cur.fetchone()
+        if row is None:
+            return None
+        author_id = row[0]
+        cur = await conn.execute(f"DELETE FROM {likes_table} WHERE post_id = ? AND user_id = ?", (post_id, user_id))
+        if cur.rowcount:
+            liked, delta = False, -1
+        else:
+            cur = await conn.execute(
+                f"INSERT OR IGNORE INTO {likes_table} (post_id, user_id) VALUES (?, ?)", (post_id, user_id)
+            )
+            liked, delta = True, 1 if cur.rowcount else 0
+        if delta:
+            await conn.execute(f"UPDATE {table} SET likes_count = likes_count + ? WHERE id = ?", (delta, post_id))
+        async with conn.execute(f"SELECT likes_count FROM {table} WHERE id = ?", (post_id,)) as cur:
+            likes = (await cur.fetchone())[0]
+    return liked, delta != 0, likes, author_id
@@ -0,0 +1,182 @@
+"""
+Временные ряды активности для админки
+Пути записи (регистрация, вход, пост, сообщение, лайк, любой авторизованный запрос) вызывают
+metrics.record / metrics.mark_active — это только инкремент в памяти. Раз в METRICS_FLUSH_SECONDS
+накопленное дописывается в metrics_series поминутными и почасовыми бакетами (UPSERT value + n),
+поэтому график нагрузки строится без агрегатов по живым таблицам.
+active_users каждый воркер считает по своим запросам и пишет максимум — при нескольких воркерах
+значение приблизительное (нижняя оценка).
+Хранение: минутные бакеты — METRICS_MINUTE_RETENTION_HOURS, часовые — METRICS_HOUR_RETENTION_DAYS.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from database import get_db, get_db_type
+
+logger = logging.getLogger(__name__)
+
+METRICS_FLUSH_SECONDS = int(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+METRICS_MINUTE_RETENTION_HOURS = int(os.getenv("METRICS_MINUTE_RETENTION_HOURS", "48"))
+METRICS_HOUR_RETENTION_DAYS = int(os.getenv("METRICS_HOUR_RETENTION_DAYS", "90"))
+
+METRICS = ("registrations", "logins", "posts", "messages", "likes", "active_users")
+MINUTE = 60
+HOUR = 3600
+# Допустимые шаги выдачи (секунды) и из каких бакетов они собираются
+STEPS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600, "6h": 21600, "1d": 86400}
+MAX_POINTS = 1000
+
+
+class MetricsRecorder:
+    def __init__(self):
+        # (resolution, bucket, metric) -> приращение, ещё не записанное в БД
+        self._pending: Dict[Tuple[int, int, str], int] = defaultdict(int)
+        # Уникальные активные пользователи — множества по открытым бакетам
+        self._active: Dict[Tuple[int, int], Set[int]] = {}
+        self._last_cleanup = 0.0
+
+    def record(self, metric: str, n: int = 1) -> None:
+        now = int(time.time())
+        for res in (MINUTE, HOUR):
+            self._pending[(res, now - now % res, metric)] += n
+
+    def mark_active(self, user_id: int) -> None:
+        now = int(time.time())
+        for res in (MINUTE, HOUR):
+            self._active.setdefault((res, now - now % res), set()).add(user_id)
+
+    def _drain(self, final: bool = False) -> Tuple[List[tuple], List[tuple]]:
+        """(приращения счётчиков, текущие размеры множеств активных). Закрытые бакеты активных
+        после этого забываются; открытые переписываются при каждом сбросе (UPSERT по максимуму)."""
+        counts = [(res, bucket, metric, n) for (res, bucket, metric), n in self._pending.items() if n]
+        self._pending = defaultdict(int)
+        now = int(time.time())
+        active = []
+        for key in list(self._active):
+            res, bucket = key
+            active.append((res, bucket, "active_users", len(self._active[key])))
+            if final or bucket + res <= now:
+                del self._active[key]
+        return counts, active
+
+    async def flush(self, final: bool = False) -> None:
+        counts, active = self._drain(final)
+        if not counts and not active:
+            return
+        db_type = get_db_type()
+        try:
+            async with get_db() as conn:
+                if db_type == 'postgresql':
+                    await conn.executemany(
+                        """INSERT INTO metrics_series (resolution, bucket, metric, value) VALUES ($1, $2, $3, $4)
+                           ON CONFLICT (resolution, metric, bucket) DO UPDATE SET value = metrics_series.value + EXCLUDED.value""",
+                        counts
+                    )
+                    await conn.executemany(
+                        """INSERT INTO metrics_series (resolution, bucket, metric, value) VALUES ($1, $2, $3, $4)
+                           ON CONFLICT (resolution, metric, bucket) DO UPDATE SET value = GREATEST(metrics_series.value, EXCLUDED.value)""",
+                        active
+                    )
+                else:
+                    await conn.executemany(
+                        """INSERT INTO metrics_series (resolution, bucket, metric, value) VALUES (?, ?, ?, ?)
+                           ON CONFLICT (resolution, metric, bucket) DO UPDATE SET value = value + excluded.value""",
+                        counts
+                    )
+                    await conn.executemany(
+                        """INSERT INTO metrics_series (resolution, bucket, metric, value) VALUES (?, ?, ?, ?)
+                           ON CONFLICT (resolution, metric, bucket) DO UPDATE SET value = MAX(value, excluded.value)""",
+                        active
+                    )
+                    await conn.commit()
+        except Exception:
+            # Вернуть приращения в очередь, чтобы не потерять при временной ошибке БД
+            for res, bucket, metric, n in counts:
+                self._pending[(res, bucket, metric)] += n
+            raise
+
+    async def cleanup(self) -> None:
+        """Удалить бакеты старше срока хранения (не чаще раза в час)."""
+        now = time.time()
+        if now - self._last_cleanup < HOUR:
+            return
+        self._last_cleanup = now
+        limits = ((MINUTE, int(now) - METRICS_MINUTE_RETENTION_HOURS * HOUR),
+                  (HOUR, int(now) - METRICS_HOUR_RETENTION_DAYS * 86400))
+        db_type = get_db_type()
+        async with get_db() as conn:
+            for res, before in limits:
+                if db_type == 'postgresql':
+                    await conn.execute("DELETE FROM metrics_series WHERE resolution = $1 AND bucket < $2", res, before)
+                else:
+                    await conn.execute("DELETE FROM metrics_series WHERE resolution = ? AND bucket < ?", (res, before))
+            if db_type != 'postgresql':
+                await conn.commit()
+
+
+metrics = MetricsRecorder()
+
+
+def pick_step(start: int, end: int, step: Optional[str]) -> int:
+    """Шаг выдачи: заданный или наименьший, при котором точек не больше MAX_POINTS."""
+    if step:
+        return STEPS[step]
+    for seconds in sorted(STEPS.values()):
+        if (end - start) / seconds <= MAX_POINTS:
+            return seconds
+    return STEPS["1d"]
+
+
+async def query_series(
+    metric_names: List[str], start: int, end: int, step: int
+) -> Tuple[int, Dict[str, List[List[int]]]]:
+    """(фактический шаг, ряды [bucket_epoch, value]). Минутные бакеты используются для шагов меньше часа
+    в пределах их хранения; для более старого диапазона шаг поднимается до часа.
+    Счётчики при прореживании суммируются, active_users — берётся максимум
+    (уникальных за крупный интервал из мелких не сложить)."""
+    minute_floor = int(time.time()) - METRICS_MINUTE_RETENTION_HOURS * HOUR
+    res = MINUTE if step < HOUR and start >= minute_floor else HOUR
+    step = max(step, res)
+    start -= start % step
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            rows = await conn.fetch(
+                """SELECT metric, bucket - bucket % $4 AS slot,
+                          CASE WHEN metric = 'active_users' THEN MAX(value) ELSE SUM(value) END AS value
+                   FROM metrics_series
+                   WHERE resolution = $1 AND metric = ANY($2::text[]) AND bucket >= $3 AND bucket < $5
+                   GROUP BY metric, slot""",
+                res, metric_names, start, step, end
+            )
+            rows = [(r["metric"], r["slot"], r["value"]) for r in rows]
+        else:
+            ph = ",".join(["?"] * len(metric_names))
+            async with conn.execute(
+                f"""SELECT metric, bucket - bucket % ? AS slot,
+                           CASE WHEN metric = 'active_users' THEN MAX(value) ELSE SUM(value) END
+                    FROM metrics_series
+                    WHERE resolution = ? AND metric IN ({ph}) AND bucket >= ? AND bucket < ?
+                    GROUP BY metric, slot""",
+                (step, res, *metric_names, start, end)
+            ) as cur:
+                rows = await cur.fetchall()
+    values = {(m, slot): v for m, slot, v in rows}
+    return step, {
+        m: [[slot, int(values.get((m, slot), 0))] for slot in range(start, end, step)]
+        for m in metric_names
+    }
+
+
+async def run_metrics_flush() -> None:
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            await metrics.flush()
+            await metrics.cleanup()
+        except Exception as e:
+            logger.warning("Не удалось записать метрики: %s", e)
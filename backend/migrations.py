@@ -0,0 +1,170 @@
+"""
+Версионированные миграции схемы
+Схема — упорядоченный список шагов MIGRATIONS (версия, имя, функция, в транзакции ли).
+Выполненный шаг отмечается в applied_migrations строкой "schema_version:<версия>", поэтому при старте
+воркера достаточно одного запроса по первичному ключу: есть отметка последней версии — больше ничего.
+Недостающие шаги выполняет только один процесс: PostgreSQL — pg_advisory_lock, SQLite — файловая
+блокировка рядом с файлом БД. Остальные ждут блокировку и перечитывают версию (обычно уже актуальную).
+Изменение схемы — новый шаг в конце MIGRATIONS со следующим номером; старые шаги не меняются.
+
+Запуск до деплоя (из каталога backend):
+  python migrations.py           — применить недостающие шаги
+  python migrations.py --status  — текущая и последняя версия, список недостающих шагов
+"""
+import asyncio
+import logging
+import sqlite3
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Tuple
+
+import database
+from database import (
+    POSTGRES_AVAILABLE, baseline_schema, get_db, get_db_type, shard_stats_counters, slim_comments_preview,
+    resplit_group_slugs, comment_paths_collate_c,
+)
+from process_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# (версия, имя, шаг(conn, db_type), в транзакции). Базовый шаг написан для автокоммита
+# (внутри есть try/except вокруг отдельных ALTER), поэтому выполняется вне транзакции.
+MIGRATIONS: List[Tuple[int, str, Callable[..., Awaitable[None]], bool]] = [
+    (1, "baseline", baseline_schema, False),
+    (2, "stats_counter_shards", shard_stats_counters, True),
+    (3, "slim_comments_preview", slim_comments_preview, True),
+    (4, "resplit_group_slugs", resplit_group_slugs, True),
+    (5, "comment_paths_collate_c", comment_paths_collate_c, True),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+VERSION_PREFIX = "schema_version:"
+# Ключ pg_advisory_lock — общий для всех воркеров и CLI
+MIGRATION_LOCK_KEY = 7_310_431_001
+# Ошибки запроса к ещё не созданной applied_migrations (первый запуск на пустой БД)
+_MISSING_TABLE_ERRORS = (sqlite3.OperationalError,) + ((database.asyncpg.UndefinedTableError,) if POSTGRES_AVAILABLE else ())
+
+
+def _is_missing_table(e: Exception) -> bool:
+    return not isinstance(e, sqlite3.OperationalError) or "no such table" in str(e)
+
+
+async def _has_version(conn, db_type: str, version: int) -> bool:
+    """Отмечена ли версия; до первого запуска таблицы applied_migrations ещё нет — False."""
+    name = f"{VERSION_PREFIX}{version}"
+    try:
+        if db_type == 'postgresql':
+            return bool(await conn.fetchval("SELECT 1 FROM applied_migrations WHERE name = $1", name))
+        async with conn.execute("SELECT 1 FROM applied_migrations WHERE name = ?", (name,)) as cur:
+            return await cur.fetchone() is not None
+    except _MISSING_TABLE_ERRORS as e:
+        if not _is_missing_table(e):
+            raise
+        return False
+
+
+async def current_version(conn, db_type: str) -> int:
+    """Наибольшая отмеченная версия схемы; 0 — БД пустая или создана до версионирования."""
+    try:
+        if db_type == 'postgresql':
+            names = [r["name"] for r in await conn.fetch(
+                "SELECT name FROM applied_migrations WHERE name LIKE $1", VERSION_PREFIX + "%"
+            )]
+        else:
+            async with conn.execute(
+                "SELECT name FROM applied_migrations WHERE name LIKE ?", (VERSION_PREFIX + "%",)
+            ) as cur:
+                names = [r[0] for r in await cur.fetchall()]
+    except _MISSING_TABLE_ERRORS as e:
+        if not _is_missing_table(e):
+            raise
+        return 0
+    return max((int(n[len(VERSION_PREFIX):]) for n in names), default=0)
+
+
+@asynccontextmanager
+async def _migration_lock(conn, db_type: str):
+    """Один мигрирующий процесс на БД; остальные ждут здесь."""
+    if db_type == 'postgresql':
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+        try:
+            yield
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+    else:
+        lock = FileLock(database._sqlite_path + ".migrate.lock")
+        await asyncio.to_thread(lock.acquire)
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+async def _apply(conn, db_type: str, version: int, name: str, step, atomic: bool) -> None:
+    mark = f"{VERSION_PREFIX}{version}"
+    started = time.perf_counter()
+    if db_type == 'postgresql':
+        if atomic:
+            async with conn.transaction():
+                await step(conn, db_type)
+                await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", mark)
+        else:
+            await step(conn, db_type)
+            await conn.execute("INSERT INTO applied_migrations (name) VALUES ($1)", mark)
+    else:
+        # В SQLite DDL транзакционен: шаг и отметка коммитятся вместе (если шаг сам не коммитит)
+        await step(conn, db_type)
+        await conn.execute("INSERT INTO applied_migrations (name) VALUES (?)", (mark,))
+        await conn.commit()
+    logger.info("Схема БД: шаг %s (%s) применён за %.2f с", version, name, time.perf_counter() - started)
+
+
+async def migrate() -> int:
+    """Выполнить недостающие шаги; вернуть их число (0 — схема уже актуальна)."""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if await _has_version(conn, db_type, SCHEMA_VERSION):
+            return 0
+        async with _migration_lock(conn, db_type):
+            # Пока ждали блокировку, другой процесс мог всё сделать
+            version = await current_version(conn, db_type)
+            pending = [m for m in MIGRATIONS if m[0] > version]
+            for step_version, name, step, atomic in pending:
+                await _apply(conn, db_type, step_version, name, step, atomic)
+    if pending:
+        logger.info("Схема БД обновлена до версии %s", SCHEMA_VERSION)
+    return len(pending)
+
+
+async def status() -> Tuple[int, List[Tuple[int, str]]]:
+    """(текущая версия, недостающие шаги [(версия, имя)])."""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        version = await current_version(conn, db_type)
+    return version, [(v, name) for v, name, _, _ in MIGRATIONS if v > version]
+
+
+async def _main(argv: List[str]) -> int:
+    try:
+        if "--status" in argv:
+            version, pending = await status()
+            print(f"{get_db_type()}: версия схемы {version}, последняя {SCHEMA_VERSION}")
+            for v, name in pending:
+                print(f"  не применён шаг {v}: {name}")
+            return 1 if pending else 0
+        applied = await migrate()
+        print(f"Применено шагов: {applied}, версия схемы {SCHEMA_VERSION}")
+        return 0
+    finally:
+        await database.close_db()
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+    from dotenv import load_dotenv
+
+    # Те же файлы окружения, что читает server.py, — CLI мигрирует ту же БД
+    ROOT_DIR = Path(__file__).parent
+    load_dotenv(ROOT_DIR / '.env')
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,218 @@
+"""
+Пакетная модерация
+Список действий (бан, разбан, удаление поста, рассмотрение жалобы) сначала целиком проверяется,
+затем применяется в одной транзакции запросами по множеству id (ANY / IN) — по одному на вид действия.
+Записи ban_history вставляются одним многострочным INSERT, in-memory индексы обновляются один раз в конце.
+Ошибка в любом действии — ничего не применяется.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from autocomplete import username_index
+from database import get_db, get_db_type
+from recommendations import recommendation_engine
+from reports import REPORT_REVIEW_STATUSES, sync_targets_for_reports
+
+BULK_MODERATION_MAX = 1000
+MODERATION_ACTIONS = ("ban", "unban", "delete_post", "review_report")
+
+
+class BulkModerationError(Exception):
+    """Пакет отклонён; errors — [{"index", "error"}] по номерам действий в запросе."""
+
+    def __init__(self, errors: List[dict]):
+        super().__init__(f"{len(errors)} invalid actions")
+        self.errors = errors
+
+
+class ModerationPlan:
+    """Проверенный пакет, сгруппированный по видам действий."""
+
+    def __init__(self):
+        self.bans: Dict[int, Tuple[Optional[str], Optional[datetime]]] = {}
+        self.unbans: Set[int] = set()
+        self.delete_posts: Set[int] = set()
+        self.reviews: Dict[int, str] = {}
+        # target -> индекс действия в запросе, чтобы указать на него, если цели нет в БД
+        self.index: Dict[Tuple[str, int], int] = {}
+
+    def counts(self) -> Dict[str, int]:
+        return {"ban": len(self.bans), "unban": len(self.unbans),
+                "delete_post": len(self.delete_posts), "review_report": len(self.reviews)}
+
+
+def plan_actions(actions: Iterable[Any]) -> ModerationPlan:
+    """Проверить формат действий и противоречия (бан и разбан одного пользователя, разные решения
+    по одной жалобе). Повторы одного и того же действия схлопываются."""
+    plan = ModerationPlan()
+    errors: List[dict] = []
+    for i, a in enumerate(actions):
+        if a.action not in MODERATION_ACTIONS:
+            errors.append({"index": i, "error": f"action должен быть одним из: {', '.join(MODERATION_ACTIONS)}"})
+            continue
+        kind = "user" if a.action in ("ban", "unban") else a.action
+        plan.index.setdefault((kind, a.target_id), i)
+        if a.action == "ban":
+            expires = None
+            if a.expires_at:
+                try:
+                    expires = datetime.fromisoformat(a.expires_at)
+                except ValueError:
+                    errors.append({"index": i, "error": "expires_at — невалидный ISO datetime"})
+                    continue
+                if expires.tzinfo is not None:
+                    expires = expires.astimezone(timezone.utc).replace(tzinfo=None)
+            if a.target_id in plan.unbans:
+                errors.append({"index": i, "error": "бан и разбан одного пользователя в одном пакете"})
+                continue
+            plan.bans[a.target_id] = (a.reason, expires)
+        elif a.action == "unban":
+            if a.target_id in plan.bans:
+                errors.append({"index": i, "error": "бан и разбан одного пользователя в одном пакете"})
+                continue
+            plan.unbans.add(a.target_id)
+        elif a.action == "delete_post":
+            plan.delete_posts.add(a.target_id)
+        else:
+            if a.status not in REPORT_REVIEW_STATUSES:
+                errors.append({"index": i, "error": "status должен быть dismissed или actioned"})
+                continue
+            if plan.reviews.get(a.target_id, a.status) != a.status:
+                errors.append({"index": i, "error": "разные решения по одной жалобе"})
+                continue
+            plan.reviews[a.target_id] = a.status
+    if errors:
+        raise BulkModerationError(errors)
+    return plan
+
+
+async def _missing(conn, db_type: str, table: str, ids: Set[int]) -> Set[int]:
+    if not ids:
+        return set()
+    if db_type == 'postgresql':
+        rows = await conn.fetch(f"SELECT id FROM {table} WHERE id = ANY($1::int[])", list(ids))
+        found = {r["id"] for r in rows}
+    else:
+        async with conn.execute(
+            f"SELECT id FROM {table} WHERE id IN ({','.join('?' * len(ids))})", tuple(ids)
+        ) as cur:
+            found = {r[0] for r in await cur.fetchall()}
+    return ids - found
+
+
+async def _check_targets(conn, db_type: str, plan: ModerationPlan) -> None:
+    errors = []
+    for kind, table, ids in (("user", "users", set(plan.bans) | plan.unbans),
+                             ("delete_post", "posts", plan.delete_posts),
+                             ("review_report", "reports", set(plan.reviews))):
+        for target in await _missing(conn, db_type, table, ids):
+            errors.append({"index": plan.index[(kind, target)], "error": f"{table}: id {target} не найден"})
+    if errors:
+        raise BulkModerationError(sorted(errors, key=lambda e: e["index"]))
+
+
+def _history_rows(plan: ModerationPlan) -> List[tuple]:
+    """(user_id, action, reason, expires_at) для ban_history."""
+    rows = [(uid, "ban", reason, expires) for uid, (reason, expires) in plan.bans.items()]
+    rows += [(uid, "unban", None, None) for uid in plan.unbans]
+    return rows
+
+
+async def _apply_postgres(conn, plan: ModerationPlan, admin_id: int, now: datetime) -> None:
+    async with conn.transaction():
+        await _check_targets(conn, 'postgresql', plan)
+        if plan.bans:
+            await conn.execute("UPDATE users SET is_banned = TRUE WHERE id = ANY($1::int[])", list(plan.bans))
+        if plan.unbans:
+            await conn.execute("UPDATE users SET is_banned = FALSE WHERE id = ANY($1::int[])", list(plan.unbans))
+        history = _history_rows(plan)
+        if history:
+            user_ids, actions, reasons, expires = (list(col) for col in zip(*history))
+            await conn.execute(
+                """INSERT INTO ban_history (user_id, admin_id, action, reason, expires_at, created_at)
+                   SELECT h.user_id, $1, h.action, h.reason, h.expires_at, $2
+                   FROM unnest($3::int[], $4::text[], $5::text[], $6::timestamp[]) AS h(user_id, action, reason, expires_at)""",
+                admin_id, now, user_ids, actions, reasons, expires
+            )
+        if plan.delete_posts:
+            await conn.execute("DELETE FROM posts WHERE id = ANY($1::int[])", list(plan.delete_posts))
+        for status in REPORT_REVIEW_STATUSES:
+            ids = [rid for rid, s in plan.reviews.items() if s == status]
+            if ids:
+                await conn.execute(
+                    "UPDATE reports SET status = $1, reviewed_by = $2, reviewed_at = $3 WHERE id = ANY($4::int[])",
+                    status, admin_id, now, ids
+                )
+                await sync_targets_for_reports(conn, 'postgresql', ids, status, admin_id, now)
+
+
+async def _apply_sqlite(conn, plan: ModerationPlan, admin_id: int, now: datetime) -> None:
+    # Всё до commit — одна транзакция; при исключении соединение закрывается без commit (откат)
+    await _check_targets(conn, 'sqlite', plan)
+
+    def in_list(ids) -> str:
+        return ",".join("?" * len(ids))
+
+    if plan.bans:
+        await conn.execute(f"UPDATE users SET is_banned = 1 WHERE id IN ({in_list(plan.bans)})", tuple(plan.bans))
+    if plan.unbans:
+        await conn.execute(f"UPDATE users SET is_banned = 0 WHERE id IN ({in_list(plan.unbans)})", tuple(plan.unbans))
+    history = _history_rows(plan)
+    if history:
+        params = []
+        for uid, action, reason, expires in history:
+            params += [uid, admin_id, action, reason, expires.isoformat() if expires else None, now.isoformat()]
+        await conn.execute(
+            "INSERT INTO ban_history (user_id, admin_id, action, reason, expires_at, created_at) VALUES "
+            + ",".join(["(?,?,?,?,?,?)"] * len(history)),
+            params
+        )
+    if plan.delete_posts:
+        await conn.execute(
+            f"DELETE FROM posts WHERE id IN ({in_list(plan.delete_posts)})", tuple(plan.delete_posts)
+        )
+    for status in REPORT_REVIEW_STATUSES:
+        ids = [rid for rid, s in plan.reviews.items() if s == status]
+        if ids:
+            await conn.execute(
+                f"UPDATE reports SET status = ?, reviewed_by = ?, reviewed_at = ? WHERE id IN ({in_list(ids)})",
+                (status, admin_id, now.isoformat(), *ids)
+            )
+            await sync_targets_for_reports(conn, 'sqlite', ids, status, admin_id, now)
+    await conn.commit()
+
+
+async def _sync_indexes(conn, db_type: str, plan: ModerationPlan) -> None:
+    """Обновить in-memory индексы после коммита: забаненных убрать из автодополнения,
+    разбаненных вернуть (одним запросом за никами), удалённые посты — из рекомендаций."""
+    for uid in plan.bans:
+        username_index.remove(uid)
+    if plan.unbans:
+        ids = list(plan.unbans)
+        if db_type == 'postgresql':
+            rows = await conn.fetch("SELECT id, username FROM users WHERE id = ANY($1::int[])", ids)
+            rows = [(r["id"], r["username"]) for r in rows]
+        else:
+            async with conn.execute(
+                f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(ids))})", ids
+            ) as cur:
+                rows = await cur.fetchall()
+        for uid, username in rows:
+            username_index.add(uid, username)
+    for post_id in plan.delete_posts:
+        recommendation_engine.remove_post(post_id)
+
+
+async def apply_bulk(actions: List[Any], admin_id: int) -> Dict[str, int]:
+    """Проверить и применить пакет; вернуть число применённых действий по видам.
+    BulkModerationError — пакет отклонён целиком."""
+    plan = plan_actions(actions)
+    now = datetime.utcnow()
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            await _apply_postgres(conn, plan, admin_id, now)
+        else:
+            await _apply_sqlite(conn, plan, admin_id, now)
+        await _sync_indexes(conn, db_type, plan)
+    return plan.counts()
@@ -0,0 +1,78 @@
+"""
+Курсорная (keyset) пагинация
+Курсор — непрозрачная для клиента base64-строка со значениями ключа сортировки последней строки.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Упаковать значения ключа сортировки в курсор. datetime сериализуется в ISO."""
+    plain = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(plain, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+# Типы значений курсора для decode_cursor: время — ISO-строка (см. encode_cursor), число — int или float
+CURSOR_TIME = str
+CURSOR_NUMBER = (int, float)
+
+
+def _cursor_value_ok(value: Any, expected) -> bool:
+    # bool в JSON — не число, хотя в Python это подкласс int
+    return isinstance(value, expected) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor: Optional[str], types: Tuple[Any, ...]) -> Optional[List[Any]]:
+    """Распаковать курсор из len(types) значений; types — тип (или кортеж типов) каждого значения.
+    None — первая страница. Битый курсор или значение не того типа — 400."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+    if (
+        not isinstance(values, list) or len(values) != len(types)
+        or not all(_cursor_value_ok(v, t) for v, t in zip(values, types))
+    ):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+    return values
+
+
+def cursor_datetime(value: Any, db_type: str) -> Any:
+    """Время из курсора в виде, пригодном для сравнения в SQL:
+    datetime для PostgreSQL, исходная строка для SQLite (там время хранится текстом)."""
+    if value is None or db_type != 'postgresql':
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+def keyset_condition(
+    columns: List[str], values: List[Any], db_type: str, start: int = 1, desc: bool = False
+) -> Tuple[str, List[Any]]:
+    """Условие «строка после курсора» для сортировки по columns (все ASC или все DESC):
+    (a > $1 OR (a = $1 AND b > $2)). Возвращает SQL и параметры; для PostgreSQL
+    плейсхолдеры $start, $start+1, ..., для SQLite — ? с повтором значений."""
+    op = "<" if desc else ">"
+    if db_type == 'postgresql':
+        ph = [f"${start + i}" for i in range(len(columns))]
+        params = list(values)
+    else:
+        ph = ["?"] * len(columns)
+        params = []
+    parts = []
+    for i, col in enumerate(columns):
+        eq = [f"{columns[j]} = {ph[j]}" for j in range(i)]
+        parts.append("(" + " AND ".join(eq + [f"{col} {op} {ph[i]}"]) + ")")
+        if db_type != 'postgresql':
+            params += list(values[:i]) + [values[i]]
+    return "(" + " OR ".join(parts) + ")", params
@@ -0,0 +1,164 @@
+"""
+Сервис присутствия («в сети» / «недавно» / «не в сети»)
+Последняя активность и число открытых соединений пользователя хранятся в памяти процесса.
+Запросы к API и подключения отмечают активность без записи в БД; users.last_seen
+обновляется пачкой раз в PRESENCE_FLUSH_SECONDS. Тот же цикл подтягивает из БД активность,
+записанную другими воркерами, поэтому статус можно отдавать вообще без запроса к users.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from database import get_db, get_db_type
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_FLUSH_SECONDS = int(os.getenv("PRESENCE_FLUSH_SECONDS", "30"))
+# Пороги статуса: online — активность в последние 5 минут, inactive — 5–30 минут
+PRESENCE_ONLINE_SECONDS = 300
+PRESENCE_INACTIVE_SECONDS = 1800
+
+
+def _to_epoch(value) -> Optional[float]:
+    """last_seen из БД (datetime или текст SQLite, время в UTC) -> epoch-секунды."""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace("Z", ""))
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_db_time(ts: float, db_type: str):
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None, microsecond=0)
+    return dt if db_type == 'postgresql' else dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class PresenceService:
+    def __init__(self):
+        self._last_active: Dict[int, float] = {}
+        self._connections: Dict[int, int] = {}
+        self._dirty: Dict[int, float] = {}
+        self._synced_until: Optional[float] = None
+
+    def touch(self, user_id: int) -> None:
+        """Отметить активность (любой авторизованный запрос)."""
+        now = time.time()
+        self._last_active[user_id] = now
+        self._dirty[user_id] = now
+
+    def connect(self, user_id: int) -> None:
+        """Открыто постоянное соединение (WebSocket и т.п.) — пока оно живо, пользователь в сети."""
+        self._connections[user_id] = self._connections.get(user_id, 0) + 1
+        self.touch(user_id)
+
+    def disconnect(self, user_id: int) -> None:
+        left = self._connections.get(user_id, 0) - 1
+        if left > 0:
+            self._connections[user_id] = left
+        else:
+            self._connections.pop(user_id, None)
+        self.touch(user_id)
+
+    def last_active(self, user_id: int, fallback=None) -> Optional[float]:
+        """Последняя активность в epoch: из памяти или из переданного last_seen, что новее."""
+        mem = self._last_active.get(user_id)
+        db = _to_epoch(fallback)
+        if mem is None:
+            return db
+        return mem if db is None else max(mem, db)
+
+    def status(self, user_id: int, fallback=None) -> str:
+        if self._connections.get(user_id):
+            return "online"
+        ts = self.last_active(user_id, fallback)
+        if ts is None:
+            return "offline"
+        delta = time.time() - ts
+        if delta <= PRESENCE_ONLINE_SECONDS:
+            return "online"
+        if delta <= PRESENCE_INACTIVE_SECONDS:
+            return "inactive"
+        return "offline"
+
+    def bulk(self, user_ids: Iterable[int]) -> Dict[int, dict]:
+        """Статусы пачки пользователей только из памяти. Кого нет в памяти — не был активен
+        последние PRESENCE_INACTIVE_SECONDS (синхронизация подтягивает всех, кто был)."""
+        out = {}
+        for uid in user_ids:
+            ts = self._last_active.get(uid)
+            out[uid] = {
+                "status": self.status(uid),
+                "last_seen": datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z") if ts else None,
+            }
+        return out
+
+    async def flush(self) -> None:
+        """Записать накопленную активность в users.last_seen одним пакетом."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        db_type = get_db_type()
+        rows = [(_to_db_time(ts, db_type), uid) for uid, ts in batch.items()]
+        try:
+            async with get_db() as conn:
+                if db_type == 'postgresql':
+                    await conn.executemany("UPDATE users SET last_seen = $1 WHERE id = $2", rows)
+                else:
+                    await conn.executemany("UPDATE users SET last_seen = ? WHERE id = ?", rows)
+                    await conn.commit()
+        except Exception:
+            # Не потерять активность: вернуть в очередь, более свежие отметки не затирать
+            for uid, ts in batch.items():
+                if ts > self._dirty.get(uid, 0):
+                    self._dirty[uid] = ts
+            raise
+
+    async def sync(self) -> None:
+        """Подтянуть из БД активность за последние PRESENCE_INACTIVE_SECONDS (в т.ч. от других воркеров)."""
+        now = time.time()
+        since = now - PRESENCE_INACTIVE_SECONDS
+        if self._synced_until is not None:
+            since = max(since, self._synced_until - PRESENCE_FLUSH_SECONDS * 2)
+        db_type = get_db_type()
+        async with get_db() as conn:
+            if db_type == 'postgresql':
+                rows = await conn.fetch(
+                    "SELECT id, last_seen FROM users WHERE last_seen > $1", _to_db_time(since, db_type)
+                )
+                pairs = [(r["id"], r["last_seen"]) for r in rows]
+            else:
+                async with conn.execute(
+                    "SELECT id, last_seen FROM users WHERE last_seen > ?", (_to_db_time(since, db_type),)
+                ) as cur:
+                    pairs = await cur.fetchall()
+        for uid, last_seen in pairs:
+            ts = _to_epoch(last_seen)
+            if ts is not None and ts > self._last_active.get(uid, 0):
+                self._last_active[uid] = ts
+        # Давно неактивных без соединений из памяти убираем — для них статус и так offline
+        stale = now - PRESENCE_INACTIVE_SECONDS
+        for uid in [u for u, ts in self._last_active.items() if ts < stale and u not in self._connections]:
+            del self._last_active[uid]
+        self._synced_until = now
+
+
+presence = PresenceService()
+
+
+async def run_presence_sync() -> None:
+    """Начальная загрузка, затем периодически: сбросить активность в БД и подтянуть чужую."""
+    while True:
+        try:
+            await presence.flush()
+            await presence.sync()
+        except Exception as e:
+            logger.warning("Ошибка синхронизации присутствия: %s", e)
+        await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
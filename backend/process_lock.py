@@ -0,0 +1,70 @@
+"""
+Межпроцессная блокировка на файле
+fcntl.flock на Linux / macOS, msvcrt.locking на Windows. Блокировку держит открытый дескриптор,
+поэтому при падении процесса ОС снимает её сама — «зависших» lock-файлов не бывает.
+"""
+import os
+import time
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Эксклюзивная блокировка файла path (файл создаётся при необходимости)."""
+
+    def __init__(self, path: str, poll_interval: float = 0.2):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Взять блокировку; blocking=False — не ждать, а вернуть False, если она занята."""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self._fd = fd
+                return True
+            except OSError:
+                # flock в блокирующем режиме ждёт сам; msvcrt умеет только пробовать — опрашиваем
+                if blocking and not fcntl:
+                    time.sleep(self.poll_interval)
+                    continue
+                os.close(fd)
+                if blocking:
+                    raise
+                return False
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
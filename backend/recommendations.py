@@ -0,0 +1,501 @@
+"""
+Движок рекомендаций постов по тегам
+Держит в памяти разреженные матрицы «пост × тег» (CSR на массивах numpy) и «пользователь × тег»
+(подписки + теги лайкнутых постов с затуханием по давности лайка) и считает скоры кандидатов
+батчевым умножением матриц. Обновляется инкрементально по водяным знакам posts.id / post_likes.id
+и хукам из эндпоинтов; раз в REC_REBUILD_SECONDS полностью перестраивается (удаления, отписки из других воркеров).
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from cache import TTLCache
+from database import get_db, get_db_type
+from social_graph import USE_FRIEND_EDGES, social_graph
+
+# numpy (~0.1 с импорта) подгружается при первой загрузке движка в фоне, а не при импорте server.py
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = None
+
+
+def _import_numpy() -> None:
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+if not NUMPY_AVAILABLE:
+    logging.warning("numpy не установлен, рекомендации считаются SQL-запросом")
+
+logger = logging.getLogger(__name__)
+
+REC_SUBSCRIPTION_WEIGHT = float(os.getenv("REC_SUBSCRIPTION_WEIGHT", "1.0"))
+REC_LIKE_WEIGHT = float(os.getenv("REC_LIKE_WEIGHT", "0.5"))
+REC_LIKE_HALF_LIFE_DAYS = float(os.getenv("REC_LIKE_HALF_LIFE_DAYS", "30"))
+REC_POST_HALF_LIFE_DAYS = float(os.getenv("REC_POST_HALF_LIFE_DAYS", "7"))
+REC_FRIEND_BOOST = float(os.getenv("REC_FRIEND_BOOST", "1.0"))
+# Кандидаты и лайки старше окна не учитываются (их вклад после затухания пренебрежимо мал)
+REC_WINDOW_DAYS = float(os.getenv("REC_WINDOW_DAYS", "180"))
+REC_REFRESH_SECONDS = int(os.getenv("REC_REFRESH_SECONDS", "30"))
+REC_REBUILD_SECONDS = int(os.getenv("REC_REBUILD_SECONDS", "3600"))
+# Предел размера промежуточной матрицы (пользователи × ненулевые) при батчевом скоринге
+REC_BATCH_CELLS = int(os.getenv("REC_BATCH_CELLS", "8000000"))
+# Кэш готовых рекомендаций: сколько id храним, сколько они свежие и сколько ещё можно отдавать устаревшими
+REC_CACHE_SIZE = int(os.getenv("REC_CACHE_SIZE", "200"))
+REC_CACHE_TTL_SECONDS = int(os.getenv("REC_CACHE_TTL_SECONDS", "300"))
+REC_CACHE_STALE_SECONDS = int(os.getenv("REC_CACHE_STALE_SECONDS", "3600"))
+REC_CACHE_MAX_USERS = int(os.getenv("REC_CACHE_MAX_USERS", "50000"))
+# Планировщик: кого считаем активным (по users.last_seen) и как часто обходим
+REC_ACTIVE_MINUTES = int(os.getenv("REC_ACTIVE_MINUTES", "30"))
+REC_SCHEDULER_SECONDS = int(os.getenv("REC_SCHEDULER_SECONDS", "60"))
+
+
+def to_epoch(value) -> float:
+    """created_at из БД (datetime в PostgreSQL, строка в SQLite) -> unix-время. Время в БД — UTC."""
+    if value is None:
+        return 0.0
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", ""))
+        except ValueError:
+            return 0.0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class TagAffinityEngine:
+    """Скоринг: score = (P·u + friend_boost·[автор — друг]) · 2^(-возраст поста / half_life).
+
+    P — CSR «пост × тег» (строки добавляются в конец по мере появления постов),
+    u — вектор интересов: подписки с постоянным весом + теги лайков с весом, затухающим по давности лайка.
+    Затухание лайков хранится в «прямой» форме (вес · 2^((t_лайка - ref) / h)), поэтому
+    вектор пользователя обновляется за O(тегов поста) и масштабируется одним множителем при чтении.
+    """
+
+    def __init__(self):
+        self.ready = False
+        # Пока load() читает БД, хуки копятся здесь и повторяются на новом состоянии
+        self._pending: Optional[List[tuple]] = None
+        self._reset()
+
+    def _reset(self):
+        self._ref = time.time()
+        self._tag_col: Dict[int, int] = {}
+        self._row_of: Dict[int, int] = {}
+        self._post_ids = []
+        self._author = []
+        self._created = []
+        self._alive = []
+        self._indptr = [0]
+        self._indices = []
+        self._arrays = None  # numpy-снимок списков выше, пересобирается лениво
+        self._subs: Dict[int, Set[int]] = {}
+        self._likes: Dict[int, Dict[int, float]] = {}
+        self._like_vec: Dict[int, Dict[int, float]] = {}
+        self._last_post_id = 0
+        self._last_like_id = 0
+
+    # ---------- инкрементальные обновления ----------
+
+    def _col(self, tag_id: int) -> int:
+        col = self._tag_col.get(tag_id)
+        if col is None:
+            col = self._tag_col[tag_id] = len(self._tag_col)
+        return col
+
+    def _decay_weight(self, liked_at: float) -> float:
+        return REC_LIKE_WEIGHT * 2.0 ** ((liked_at - self._ref) / (REC_LIKE_HALF_LIFE_DAYS * 86400))
+
+    def _record(self, *event) -> None:
+        if self._pending is not None:
+            self._pending.append(event)
+
+    def add_post(self, post_id: int, author_id: int, created_at: float, tag_ids: Iterable[int]) -> None:
+        tag_ids = tuple(tag_ids)
+        self._record("add_post", post_id, author_id, created_at, tag_ids)
+        if post_id in self._row_of:
+            return
+        self._row_of[post_id] = len(self._post_ids)
+        self._post_ids.append(post_id)
+        self._author.append(author_id)
+        self._created.append(created_at)
+        self._alive.append(True)
+        self._indices.extend(sorted({self._col(t) for t in tag_ids}))
+        self._indptr.append(len(self._indices))
+        self._last_post_id = max(self._last_post_id, post_id)
+        self._arrays = None
+
+    def remove_post(self, post_id: int) -> None:
+        self._record("remove_post", post_id)
+        row = self._row_of.get(post_id)
+        if row is not None and self._alive[row]:
+            self._alive[row] = False
+            self._arrays = None
+
+    def _post_cols(self, post_id: int) -> List[int]:
+        row = self._row_of.get(post_id)
+        if row is None:
+            return []
+        return self._indices[self._indptr[row]:self._indptr[row + 1]]
+
+    def set_like(self, user_id: int, post_id: int, liked: bool, liked_at: Optional[float] = None) -> None:
+        if liked:
+            liked_at = liked_at or time.time()
+        self._record("set_like", user_id, post_id, liked, liked_at)
+        likes = self._likes.setdefault(user_id, {})
+        vec = self._like_vec.setdefault(user_id, {})
+        if liked:
+            if post_id in likes:
+                return
+            likes[post_id] = liked_at
+            sign = 1.0
+        else:
+            liked_at = likes.pop(post_id, None)
+            if liked_at is None:
+                return
+            sign = -1.0
+        w = sign * self._decay_weight(liked_at)
+        for col in self._post_cols(post_id):
+            vec[col] = vec.get(col, 0.0) + w
+
+    def set_subscription(self, user_id: int, tag_id: int, subscribed: bool) -> None:
+        self._record("set_subscription", user_id, tag_id, subscribed)
+        subs = self._subs.setdefault(user_id, set())
+        if subscribed:
+            subs.add(tag_id)
+            self._col(tag_id)
+        else:
+            subs.discard(tag_id)
+
+    def liked_post_ids(self, user_id: int) -> Set[int]:
+        return set(self._likes.get(user_id, ()))
+
+    # ---------- скоринг ----------
+
+    def _snapshot(self):
+        if self._arrays is None:
+            self._arrays = {
+                "post_ids": np.asarray(self._post_ids, dtype=np.int64),
+                "author": np.asarray(self._author, dtype=np.int64),
+                "created": np.asarray(self._created, dtype=np.float64),
+                "alive": np.asarray(self._alive, dtype=bool),
+                "indptr": np.asarray(self._indptr, dtype=np.int64),
+                "indices": np.asarray(self._indices, dtype=np.int64),
+            }
+        return self._arrays
+
+    def interest_matrix(self, user_ids: List[int], now: float):
+        """Плотная матрица интересов (пользователи × теги)."""
+        n_tags = max(len(self._tag_col), 1)
+        U = np.zeros((len(user_ids), n_tags), dtype=np.float32)
+        scale = 2.0 ** ((self._ref - now) / (REC_LIKE_HALF_LIFE_DAYS * 86400))
+        for i, uid in enumerate(user_ids):
+            vec = self._like_vec.get(uid)
+            if vec:
+                cols = np.fromiter(vec.keys(), dtype=np.int64, count=len(vec))
+                vals = np.fromiter(vec.values(), dtype=np.float64, count=len(vec))
+                U[i, cols] += np.maximum(vals * scale, 0.0)
+            for tag_id in self._subs.get(uid, ()):
+                col = self._tag_col.get(tag_id)
+                if col is not None:
+                    U[i, col] += REC_SUBSCRIPTION_WEIGHT
+        return U
+
+    def _affinity(self, U, arr):
+        """P · Uᵀ для CSR P: (пользователи × посты)."""
+        n_rows = len(arr["post_ids"])
+        out = np.zeros((U.shape[0], n_rows), dtype=np.float32)
+        indptr, indices = arr["indptr"], arr["indices"]
+        if len(indices) == 0:
+            return out
+        nonempty = np.flatnonzero(np.diff(indptr))
+        out[:, nonempty] = np.add.reduceat(U[:, indices], indptr[nonempty], axis=1)
+        return out
+
+    def rank_many(self, user_ids: List[int], friends: Dict[int, Set[int]], limit: int,
+                  now: Optional[float] = None) -> Dict[int, List[int]]:
+        """Топ-limit id постов для каждого пользователя, одним батчем на группу пользователей."""
+        now = now or time.time()
+        arr = self._snapshot()
+        if not user_ids or len(arr["post_ids"]) == 0:
+            return {uid: [] for uid in user_ids}
+        in_window = arr["alive"] & (arr["created"] >= now - REC_WINDOW_DAYS * 86400)
+        decay = np.power(2.0, -(now - arr["created"]) / (REC_POST_HALF_LIFE_DAYS * 86400)).astype(np.float32)
+        batch = max(1, REC_BATCH_CELLS // max(len(arr["indices"]), 1))
+        result = {}
+        for start in range(0, len(user_ids), batch):
+            chunk = user_ids[start:start + batch]
+            scores = self._affinity(self.interest_matrix(chunk, now), arr)
+            for i, uid in enumerate(chunk):
+                base = scores[i]
+                fr = friends.get(uid)
+                if fr:
+                    base = base + REC_FRIEND_BOOST * np.isin(arr["author"], np.fromiter(fr, dtype=np.int64, count=len(fr)))
+                mask = in_window & (base > 0) & (arr["author"] != uid)
+                liked = self._likes.get(uid)
+                if liked:
+                    rows = [self._row_of[p] for p in liked if p in self._row_of]
+                    mask[rows] = False
+                cand = np.flatnonzero(mask)
+                if len(cand) == 0:
+                    result[uid] = []
+                    continue
+                final = base[cand] * decay[cand]
+                if len(cand) > limit:
+                    top = np.argpartition(-final, limit - 1)[:limit]
+                    cand, final = cand[top], final[top]
+                order = np.lexsort((-arr["created"][cand], -final))
+                result[uid] = arr["post_ids"][cand[order]].tolist()
+        return result
+
+    def rank(self, user_id: int, friend_ids: Set[int], limit: int) -> List[int]:
+        return self.rank_many([user_id], {user_id: friend_ids}, limit)[user_id]
+
+    # ---------- загрузка из БД ----------
+
+    async def load(self) -> None:
+        """Полная перестройка из posts / post_tags / post_likes / user_tag_subscriptions.
+        Хуки, пришедшие, пока читается БД, повторяются на новом состоянии (все они идемпотентны)."""
+        _import_numpy()
+        events: List[tuple] = []
+        self._pending = events
+        try:
+            fresh, n_likes = await self._build()
+        finally:
+            self._pending = None
+        self.__dict__.update(fresh.__dict__)
+        for method, *args in events:
+            getattr(self, method)(*args)
+        logger.info("Рекомендации: загружено %d постов, %d тегов, %d лайков",
+                    len(self._post_ids), len(self._tag_col), n_likes)
+
+    async def _build(self) -> Tuple["TagAffinityEngine", int]:
+        fresh = TagAffinityEngine()
+        since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=REC_WINDOW_DAYS)
+        db_type = get_db_type()
+        async with get_db() as conn:
+            if db_type == 'postgresql':
+                posts = [tuple(r) for r in await conn.fetch("SELECT id, author_id, created_at FROM posts ORDER BY id")]
+                post_tags = [tuple(r) for r in await conn.fetch("SELECT post_id, tag_id FROM post_tags")]
+                subs = [tuple(r) for r in await conn.fetch("SELECT user_id, tag_id FROM user_tag_subscriptions")]
+                likes = [tuple(r) for r in await conn.fetch(
+                    "SELECT id, user_id, post_id, created_at FROM post_likes WHERE created_at >= $1", since
+                )]
+                last_like = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM post_likes")
+            else:
+                async with conn.execute("SELECT id, author_id, created_at FROM posts ORDER BY id") as cur:
+                    posts = await cur.fetchall()
+                async with conn.execute("SELECT post_id, tag_id FROM post_tags") as cur:
+                    post_tags = await cur.fetchall()
+                async with conn.execute("SELECT user_id, tag_id FROM user_tag_subscriptions") as cur:
+                    subs = await cur.fetchall()
+                async with conn.execute(
+                    "SELECT id, user_id, post_id, created_at FROM post_likes WHERE created_at >= ?",
+                    (since.strftime("%Y-%m-%d %H:%M:%S"),)
+                ) as cur:
+                    likes = await cur.fetchall()
+                async with conn.execute("SELECT COALESCE(MAX(id), 0) FROM post_likes") as cur:
+                    last_like = (await cur.fetchone())[0]
+        tags_by_post: Dict[int, List[int]] = {}
+        for post_id, tag_id in post_tags:
+            tags_by_post.setdefault(post_id, []).append(tag_id)
+        for post_id, author_id, created_at in posts:
+            fresh.add_post(post_id, author_id, to_epoch(created_at), tags_by_post.get(post_id, ()))
+        for user_id, tag_id in subs:
+            fresh.set_subscription(user_id, tag_id, True)
+        for _, user_id, post_id, created_at in likes:
+            fresh.set_like(user_id, post_id, True, to_epoch(created_at))
+        fresh._last_like_id = last_like or 0
+        fresh._snapshot()
+        fresh.ready = True
+        return fresh, len(likes)
+
+    async def refresh(self) -> None:
+        """Догрузить новые посты (с тегами) и лайки после водяных знаков."""
+        db_type = get_db_type()
+        async with get_db() as conn:
+            if db_type == 'postgresql':
+                posts = [tuple(r) for r in await conn.fetch(
+                    "SELECT id, author_id, created_at FROM posts WHERE id > $1 ORDER BY id", self._last_post_id
+                )]
+                post_tags = [tuple(r) for r in await conn.fetch(
+                    "SELECT post_id, tag_id FROM post_tags WHERE post_id > $1", self._last_post_id
+                )]
+                likes = [tuple(r) for r in await conn.fetch(
+                    "SELECT id, user_id, post_id, created_at FROM post_likes WHERE id > $1 ORDER BY id", self._last_like_id
+                )]
+            else:
+                async with conn.execute(
+                    "SELECT id, author_id, created_at FROM posts WHERE id > ? ORDER BY id", (self._last_post_id,)
+                ) as cur:
+                    posts = await cur.fetchall()
+                async with conn.execute(
+                    "SELECT post_id, tag_id FROM post_tags WHERE post_id > ?", (self._last_post_id,)
+                ) as cur:
+                    post_tags = await cur.fetchall()
+                async with conn.execute(
+                    "SELECT id, user_id, post_id, created_at FROM post_likes WHERE id > ? ORDER BY id", (self._last_like_id,)
+                ) as cur:
+                    likes = await cur.fetchall()
+        tags_by_post: Dict[int, List[int]] = {}
+        for post_id, tag_id in post_tags:
+            tags_by_post.setdefault(post_id, []).append(tag_id)
+        for post_id, author_id, created_at in posts:
+            self.add_post(post_id, author_id, to_epoch(created_at), tags_by_post.get(post_id, ()))
+        for like_id, user_id, post_id, created_at in likes:
+            self.set_like(user_id, post_id, True, to_epoch(created_at))
+            self._last_like_id = max(self._last_like_id, like_id)
+
+
+recommendation_engine = TagAffinityEngine()
+
+
+async def run_recommendation_refresh() -> None:
+    """Первичная загрузка движка и фоновое обновление: инкрементально каждые REC_REFRESH_SECONDS, полностью — раз в REC_REBUILD_SECONDS."""
+    if not NUMPY_AVAILABLE:
+        return
+    try:
+        await asyncio.to_thread(_import_numpy)
+        await recommendation_engine.load()
+    except Exception as e:
+        logger.warning("Не удалось загрузить движок рекомендаций: %s", e)
+    last_rebuild = time.monotonic()
+    while True:
+        await asyncio.sleep(REC_REFRESH_SECONDS)
+        try:
+            if time.monotonic() - last_rebuild >= REC_REBUILD_SECONDS:
+                await recommendation_engine.load()
+                last_rebuild = time.monotonic()
+            else:
+                await recommendation_engine.refresh()
+        except Exception as e:
+            logger.warning("Не удалось обновить движок рекомендаций: %s", e)
+
+
+# ---------- кэш готовых рекомендаций ----------
+
+recommendation_cache = TTLCache(
+    ttl=REC_CACHE_TTL_SECONDS, maxsize=REC_CACHE_MAX_USERS, stale_ttl=REC_CACHE_STALE_SECONDS
+)
+_revalidating: Set[int] = set()
+
+
+async def _friends_of(conn, db_type: str, user_ids: List[int]) -> Dict[int, Set[int]]:
+    """Друзья (принятые заявки) сразу для нескольких пользователей одним запросом."""
+    out: Dict[int, Set[int]] = {uid: set() for uid in user_ids}
+    if not user_ids:
+        return out
+    if USE_FRIEND_EDGES:
+        if db_type == 'postgresql':
+            rows = await conn.fetch(
+                "SELECT user_id, friend_id FROM friend_edges WHERE user_id = ANY($1::int[])", user_ids
+            )
+            pairs = [(r["user_id"], r["friend_id"]) for r in rows]
+        else:
+            async with conn.execute(
+                f"SELECT user_id, friend_id FROM friend_edges WHERE user_id IN ({','.join(['?'] * len(user_ids))})",
+                user_ids
+            ) as cur:
+                pairs = await cur.fetchall()
+        for a, b in pairs:
+            out[a].add(b)
+        return out
+    if db_type == 'postgresql':
+        rows = await conn.fetch(
+            "SELECT requester_id, addressee_id FROM friendships WHERE status = 'accepted' "
+            "AND (requester_id = ANY($1::int[]) OR addressee_id = ANY($1::int[]))",
+            user_ids
+        )
+        pairs = [(r["requester_id"], r["addressee_id"]) for r in rows]
+    else:
+        ph = ",".join(["?"] * len(user_ids))
+        async with conn.execute(
+            f"SELECT requester_id, addressee_id FROM friendships WHERE status = 'accepted' "
+            f"AND (requester_id IN ({ph}) OR addressee_id IN ({ph}))",
+            (*user_ids, *user_ids)
+        ) as cur:
+            pairs = await cur.fetchall()
+    for a, b in pairs:
+        if a in out:
+            out[a].add(b)
+        if b in out:
+            out[b].add(a)
+    return out
+
+
+async def compute_recommendations(user_ids: List[int]) -> Dict[int, List[int]]:
+    """Пересчитать и положить в кэш рекомендации для пачки пользователей."""
+    if social_graph.ready:
+        friends = {uid: set(social_graph.friends(uid)) for uid in user_ids}
+    else:
+        db_type = get_db_type()
+        async with get_db() as conn:
+            friends = await _friends_of(conn, db_type, user_ids)
+    ranked = recommendation_engine.rank_many(user_ids, friends, REC_CACHE_SIZE)
+    for uid, ids in ranked.items():
+        recommendation_cache.set(uid, ids)
+    return ranked
+
+
+async def _revalidate(user_id: int) -> None:
+    try:
+        await compute_recommendations([user_id])
+    except Exception as e:
+        logger.warning("Не удалось обновить рекомендации пользователя %s: %s", user_id, e)
+    finally:
+        _revalidating.discard(user_id)
+
+
+async def cached_recommendations(user_id: int) -> List[int]:
+    """Ранжированные id постов из кэша. Свежие — сразу; устаревшие — сразу, а пересчёт уходит в фон;
+    отсутствующие — считаются синхронно."""
+    entry = recommendation_cache.get_entry(user_id)
+    if entry is None:
+        return (await compute_recommendations([user_id]))[user_id]
+    ids, age = entry
+    if age > REC_CACHE_TTL_SECONDS and user_id not in _revalidating:
+        _revalidating.add(user_id)
+        asyncio.create_task(_revalidate(user_id))
+    return ids
+
+
+async def _active_user_ids() -> List[int]:
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=REC_ACTIVE_MINUTES)
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            rows = await conn.fetch("SELECT id FROM users WHERE last_seen >= $1", since)
+            return [r["id"] for r in rows]
+        async with conn.execute(
+            "SELECT id FROM users WHERE last_seen >= ?", (since.strftime("%Y-%m-%d %H:%M:%S"),)
+        ) as cur:
+            return [r[0] for r in await cur.fetchall()]
+
+
+async def run_recommendation_scheduler() -> None:
+    """Фоновый прогрев кэша: активным пользователям, у которых запись скоро устареет, пересчитываем заранее."""
+    if not NUMPY_AVAILABLE:
+        return
+    while True:
+        await asyncio.sleep(REC_SCHEDULER_SECONDS)
+        if not recommendation_engine.ready:
+            continue
+        try:
+            due = []
+            for uid in await _active_user_ids():
+                age = recommendation_cache.age(uid)
+                if age is None or age >= REC_CACHE_TTL_SECONDS - REC_SCHEDULER_SECONDS:
+                    due.append(uid)
+            for start in range(0, len(due), 500):
+                await compute_recommendations(due[start:start + 500])
+                await asyncio.sleep(0)
+            if due:
+                logger.info("Рекомендации пересчитаны для %d активных пользователей", len(due))
+        except Exception as e:
+            logger.warning("Планировщик рекомендаций: %s", e)
@@ -0,0 +1,211 @@
+"""
+Жалобы и очередь модерации
+Один пользователь может пожаловаться на цель (post / comment / ...) только один раз
+(уникальный индекс reports(reporter_id, target_type, target_id)), не чаще REPORTS_PER_HOUR жалоб в час.
+Жалобы сворачиваются в report_targets — одна строка на цель: число пожаловавшихся, первая и последняя
+жалоба, приоритет (сумма весов причин, см. REPORT_REASON_WEIGHTS) и гистограмма причин
+в report_target_reasons. Модератор листает цели по приоритету, а не сырые строки reports.
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import get_db, get_db_type, report_reason_key, report_weight
+from pagination import keyset_condition
+
+REPORTS_PER_HOUR = int(os.getenv("REPORTS_PER_HOUR", "20"))
+REPORT_REVIEW_STATUSES = ("dismissed", "actioned")
+
+
+async def submit_report(reporter_id: int, target_type: str, target_id: int, reason: Optional[str]) -> str:
+    """Записать жалобу и учесть её в очереди. Результат: created | duplicate | rate_limited.
+    Повторная жалоба того же пользователя на ту же цель ничего не пишет. Новая жалоба
+    на уже рассмотренную цель возвращает её в очередь (status = pending)."""
+    key = report_reason_key(reason)
+    weight = report_weight(key)
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            async with conn.transaction():
+                recent = await conn.fetchval(
+                    "SELECT COUNT(*) FROM reports WHERE reporter_id = $1 AND created_at > NOW() - INTERVAL '1 hour'",
+                    reporter_id
+                )
+                if recent >= REPORTS_PER_HOUR:
+                    return "rate_limited"
+                report_id = await conn.fetchval(
+                    """INSERT INTO reports (reporter_id, target_type, target_id, reason) VALUES ($1, $2, $3, $4)
+                       ON CONFLICT (reporter_id, target_type, target_id) DO NOTHING RETURNING id""",
+                    reporter_id, target_type, target_id, reason
+                )
+                if report_id is None:
+                    return "duplicate"
+                rt_id = await conn.fetchval(
+                    """INSERT INTO report_targets (target_type, target_id, status, reporters_count, priority, first_reported_at, last_reported_at)
+                       VALUES ($1, $2, 'pending', 1, $3, NOW(), NOW())
+                       ON CONFLICT (target_type, target_id) DO UPDATE SET
+                           status = 'pending',
+                           reporters_count = report_targets.reporters_count + 1,
+                           priority = report_targets.priority + EXCLUDED.priority,
+                           last_reported_at = EXCLUDED.last_reported_at
+                       RETURNING id""",
+                    target_type, target_id, weight
+                )
+                await conn.execute(
+                    """INSERT INTO report_target_reasons (report_target_id, reason, count) VALUES ($1, $2, 1)
+                       ON CONFLICT (report_target_id, reason) DO UPDATE SET count = report_target_reasons.count + 1""",
+                    rt_id, key
+                )
+        else:
+            async with conn.execute(
+                "SELECT COUNT(*) FROM reports WHERE reporter_id = ? AND created_at > datetime('now', '-1 hour')",
+                (reporter_id,)
+            ) as cur:
+                recent = (await cur.fetchone())[0]
+            if recent >= REPORTS_PER_HOUR:
+                return "rate_limited"
+            cur = await conn.execute(
+                """INSERT INTO reports (reporter_id, target_type, target_id, reason) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (reporter_id, target_type, target_id) DO NOTHING""",
+                (reporter_id, target_type, target_id, reason)
+            )
+            if cur.rowcount == 0:
+                return "duplicate"
+            await conn.execute(
+                """INSERT INTO report_targets (target_type, target_id, status, reporters_count, priority, first_reported_at, last_reported_at)
+                   VALUES (?, ?, 'pending', 1, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                   ON CONFLICT (target_type, target_id) DO UPDATE SET
+                       status = 'pending',
+                       reporters_count = reporters_count + 1,
+                       priority = priority + excluded.priority,
+                       last_reported_at = excluded.last_reported_at""",
+                (target_type, target_id, weight)
+            )
+            await conn.execute(
+                """INSERT INTO report_target_reasons (report_target_id, reason, count)
+                   SELECT id, ?, 1 FROM report_targets WHERE target_type = ? AND target_id = ?
+                   ON CONFLICT (report_target_id, reason) DO UPDATE SET count = count + 1""",
+                (key, target_type, target_id)
+            )
+            await conn.commit()
+    return "created"
+
+
+async def sync_targets_for_reports(conn, db_type: str, report_ids: List[int], status: str, admin_id: int, now: datetime) -> None:
+    """После рассмотрения отдельных жалоб (в той же транзакции): их цель получает status,
+    если по ней не осталось жалоб в pending, иначе остаётся в очереди."""
+    if not report_ids:
+        return
+    if db_type == 'postgresql':
+        await conn.execute(
+            """UPDATE report_targets t SET
+                   status = CASE WHEN EXISTS (
+                       SELECT 1 FROM reports r WHERE r.target_type = t.target_type AND r.target_id = t.target_id AND r.status = 'pending'
+                   ) THEN 'pending' ELSE $1 END,
+                   reviewed_by = $2, reviewed_at = $3
+               WHERE (t.target_type, t.target_id) IN (SELECT target_type, target_id FROM reports WHERE id = ANY($4::int[]))""",
+            status, admin_id, now, report_ids
+        )
+    else:
+        await conn.execute(
+            f"""UPDATE report_targets SET
+                    status = CASE WHEN EXISTS (
+                        SELECT 1 FROM reports r WHERE r.target_type = report_targets.target_type
+                            AND r.target_id = report_targets.target_id AND r.status = 'pending'
+                    ) THEN 'pending' ELSE ? END,
+                    reviewed_by = ?, reviewed_at = ?
+                WHERE (target_type, target_id) IN (SELECT target_type, target_id FROM reports WHERE id IN ({','.join('?' * len(report_ids))}))""",
+            (status, admin_id, now.isoformat(), *report_ids)
+        )
+
+
+async def review_target(report_target_id: int, status: str, admin_id: int) -> bool:
+    """Решение по цели целиком: она и все её жалобы в pending получают status. False — цели нет."""
+    now = datetime.utcnow()
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    "UPDATE report_targets SET status = $1, reviewed_by = $2, reviewed_at = $3 WHERE id = $4 RETURNING target_type, target_id",
+                    status, admin_id, now, report_target_id
+                )
+                if row is None:
+                    return False
+                await conn.execute(
+                    """UPDATE reports SET status = $1, reviewed_by = $2, reviewed_at = $3
+                       WHERE target_type = $4 AND target_id = $5 AND status = 'pending'""",
+                    status, admin_id, now, row["target_type"], row["target_id"]
+                )
+        else:
+            async with conn.execute(
+                "SELECT target_type, target_id FROM report_targets WHERE id = ?", (report_target_id,)
+            ) as cur:
+                row = await cur.fetchone()
+            if row is None:
+                return False
+            await conn.execute(
+                "UPDATE report_targets SET status = ?, reviewed_by = ?, reviewed_at = ? WHERE id = ?",
+                (status, admin_id, now.isoformat(), report_target_id)
+            )
+            await conn.execute(
+                """UPDATE reports SET status = ?, reviewed_by = ?, reviewed_at = ?
+                   WHERE target_type = ? AND target_id = ? AND status = 'pending'""",
+                (status, admin_id, now.isoformat(), row[0], row[1])
+            )
+            await conn.commit()
+    return True
+
+
+async def list_queue(
+    status: str, after: Optional[List[Any]], limit: int, target_type: Optional[str] = None
+) -> Tuple[List[dict], Optional[List[Any]]]:
+    """Страница целей по убыванию приоритета (при равном — новее выше) и ключ следующей страницы
+    [priority, id]. У каждой цели — гистограмма причин {причина: число}."""
+    db_type = get_db_type()
+    pg = db_type == 'postgresql'
+    where, params = ["t.status = " + ("$1" if pg else "?")], [status]
+    if target_type:
+        params.append(target_type)
+        where.append("t.target_type = " + (f"${len(params)}" if pg else "?"))
+    if after:
+        cond, cond_params = keyset_condition(["t.priority", "t.id"], after, db_type, len(params) + 1, desc=True)
+        where.append(cond)
+        params += cond_params
+    params.append(limit + 1)
+    sql = (f"""SELECT t.id, t.target_type, t.target_id, t.status, t.reporters_count, t.priority,
+                      t.first_reported_at, t.last_reported_at
+               FROM report_targets t WHERE {' AND '.join(where)}
+               ORDER BY t.priority DESC, t.id DESC LIMIT """ + (f"${len(params)}" if pg else "?"))
+    columns = ["id", "target_type", "target_id", "status", "reporters_count", "priority",
+               "first_reported_at", "last_reported_at"]
+    async with get_db() as conn:
+        if pg:
+            items = [dict(r) for r in await conn.fetch(sql, *params)]
+        else:
+            async with conn.execute(sql, params) as cur:
+                items = [dict(zip(columns, r)) for r in await cur.fetchall()]
+        next_key = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_key = [items[-1]["priority"], items[-1]["id"]]
+        reasons: Dict[int, Dict[str, int]] = {it["id"]: {} for it in items}
+        if items:
+            ids = list(reasons)
+            if pg:
+                rows = await conn.fetch(
+                    "SELECT report_target_id, reason, count FROM report_target_reasons WHERE report_target_id = ANY($1::int[])",
+                    ids
+                )
+                rows = [(r["report_target_id"], r["reason"], r["count"]) for r in rows]
+            else:
+                async with conn.execute(
+                    f"SELECT report_target_id, reason, count FROM report_target_reasons WHERE report_target_id IN ({','.join('?' * len(ids))})",
+                    ids
+                ) as cur:
+                    rows = await cur.fetchall()
+            for rt_id, reason, count in rows:
+                reasons[rt_id][reason] = count
+    for it in items:
+        it["reasons"] = dict(sorted(reasons[it["id"]].items(), key=lambda kv: -kv[1]))
+    return items, next_key
@@ -0,0 +1,60 @@
+"""
+Полнотекстовый поиск по постам и постам групп
+PostgreSQL: сгенерированная колонка search_tsv (russian + english) с GIN-индексом.
+SQLite: FTS5 external-content таблицы posts_fts / group_posts_fts, синхронизируемые триггерами.
+Ранжирование: релевантность с затуханием по возрасту поста.
+"""
+import html
+import math
+import os
+import re
+from typing import Optional
+
+# Через сколько дней релевантность поста «стоит» вдвое меньше свежего
+SEARCH_RECENCY_HALF_LIFE_DAYS = float(os.getenv("SEARCH_RECENCY_HALF_LIFE_DAYS", "30"))
+# Множитель для epoch-секунд: score = ln(relevance) + created_at_epoch * RECENCY_PER_SECOND
+RECENCY_PER_SECOND = math.log(2) / (SEARCH_RECENCY_HALF_LIFE_DAYS * 86400)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Границы совпадения, которые вставляют ts_headline / snippet(): символы из Private Use Area,
+# чтобы сначала экранировать текст сообщения целиком и только потом превратить их в <mark>
+SNIPPET_START = "\ue000"
+SNIPPET_STOP = "\ue001"
+
+
+def search_score(relevance, epoch) -> float:
+    """Итоговый скор: логарифм релевантности плюс «свежесть».
+    Зависит только от строки, поэтому годится как ключ keyset-пагинации."""
+    rel = max(float(relevance or 0.0), 1e-6)
+    return math.log(rel) + float(epoch or 0) * RECENCY_PER_SECOND
+
+
+def render_snippet(text: Optional[str]) -> str:
+    """Фрагмент с границами SNIPPET_START / SNIPPET_STOP -> безопасный HTML: экранированный текст и <mark>…</mark>."""
+    escaped = html.escape(text or "", quote=False)
+    return escaped.replace(SNIPPET_START, "<mark>").replace(SNIPPET_STOP, "</mark>")
+
+
+def fts5_query(q: str) -> Optional[str]:
+    """Пользовательский ввод -> безопасный MATCH-запрос FTS5.
+    Каждое слово берётся в кавычки (никакого синтаксиса FTS5 от клиента), последнее — как префикс."""
+    tokens = _TOKEN_RE.findall(q or "")
+    if not tokens:
+        return None
+    parts = ['"%s"' % t for t in tokens[:-1]]
+    parts.append('"%s"*' % tokens[-1])
+    return " ".join(parts)
+
+
+async def sqlite_fts_ready(conn, table: str) -> bool:
+    """Есть ли FTS5-индекс для таблицы (на сборках SQLite без FTS5 миграция его не создаёт)."""
+    async with conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",)
+    ) as cursor:
+        return await cursor.fetchone() is not None
+
+
+async def register_sqlite_functions(conn) -> None:
+    """Регистрирует search_score() на SQLite-подключении (у каждого get_db() своё подключение)."""
+    await conn.create_function("search_score", 2, search_score, deterministic=True)
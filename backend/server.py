@@ -1,5 +1,6 @@
+from startup_profile import startup_profile  # первым: отсчёт фаз импорта
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, UploadFile, File, Query, Request, Header
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -11,18 +12,51 @@ import hashlib
 import hmac
 from pathlib import Path
 from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import re
 import random
 import secrets
 import uuid
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
 import json
 from jose import jwt, JWTError
 import bcrypt
+startup_profile.mark("импорт: fastapi, pydantic, jose, bcrypt")
 
 # Импортируем нашу систему БД
-from database import get_db, init_db, close_db, get_db_type
+from database import (
+    get_db, init_db, close_db, get_db_type, build_comments_preview, COMMENTS_PREVIEW_SIZE, GROUP_SLUG_BASE_MAX,
+    split_group_slug,
+)
+from autocomplete import username_index, refresh_user_in_index, run_username_index_reload, search_usernames_db
+from pagination import (
+    encode_cursor, decode_cursor, cursor_datetime, keyset_condition, CURSOR_TIME, CURSOR_NUMBER,
+)
+from search import (
+    RECENCY_PER_SECOND, SNIPPET_START, SNIPPET_STOP, fts5_query, render_snippet, sqlite_fts_ready,
+    register_sqlite_functions,
+)
+from social_graph import (
+    USE_FRIEND_EDGES, social_graph, friend_ids_subquery, friend_suggestions, invalidate_suggestions,
+    run_social_graph_reload,
+)
+from presence import presence, run_presence_sync
+from stats import read_stats, run_stats_jobs
+from metrics import METRICS, STEPS, metrics, pick_step, query_series, run_metrics_flush
+from export import EXPORTS, EXPORT_FORMATS, build_filters, stream_export, total_rows
+from moderation import BULK_MODERATION_MAX, BulkModerationError, apply_bulk
+from reports import REPORT_REVIEW_STATUSES, list_queue, review_target, submit_report, sync_targets_for_reports
+from comments import THREAD_REPLIES_MAX, insert_comment, load_replies, load_threads
+from likes import toggle_like
+from group_feed import load_group_feed, load_group_posts, next_key
+from cache import TTLCache
+from recommendations import (
+    NUMPY_AVAILABLE, recommendation_engine, recommendation_cache, cached_recommendations,
+    run_recommendation_refresh, run_recommendation_scheduler, to_epoch,
+)
+from background import release_leadership, run_singleton_tasks
+startup_profile.mark("импорт: модули приложения")
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -285,6 +319,7 @@ class PostResponse(BaseModel):
 
 class CommentCreate(BaseModel):
     content: str
+    parent_id: Optional[int] = None  # ответ на комментарий
 
 class CommentResponse(BaseModel):
     id: int
@@ -294,6 +329,9 @@ class CommentResponse(BaseModel):
     avatar_url: Optional[str] = None
     content: str
     created_at: datetime
+    parent_id: Optional[int] = None
+    depth: int = 0
+    reply_count: int = 0
 
 class TagResponse(BaseModel):
     id: int
@@ -338,6 +376,28 @@ class UserFullProfile(BaseModel):
 
 # Максимальный limit для пагинации (защита от тяжёлых запросов)
 PAGINATION_MAX_LIMIT = 100
+# Комментарии к посту: страница по умолчанию и максимум
+COMMENTS_PAGE_LIMIT = 50
+COMMENTS_PAGE_MAX_LIMIT = 200
+# Дальше skip не пускаем: OFFSET читает и выбрасывает все пропущенные строки — листать через cursor
+ADMIN_MAX_OFFSET = 1000
+
+
+def _admin_offset(skip: int, cursor: Optional[str]) -> int:
+    """skip для админских списков: с cursor не используется, без него — только небольшие смещения."""
+    if cursor:
+        return 0
+    if skip > ADMIN_MAX_OFFSET:
+        raise HTTPException(status_code=400, detail=f"skip больше {ADMIN_MAX_OFFSET} — используйте cursor")
+    return skip
+
+
+def _limit_offset_sql(db_type: str, params: list, limit: int, offset: int) -> str:
+    """LIMIT (на одну строку больше — чтобы понять, есть ли следующая страница) и OFFSET."""
+    params += [limit + 1, offset]
+    if db_type == 'postgresql':
+        return f" LIMIT ${len(params) - 1} OFFSET ${len(params)}"
+    return " LIMIT ? OFFSET ?"
 
 async def _start_telegram_bot():
     """Запускает Telegram-бот в режиме long-polling внутри того же event loop.
@@ -436,6 +496,7 @@ async def _start_telegram_bot():
 @app.on_event("startup")
 async def startup_event():
     """Инициализация при старте приложения"""
+    import asyncio as _asyncio
     if os.getenv("JWT_SECRET") in (None, "", "dev_secret_change_me"):
         logging.warning(
             "JWT_SECRET is default or unset. Set JWT_SECRET in production!"
@@ -444,19 +505,41 @@ async def startup_event():
         logging.warning(
             "Почта не настроена: заполни backend/mail.env (SMTP_HOST, SMTP_USER, SMTP_PASSWORD). См. backend/КАК_ЗАПОЛНИТЬ_ПОЧТУ.md"
         )
+    # Telegram (aiogram) и пересчёт статистики — только в одном воркере, см. background.py
+    singleton_tasks = [run_stats_jobs]
     if not TELEGRAM_BOT_TOKEN:
         logging.warning("Telegram не настроен: нет TELEGRAM_BOT_TOKEN в backend/telegram.env")
     else:
-        import asyncio as _asyncio
-        _asyncio.create_task(_start_telegram_bot())
-    await init_db()
+        singleton_tasks.append(_start_telegram_bot)
+    with startup_profile.phase("init_db (миграции)"):
+        await init_db()
     db_type = get_db_type()
     logging.info(f"Database initialized: {db_type}")
+    # Индексы в памяти прогреваются в фоне: до загрузки эндпоинты идут в БД
+    _asyncio.create_task(run_username_index_reload())
+    _asyncio.create_task(run_recommendation_refresh())
+    _asyncio.create_task(run_recommendation_scheduler())
+    _asyncio.create_task(run_social_graph_reload())
+    _asyncio.create_task(run_presence_sync())
+    _asyncio.create_task(run_metrics_flush())
+    _asyncio.create_task(run_singleton_tasks(singleton_tasks))
+    startup_profile.mark("запуск фоновых задач")
+    startup_profile.report()
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     """Закрытие пула подключений при остановке"""
+    # Каждый буфер сохраняется отдельно: сбой одного не должен терять данные другого
+    try:
+        await presence.flush()
+    except Exception as e:
+        logging.warning(f"Не удалось сохранить активность пользователей: {e}")
+    try:
+        await metrics.flush(final=True)
+    except Exception as e:
+        logging.warning(f"Не удалось сохранить метрики: {e}")
+    release_leadership()
     await close_db()
     logging.info("Database connections closed")
 
@@ -495,22 +578,6 @@ def _datetime_to_iso_utc(dt):
         return dt.isoformat() + "Z"
     return dt.isoformat().replace("+00:00", "Z")
 
-def get_status_from_last_seen(last_seen) -> str:
-    """online = последние 5 мин, inactive = 5–30 мин, offline = >30 мин или NULL."""
-    if last_seen is None:
-        return "offline"
-    try:
-        now = datetime.utcnow()
-        ls = last_seen.replace(tzinfo=None) if getattr(last_seen, "tzinfo", None) else last_seen
-        delta = (now - ls).total_seconds()
-        if delta <= 300:
-            return "online"
-        if delta <= 1800:
-            return "inactive"
-    except Exception:
-        pass
-    return "offline"
-
 async def get_current_user_id(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     x_device_id: Optional[str] = Header(None, alias="X-Device-Id"),
@@ -531,11 +598,9 @@ async def get_current_user_id(
                 row = await cursor.fetchone()
                 if not row:
                     raise HTTPException(status_code=401, detail="User not found")
-        # Обновляем last_seen при каждом запросе — тогда статус «В сети» реальный
-        if db_type == 'postgresql':
-            await conn.execute("UPDATE users SET last_seen = NOW() WHERE id = $1", user_id)
-        else:
-            await conn.execute("UPDATE users SET last_seen = datetime('now') WHERE id = ?", (user_id,))
+        # Активность для статуса «В сети» — в памяти, в users.last_seen пишется пачкой (presence.py)
+        presence.touch(user_id)
+        metrics.mark_active(user_id)
         # Механика устройств безопасности: обновить время последнего использования устройства
         if x_device_id:
             try:
@@ -645,6 +710,8 @@ async def register_user(data: RegisterInput):
             )
             await conn.commit()
             user_id = cursor.lastrowid
+    username_index.add(user_id, data.username)
+    metrics.record("registrations")
     _send_verification_email(data.email, verification_code)
     # Возвращаем pending_token — фронт редиректит на /verify-email?t=TOKEN
     return {"id": user_id, "username": data.username, "email": data.email, "avatar_url": None, "pending_token": pt}
@@ -687,6 +754,7 @@ async def login_user(request: Request, data: LoginInput):
         if user.get("is_banned"):
             raise HTTPException(status_code=403, detail="Account is banned")
         token = create_access_token({"sub": str(user["id"])})
+        metrics.record("logins")
         device_id = None
         name = (data.device_name and data.device_name.strip())[:255] if data.device_name else (user_agent[:255] if user_agent else "Устройство")
         if not name:
@@ -792,6 +860,7 @@ async def verify_email(data: VerifyEmailInput):
             )
             await conn.commit()
     access_token = create_access_token({"sub": str(user_id)})
+    metrics.record("logins")
     return VerifyEmailResponse(verified=True, access_token=access_token, token_type="bearer", device_id=None)
 
 @api_router.post("/auth/send-verification-email")
@@ -1042,6 +1111,7 @@ async def telegram_verify_check_anon(t: str):
             await conn.execute("UPDATE users SET pending_token=NULL WHERE id=?", (uid,))
             await conn.commit()
     access_token = create_access_token(uid)
+    metrics.record("logins")
     return {"verified": True, "access_token": access_token, "token_type": "bearer"}
 
 
@@ -1232,19 +1302,13 @@ async def get_me(user_id: int = Depends(get_current_user_id)):
         if db_type == 'postgresql' and row:
             row.setdefault("is_admin", False)
             row.setdefault("is_banned", False)
-        row["status"] = get_status_from_last_seen(row.get("last_seen"))
+        row["status"] = presence.status(row["id"], row.get("last_seen"))
         return row
 
 @api_router.post("/users/me/ping")
 async def ping_activity(user_id: int = Depends(get_current_user_id)):
     """Обновить last_seen текущего пользователя (вызывать периодически с фронта)."""
-    db_type = get_db_type()
-    async with get_db() as conn:
-        if db_type == 'postgresql':
-            await conn.execute("UPDATE users SET last_seen = NOW() WHERE id = $1", user_id)
-        else:
-            await conn.execute("UPDATE users SET last_seen = datetime('now') WHERE id = ?", (user_id,))
-            await conn.commit()
+    presence.touch(user_id)
     return {"status": "ok"}
 
 
@@ -1433,7 +1497,7 @@ async def get_user_by_username(username: str, _uid: int = Depends(get_current_us
                     row = None
         if not row:
             raise HTTPException(status_code=404, detail="User not found")
-        row["status"] = get_status_from_last_seen(row.get("last_seen"))
+        row["status"] = presence.status(row["id"], row.get("last_seen"))
         # Приватность: для чужого профиля скрываем телефон/почту по настройкам
         if row.get("id") != _uid:
             if row.get("hide_phone"):
@@ -1493,10 +1557,35 @@ async def search_users(q: Optional[str] = None, _uid: int = Depends(get_current_
                     rows_data = await cursor.fetchall()
                     rows = [{"id": r[0], "username": r[1], "email": r[2], "avatar_url": r[3], "last_seen": r[4] if len(r) > 4 else None, "is_official": bool(r[5]) if len(r) > 5 else False, "is_moderator": bool(r[6]) if len(r) > 6 else False} for r in rows_data]
         for r in rows:
-            r["status"] = get_status_from_last_seen(r.get("last_seen"))
+            r["status"] = presence.status(r["id"], r.get("last_seen"))
         return [UserSearchResponse(**r) for r in rows]
 
 
+@api_router.get("/users/presence")
+async def get_users_presence(
+    ids: List[int] = Query(..., max_length=500),
+    _uid: int = Depends(get_current_user_id),
+):
+    """Статусы присутствия пачки пользователей (для списков друзей и диалогов) — без запросов к БД.
+    Ответ: {"presence": {id: {"status": online|inactive|offline, "last_seen": ISO или null}}}."""
+    return {"presence": presence.bulk(ids)}
+
+
+@api_router.get("/users/autocomplete")
+async def autocomplete_users(
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(10, ge=1, le=50),
+    _uid: int = Depends(get_current_user_id),
+):
+    """Автодополнение @упоминаний по префиксу username из индекса в памяти (без запросов к БД).
+    Пока индекс загружается после старта воркера — тот же поиск запросом к БД.
+    Для полнотекстового поиска по подстроке — /users/search."""
+    if not username_index.loaded:
+        async with get_db() as conn:
+            return await search_usernames_db(conn, get_db_type(), q, limit=limit, exclude_id=_uid)
+    return username_index.search(q, limit=limit, exclude_id=_uid)
+
+
 @api_router.get("/users/{id}")
 async def get_user_by_id(id: int, _uid: int = Depends(get_current_user_id)):
     """Получить данные пользователя по ID"""
@@ -1540,7 +1629,7 @@ async def get_user_by_id(id: int, _uid: int = Depends(get_current_user_id)):
                     row = None
             if not row:
                 raise HTTPException(status_code=404, detail="User not found")
-        row["status"] = get_status_from_last_seen(row.get("last_seen"))
+        row["status"] = presence.status(row["id"], row.get("last_seen"))
         # Приватность: для чужого профиля скрываем телефон/почту по настройкам
         if id != _uid:
             if row.get("hide_phone"):
@@ -1730,6 +1819,8 @@ async def update_me(data: UserUpdate, user_id: int = Depends(get_current_user_id
         
         if not row:
             raise HTTPException(status_code=404, detail="User not found")
+        if data.username is not None:
+            await refresh_user_in_index(conn, db_type, user_id)
         if email_change_code and data.email:
             _send_verification_email(data.email, email_change_code)
         return row
@@ -1948,6 +2039,7 @@ async def create_notification(user_id: int, notif_type: str, actor_id: int, targ
 async def send_friend_request(data: FriendAction, user_id: int = Depends(get_current_user_id)):
     if data.user_id == user_id:
         raise HTTPException(status_code=400, detail="Cannot friend yourself")
+    # Проверки — только по БД: граф этого воркера не видит изменений из других до перезагрузки
     db_type = get_db_type()
     async with get_db() as conn:
         # Avoid duplicates and normalize requester/addressee pair
@@ -1967,6 +2059,8 @@ async def send_friend_request(data: FriendAction, user_id: int = Depends(get_cur
                     raise HTTPException(status_code=400, detail="Request already sent")
                 if row["addressee_id"] == user_id and row["status"] == 'pending':
                     await conn.execute("UPDATE friendships SET status='accepted' WHERE id=$1", row["id"])
+                    social_graph.add_friendship(user_id, data.user_id)
+                    invalidate_suggestions(user_id, data.user_id)
                     return {"status": "accepted"}
         else:
             async with conn.execute(
@@ -1987,6 +2081,8 @@ async def send_friend_request(data: FriendAction, user_id: int = Depends(get_cur
                 if row["addressee_id"] == user_id and row["status"] == 'pending':
                     await conn.execute("UPDATE friendships SET status='accepted' WHERE id=?", (row["id"],))
                     await conn.commit()
+                    social_graph.add_friendship(user_id, data.user_id)
+                    invalidate_suggestions(user_id, data.user_id)
                     return {"status": "accepted"}
 
         # create new pending
@@ -2001,6 +2097,8 @@ async def send_friend_request(data: FriendAction, user_id: int = Depends(get_cur
                 (user_id, data.user_id,)
             )
             await conn.commit()
+        social_graph.add_request(user_id, data.user_id)
+        invalidate_suggestions(user_id, data.user_id)
         
         # Создаём уведомление для получателя заявки
         await create_notification(
@@ -2030,6 +2128,8 @@ async def accept_friend_request(data: FriendAction, user_id: int = Depends(get_c
             await conn.commit()
             if conn.total_changes == 0:
                 raise HTTPException(status_code=404, detail="Request not found")
+        social_graph.add_friendship(user_id, data.user_id)
+        invalidate_suggestions(user_id, data.user_id)
         
         # Создаём уведомление для отправителя заявки
         await create_notification(
@@ -2055,12 +2155,171 @@ async def remove_friend(data: FriendAction, user_id: int = Depends(get_current_u
                 (user_id, data.user_id, data.user_id, user_id)
             )
             await conn.commit()
-            return {"status": "removed"}
+    social_graph.remove_friendship(user_id, data.user_id)
+    invalidate_suggestions(user_id, data.user_id)
+    return {"status": "removed"}
+
+async def _friend_ids(conn, db_type: str, user_id: int) -> List[int]:
+    """Отсортированные id друзей из БД — тот же источник, что и у страниц списка
+    (граф в памяти воркера может отставать от изменений в других воркерах)."""
+    if db_type == 'postgresql':
+        friends_sql, _ = friend_ids_subquery("$1")
+        rows = await conn.fetch(f"SELECT id FROM users WHERE id IN ({friends_sql}) ORDER BY id", user_id)
+        return [r["id"] for r in rows]
+    friends_sql, friends_n = friend_ids_subquery("?")
+    async with conn.execute(
+        f"SELECT id FROM users WHERE id IN ({friends_sql}) ORDER BY id", (user_id,) * friends_n
+    ) as cursor:
+        return [r[0] for r in await cursor.fetchall()]
+
+
+def _friends_version(ids: List[int]) -> str:
+    """Хэш состава списка друзей: клиент сравнивает его с закэшированным и не качает список заново."""
+    return hashlib.sha1(",".join(map(str, ids)).encode("ascii")).hexdigest()[:16]
+
 
 @api_router.get("/friends")
-async def list_friends(user_id: int = Depends(get_current_user_id)):
+async def list_friends(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    sort: Optional[str] = Query(None),
+    mode: Optional[str] = Query(None),
+    version: Optional[str] = None,
+    user_id: int = Depends(get_current_user_id),
+):
+    """Друзья пользователя.
+    Без параметров — весь список по username (как раньше).
+    limit / cursor / sort=username|online — страница {"items", "next_cursor"}: id, username, avatar_url, status;
+    sort=online — по последней активности, сохранённой в users.last_seen (сначала «в сети», затем «недавно»,
+    затем остальные); status — текущий, из памяти.
+    mode=ids — только {"ids", "version"}; если version совпадает с переданным, ids не возвращаются."""
+    if mode is not None and mode not in ("full", "ids"):
+        raise HTTPException(status_code=400, detail="mode должен быть full или ids")
+    if sort is not None and sort not in ("username", "online"):
+        raise HTTPException(status_code=400, detail="sort должен быть username или online")
+    if mode == "ids":
+        async with get_db() as conn:
+            ids = await _friend_ids(conn, get_db_type(), user_id)
+        current = _friends_version(ids)
+        if version == current:
+            return {"ids": None, "version": current, "changed": False}
+        return {"ids": ids, "version": current, "changed": True}
+    if cursor is None and limit is None and sort is None:
+        return await _list_friends_full(user_id)
+    return await _list_friends_page(user_id, sort or "username", cursor, limit or 50)
+
+
+async def _list_friends_page(user_id: int, sort: str, cursor: Optional[str], limit: int) -> dict:
+    db_type = get_db_type()
+    if sort == "username":
+        after = decode_cursor(cursor, (str, int))
+        async with get_db() as conn:
+            if db_type == 'postgresql':
+                friends_sql, _ = friend_ids_subquery("$1")
+                if after:
+                    rows = await conn.fetch(
+                        f"""SELECT id, username, avatar_url, last_seen FROM users
+                            WHERE id IN ({friends_sql}) AND (username > $2 OR (username = $2 AND id > $3))
+                            ORDER BY username, id LIMIT $4""",
+                        user_id, after[0], after[1], limit + 1
+                    )
+                else:
+                    rows = await conn.fetch(
+                        f"SELECT id, username, avatar_url, last_seen FROM users WHERE id IN ({friends_sql}) ORDER BY username, id LIMIT $2",
+                        user_id, limit + 1
+                    )
+                rows = [dict(r) for r in rows]
+            else:
+                friends_sql, friends_n = friend_ids_subquery("?")
+                where, params = f"id IN ({friends_sql})", (user_id,) * friends_n
+                if after:
+                    where += " AND (username > ? OR (username = ? AND id > ?))"
+                    params += (after[0], after[0], after[1])
+                async with conn.execute(
+                    f"SELECT id, username, avatar_url, last_seen FROM users WHERE {where} ORDER BY username, id LIMIT ?",
+                    params + (limit + 1,)
+                ) as cur:
+                    rows = [
+                        {"id": r[0], "username": r[1], "avatar_url": r[2], "last_seen": r[3]}
+                        for r in await cur.fetchall()
+                    ]
+        for r in rows:
+            r["status"] = presence.status(r["id"], r.pop("last_seen"))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1]["username"], rows[-1]["id"]])
+        return {"items": rows, "next_cursor": next_cursor}
+
+    # sort=online: keyset по (last_seen, id) из БД — порядок не зависит от того, когда запрошена страница,
+    # поэтому страницы не пропускают и не повторяют друзей; без last_seen — в конце
+    after = decode_cursor(cursor, (CURSOR_TIME, int))
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            seen = "COALESCE(last_seen, 'epoch'::timestamp)"
+            friends_sql, _ = friend_ids_subquery("$1")
+            params: list = [user_id]
+            where = f"id IN ({friends_sql})"
+            if after:
+                cond, cond_params = keyset_condition(
+                    [seen, "id"], [cursor_datetime(after[0], db_type), after[1]], db_type, 2, desc=True
+                )
+                where += " AND " + cond
+                params += cond_params
+            params.append(limit + 1)
+            rows = [dict(r) for r in await conn.fetch(
+                f"""SELECT id, username, avatar_url, last_seen, {seen} AS seen_key FROM users
+                    WHERE {where} ORDER BY seen_key DESC, id DESC LIMIT ${len(params)}""",
+                *params
+            )]
+        else:
+            seen = "COALESCE(last_seen, '')"
+            friends_sql, friends_n = friend_ids_subquery("?")
+            params = [user_id] * friends_n
+            where = f"id IN ({friends_sql})"
+            if after:
+                cond, cond_params = keyset_condition([seen, "id"], after, db_type, desc=True)
+                where += " AND " + cond
+                params += cond_params
+            async with conn.execute(
+                f"""SELECT id, username, avatar_url, last_seen, {seen} AS seen_key FROM users
+                    WHERE {where} ORDER BY seen_key DESC, id DESC LIMIT ?""",
+                params + [limit + 1]
+            ) as cur:
+                rows = [
+                    {"id": r[0], "username": r[1], "avatar_url": r[2], "last_seen": r[3], "seen_key": r[4]}
+                    for r in await cur.fetchall()
+                ]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]["seen_key"], rows[-1]["id"]])
+    for r in rows:
+        del r["seen_key"]
+        r["status"] = presence.status(r["id"], r.pop("last_seen"))
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+async def _list_friends_full(user_id: int) -> List[dict]:
     db_type = get_db_type()
     async with get_db() as conn:
+        if USE_FRIEND_EDGES:
+            if db_type == 'postgresql':
+                rows = await conn.fetch(
+                    """SELECT u.id, u.username, u.email, u.avatar_url FROM friend_edges e
+                       JOIN users u ON u.id = e.friend_id WHERE e.user_id = $1 ORDER BY u.username""",
+                    user_id
+                )
+                return [dict(r) for r in rows]
+            async with conn.execute(
+                """SELECT u.id, u.username, u.email, u.avatar_url FROM friend_edges e
+                   JOIN users u ON u.id = e.friend_id WHERE e.user_id = ? ORDER BY u.username""",
+                (user_id,)
+            ) as cursor:
+                return [
+                    {"id": r[0], "username": r[1], "email": r[2], "avatar_url": r[3]}
+                    for r in await cursor.fetchall()
+                ]
         if db_type == 'postgresql':
             rows = await conn.fetch(
                 """
@@ -2096,6 +2355,36 @@ async def list_friends(user_id: int = Depends(get_current_user_id)):
                 ]
         return rows
 
+def _comments_preview(value) -> List[dict]:
+    """posts.comments_preview (JSON-текст) -> список последних комментариев для ленты."""
+    if not value:
+        return []
+    return json.loads(value) if isinstance(value, str) else value
+
+
+async def load_comments_previews(conn, db_type: str, rows) -> dict:
+    """post_id -> последние комментарии из posts.comments_preview строк ленты.
+    В превью хранятся только id, user_id, текст и время: имя и аватар авторов читаются из users
+    одним запросом на страницу, поэтому переименование и смена аватара видны сразу."""
+    previews = {r["id"]: _comments_preview(r.get("comments_preview")) for r in rows}
+    user_ids = list({c["user_id"] for items in previews.values() for c in items})
+    if not user_ids:
+        return previews
+    if db_type == 'postgresql':
+        users = {r["id"]: (r["username"], r["avatar_url"]) for r in await conn.fetch(
+            "SELECT id, username, avatar_url FROM users WHERE id = ANY($1::int[])", user_ids
+        )}
+    else:
+        async with conn.execute(
+            f"SELECT id, username, avatar_url FROM users WHERE id IN ({','.join(['?'] * len(user_ids))})", user_ids
+        ) as cursor:
+            users = {r[0]: (r[1], r[2]) for r in await cursor.fetchall()}
+    for items in previews.values():
+        for c in items:
+            c["username"], c["avatar_url"] = users.get(c["user_id"], (None, None))
+    return previews
+
+
 # ===================== Posts API =====================
 @api_router.post("/posts")
 async def create_post(data: PostCreate, user_id: int = Depends(get_current_user_id)):
@@ -2156,6 +2445,8 @@ async def create_post(data: PostCreate, user_id: int = Depends(get_current_user_
                 }
         tags_map = await get_tags_for_posts(conn, db_type, [post_id])
         post_tags = tags_map.get(post_id, [])
+    recommendation_engine.add_post(post_id, user_id, to_epoch(row["created_at"]), [t["id"] for t in post_tags])
+    metrics.record("posts")
     
     return {
         "id": row["id"],
@@ -2166,6 +2457,7 @@ async def create_post(data: PostCreate, user_id: int = Depends(get_current_user_
         "images": json.loads(row["images"]) if row["images"] else [],
         "likes": row["likes_count"],
         "comments": row["comments_count"],
+        "comments_preview": [],
         "liked": False,
         "created_at": row["created_at"],
         "tags": post_tags
@@ -2182,7 +2474,8 @@ async def get_my_posts(user_id: int = Depends(get_current_user_id)):
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url,
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 WHERE p.author_id = $1
@@ -2197,7 +2490,8 @@ async def get_my_posts(user_id: int = Depends(get_current_user_id)):
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url,
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 WHERE p.author_id = ?
@@ -2211,12 +2505,14 @@ async def get_my_posts(user_id: int = Depends(get_current_user_id)):
                     {
                         "id": r[0], "author_id": r[1], "content": r[2], "images": r[3],
                         "likes_count": r[4], "comments_count": r[5], "created_at": r[6],
-                        "username": r[7], "avatar_url": r[8], "liked": bool(r[9])
+                        "username": r[7], "avatar_url": r[8], "liked": bool(r[9]),
+                        "comments_preview": r[10]
                     }
                     for r in rows_data
                 ]
         post_ids = [r["id"] for r in rows]
         tags_map = await get_tags_for_posts(conn, db_type, post_ids)
+        previews = await load_comments_previews(conn, db_type, rows)
     
     return [
         {
@@ -2228,6 +2524,7 @@ async def get_my_posts(user_id: int = Depends(get_current_user_id)):
             "images": json.loads(r["images"]) if r["images"] else [],
             "likes": r["likes_count"],
             "comments": r["comments_count"],
+            "comments_preview": previews.get(r["id"], []),
             "liked": r["liked"],
             "created_at": r["created_at"],
             "tags": tags_map.get(r["id"], [])
@@ -2245,7 +2542,8 @@ async def get_user_posts(target_user_id: int, current_user_id: int = Depends(get
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url,
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 WHERE p.author_id = $2
@@ -2260,7 +2558,8 @@ async def get_user_posts(target_user_id: int, current_user_id: int = Depends(get
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url,
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 WHERE p.author_id = ?
@@ -2274,12 +2573,14 @@ async def get_user_posts(target_user_id: int, current_user_id: int = Depends(get
                     {
                         "id": r[0], "author_id": r[1], "content": r[2], "images": r[3],
                         "likes_count": r[4], "comments_count": r[5], "created_at": r[6],
-                        "username": r[7], "avatar_url": r[8], "liked": bool(r[9])
+                        "username": r[7], "avatar_url": r[8], "liked": bool(r[9]),
+                        "comments_preview": r[10]
                     }
                     for r in rows_data
                 ]
         post_ids = [r["id"] for r in rows]
         tags_map = await get_tags_for_posts(conn, db_type, post_ids)
+        previews = await load_comments_previews(conn, db_type, rows)
     return [
         {
             "id": r["id"],
@@ -2290,6 +2591,7 @@ async def get_user_posts(target_user_id: int, current_user_id: int = Depends(get
             "images": json.loads(r["images"]) if r["images"] else [],
             "likes": r["likes_count"],
             "comments": r["comments_count"],
+            "comments_preview": previews.get(r["id"], []),
             "liked": r["liked"],
             "created_at": r["created_at"],
             "tags": tags_map.get(r["id"], [])
@@ -2308,7 +2610,8 @@ async def get_feed(user_id: int = Depends(get_current_user_id)):
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url, COALESCE(u.is_official, FALSE) AS is_official, COALESCE(u.is_moderator, FALSE) AS is_moderator,
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 ORDER BY p.created_at DESC
@@ -2322,7 +2625,8 @@ async def get_feed(user_id: int = Depends(get_current_user_id)):
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url, COALESCE(u.is_official, 0), COALESCE(u.is_moderator, 0),
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 ORDER BY p.created_at DESC
@@ -2336,12 +2640,13 @@ async def get_feed(user_id: int = Depends(get_current_user_id)):
                         "id": r[0], "author_id": r[1], "content": r[2], "images": r[3],
                         "likes_count": r[4], "comments_count": r[5], "created_at": r[6],
                         "username": r[7], "avatar_url": r[8], "is_official": bool(r[9]), "is_moderator": bool(r[10]),
-                        "liked": bool(r[11])
+                        "liked": bool(r[11]), "comments_preview": r[12]
                     }
                     for r in rows_data
                 ]
         post_ids = [r["id"] for r in rows]
         tags_map = await get_tags_for_posts(conn, db_type, post_ids)
+        previews = await load_comments_previews(conn, db_type, rows)
     
     return [
         {
@@ -2355,6 +2660,7 @@ async def get_feed(user_id: int = Depends(get_current_user_id)):
             "images": json.loads(r["images"]) if r["images"] else [],
             "likes": r["likes_count"],
             "comments": r["comments_count"],
+            "comments_preview": previews.get(r["id"], []),
             "liked": r["liked"],
             "created_at": r["created_at"],
             "tags": tags_map.get(r["id"], [])
@@ -2362,92 +2668,221 @@ async def get_feed(user_id: int = Depends(get_current_user_id)):
         for r in rows
     ]
 
-@api_router.post("/posts/{post_id}/like")
-async def like_post(post_id: int, user_id: int = Depends(get_current_user_id)):
-    """Поставить/убрать лайк посту"""
-    db_type = get_db_type()
-    liked = False
-    likes = 0
 
-    async with get_db() as conn:
-        # Проверяем, что пост существует
-        if db_type == 'postgresql':
-            post_exists = await conn.fetchval("SELECT id FROM posts WHERE id = $1", post_id)
-        else:
-            async with conn.execute("SELECT id FROM posts WHERE id = ?", (post_id,)) as cur:
-                post_exists = await cur.fetchone()
-        if not post_exists:
-            raise HTTPException(status_code=404, detail="Post not found")
+# ===================== Поиск по постам =====================
 
-        # Проверяем, есть ли уже лайк
+@api_router.get("/search/posts")
+async def search_posts(
+    q: str = Query(..., min_length=1, max_length=200),
+    scope: str = Query("posts"),
+    tag: Optional[List[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=50),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Полнотекстовый поиск: scope=posts — посты, scope=groups — посты групп (открытых или где вы участник).
+    Сортировка — релевантность с затуханием по возрасту. tag (можно несколько) — посты хотя бы с одним из тегов.
+    Следующая страница — cursor=next_cursor из ответа."""
+    if scope not in ("posts", "groups"):
+        raise HTTPException(status_code=400, detail="scope должен быть posts или groups")
+    tag_names = [t.strip() for t in (tag or []) if t and t.strip()]
+    if tag_names and scope != "posts":
+        raise HTTPException(status_code=400, detail="Фильтр по тегам доступен только для постов")
+    after = decode_cursor(cursor, (CURSOR_NUMBER, int))
+    table = "posts" if scope == "posts" else "group_posts"
+    db_type = get_db_type()
+    async with get_db() as conn:
         if db_type == 'postgresql':
-            existing = await conn.fetchval(
-                "SELECT id FROM post_likes WHERE post_id = $1 AND user_id = $2",
-                post_id, user_id
-            )
-            if existing:
-                # Убираем лайк
-                await conn.execute("DELETE FROM post_likes WHERE post_id = $1 AND user_id = $2", post_id, user_id)
-                await conn.execute("UPDATE posts SET likes_count = likes_count - 1 WHERE id = $1", post_id)
-                liked = False
+            params = [q, RECENCY_PER_SECOND]
+            where = ["t.search_tsv @@ sq.query"]
+            if scope == "posts":
+                cols = "t.id, t.author_id, t.content, t.images, t.likes_count, t.comments_count, t.comments_preview, t.created_at"
+                if tag_names:
+                    params.append(tag_names)
+                    where.append(
+                        "EXISTS (SELECT 1 FROM post_tags pt JOIN tags tg ON tg.id = pt.tag_id "
+                        f"WHERE pt.post_id = t.id AND tg.name = ANY(${len(params)}::text[]))"
+                    )
             else:
-                # Добавляем лайк
-                await conn.execute(
-                    "INSERT INTO post_likes (post_id, user_id) VALUES ($1, $2)",
-                    post_id, user_id
+                cols = "t.id, t.group_id, t.author_id, t.content, t.media_url, t.created_at"
+                params.append(user_id)
+                where.append(
+                    "EXISTS (SELECT 1 FROM groups g WHERE g.id = t.group_id AND (g.is_private = FALSE OR EXISTS "
+                    f"(SELECT 1 FROM group_members gm WHERE gm.group_id = g.id AND gm.user_id = ${len(params)})))"
                 )
-                await conn.execute("UPDATE posts SET likes_count = likes_count + 1 WHERE id = $1", post_id)
-                liked = True
-                # Создаём уведомление для автора поста
-                post_author = await conn.fetchval("SELECT author_id FROM posts WHERE id = $1", post_id)
-                if post_author and post_author != user_id:
-                    await create_notification(
-                        user_id=post_author,
-                        notif_type="post_like",
-                        actor_id=user_id,
-                        target_id=post_id,
-                        target_type="post",
-                        content="поставил(а) лайк вашему посту"
-                    )
-            
-            likes = await conn.fetchval("SELECT likes_count FROM posts WHERE id = $1", post_id)
-        else:  # sqlite
-            async with conn.execute(
-                "SELECT id FROM post_likes WHERE post_id = ? AND user_id = ?",
-                (post_id, user_id)
-            ) as cursor:
-                existing = await cursor.fetchone()
-            
-            if existing:
-                await conn.execute("DELETE FROM post_likes WHERE post_id = ? AND user_id = ?", (post_id, user_id))
-                await conn.execute("UPDATE posts SET likes_count = likes_count - 1 WHERE id = ?", (post_id,))
-                liked = False
+            keyset = ""
+            if after:
+                params += [float(after[0]), int(after[1])]
+                keyset = f"WHERE (s.score, s.id) < (${len(params) - 1}::float8, ${len(params)}::int)"
+            params.append(limit + 1)
+            rows = await conn.fetch(
+                f"""
+                SELECT s.*, u.username, u.avatar_url FROM (
+                    SELECT {cols},
+                           ln(ts_rank_cd(t.search_tsv, sq.query) + 1e-6)
+                           + EXTRACT(EPOCH FROM t.created_at)::float8 * $2::float8 AS score
+                    FROM {table} t
+                    CROSS JOIN (SELECT websearch_to_tsquery('russian', $1) || websearch_to_tsquery('english', $1) AS query) sq
+                    WHERE {" AND ".join(where)}
+                ) s
+                JOIN users u ON u.id = s.author_id
+                {keyset}
+                ORDER BY s.score DESC, s.id DESC
+                LIMIT ${len(params)}
+                """,
+                *params
+            )
+            rows = [dict(r) for r in rows]
+        else:
+            await register_sqlite_functions(conn)
+            if scope == "posts":
+                cols = "t.id, t.author_id, t.content, t.images, t.likes_count, t.comments_count, t.comments_preview, t.created_at"
             else:
-                await conn.execute(
-                    "INSERT INTO post_likes (post_id, user_id) VALUES (?, ?)",
-                    (post_id, user_id)
+                cols = "t.id, t.group_id, t.author_id, t.content, t.media_url, t.created_at"
+            epoch = "CAST(strftime('%s', t.created_at) AS INTEGER)"
+            if await sqlite_fts_ready(conn, table):
+                match = fts5_query(q)
+                if not match:
+                    return {"items": [], "next_cursor": None}
+                source = f"{table}_fts JOIN {table} t ON t.id = {table}_fts.rowid"
+                score = f"search_score(-bm25({table}_fts), {epoch})"
+                where = [f"{table}_fts MATCH ?"]
+                params = [match]
+            else:
+                source = f"{table} t"
+                score = f"search_score(1, {epoch})"
+                where = ["t.content LIKE ?"]
+                params = [f"%{q.strip()}%"]
+            if tag_names:
+                where.append(
+                    "EXISTS (SELECT 1 FROM post_tags pt JOIN tags tg ON tg.id = pt.tag_id "
+                    f"WHERE pt.post_id = t.id AND tg.name IN ({','.join(['?'] * len(tag_names))}))"
                 )
-                await conn.execute("UPDATE posts SET likes_count = likes_count + 1 WHERE id = ?", (post_id,))
-                liked = True
-                # Создаём уведомление для автора поста
-                async with conn.execute("SELECT author_id FROM posts WHERE id = ?", (post_id,)) as cursor:
-                    author_row = await cursor.fetchone()
-                    post_author = author_row[0] if author_row else None
-                if post_author and post_author != user_id:
-                    await create_notification(
-                        user_id=post_author,
-                        notif_type="post_like",
-                        actor_id=user_id,
-                        target_id=post_id,
-                        target_type="post",
-                        content="поставил(а) лайк вашему посту"
-                    )
-            
+                params += tag_names
+            if scope == "groups":
+                where.append(
+                    "EXISTS (SELECT 1 FROM groups g WHERE g.id = t.group_id AND (g.is_private = 0 OR EXISTS "
+                    "(SELECT 1 FROM group_members gm WHERE gm.group_id = g.id AND gm.user_id = ?)))"
+                )
+                params.append(user_id)
+            keyset = ""
+            if after:
+                keyset = "WHERE (s.score, s.id) < (?, ?)"
+                params += [float(after[0]), int(after[1])]
+            params.append(limit + 1)
+            async with conn.execute(
+                f"""
+                SELECT s.*, u.username, u.avatar_url FROM (
+                    SELECT {cols}, {score} AS score
+                    FROM {source}
+                    WHERE {" AND ".join(where)}
+                ) s
+                JOIN users u ON u.id = s.author_id
+                {keyset}
+                ORDER BY s.score DESC, s.id DESC
+                LIMIT ?
+                """,
+                params
+            ) as cur:
+                names = [d[0] for d in cur.description]
+                rows = [dict(zip(names, r)) for r in await cur.fetchall()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1]["score"], rows[-1]["id"]])
+        ids = [r["id"] for r in rows]
+
+        if scope == "posts":
+            tags_map = await get_tags_for_posts(conn, db_type, ids)
+            previews = await load_comments_previews(conn, db_type, rows)
+            liked = set()
+            if ids:
+                if db_type == 'postgresql':
+                    liked = {r["post_id"] for r in await conn.fetch(
+                        "SELECT post_id FROM post_likes WHERE user_id = $1 AND post_id = ANY($2::int[])", user_id, ids
+                    )}
+                else:
+                    async with conn.execute(
+                        f"SELECT post_id FROM post_likes WHERE user_id = ? AND post_id IN ({','.join(['?'] * len(ids))})",
+                        (user_id, *ids)
+                    ) as cur:
+                        liked = {r[0] for r in await cur.fetchall()}
+            items = [
+                {
+                    "id": r["id"],
+                    "author_id": r["author_id"],
+                    "author_username": r["username"],
+                    "author_avatar": r["avatar_url"],
+                    "content": r["content"],
+                    "images": json.loads(r["images"]) if r["images"] else [],
+                    "likes": r["likes_count"],
+                    "comments": r["comments_count"],
+                    "comments_preview": previews.get(r["id"], []),
+                    "liked": r["id"] in liked,
+                    "created_at": r["created_at"],
+                    "tags": tags_map.get(r["id"], []),
+                }
+                for r in rows
+            ]
+        else:
+            groups = {}
+            gids = sorted({r["group_id"] for r in rows})
+            if gids:
+                if db_type == 'postgresql':
+                    for g in await conn.fetch("SELECT id, name, slug FROM groups WHERE id = ANY($1::int[])", gids):
+                        groups[g["id"]] = {"id": g["id"], "name": g["name"], "slug": g["slug"]}
+                else:
+                    async with conn.execute(
+                        f"SELECT id, name, slug FROM groups WHERE id IN ({','.join(['?'] * len(gids))})", gids
+                    ) as cur:
+                        for g in await cur.fetchall():
+                            groups[g[0]] = {"id": g[0], "name": g[1], "slug": g[2]}
+            items = [
+                {
+                    "id": r["id"],
+                    "group": groups.get(r["group_id"]),
+                    "author_id": r["author_id"],
+                    "author_username": r["username"],
+                    "author_avatar": r["avatar_url"],
+                    "content": r["content"],
+                    "media_url": r["media_url"],
+                    "created_at": r["created_at"] if db_type == 'postgresql' else str(r["created_at"]),
+                }
+                for r in rows
+            ]
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@api_router.post("/posts/{post_id}/like")
+async def like_post(post_id: int, user_id: int = Depends(get_current_user_id)):
+    """Поставить/убрать лайк посту"""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            async with conn.transaction():
+                result = await toggle_like(conn, db_type, post_id, user_id)
+        else:
+            result = await toggle_like(conn, db_type, post_id, user_id)
             await conn.commit()
-            async with conn.execute("SELECT likes_count FROM posts WHERE id = ?", (post_id,)) as cursor:
-                row = await cursor.fetchone()
-                likes = row[0] if row else 0
-    
+    if result is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    liked, changed, likes, post_author = result
+
+    if changed:
+        recommendation_engine.set_like(user_id, post_id, liked)
+    if liked and changed:
+        metrics.record("likes")
+        # После коммита: уведомление пишется через отдельное соединение
+        if post_author != user_id:
+            await create_notification(
+                user_id=post_author,
+                notif_type="post_like",
+                actor_id=user_id,
+                target_id=post_id,
+                target_type="post",
+                content="поставил(а) лайк вашему посту"
+            )
     return {"liked": liked, "likes": likes}
 
 @api_router.get("/posts/{post_id}")
@@ -2461,7 +2896,8 @@ async def get_post(post_id: int, user_id: int = Depends(get_current_user_id)):
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url,
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $2) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $2) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 WHERE p.id = $1
@@ -2476,7 +2912,8 @@ async def get_post(post_id: int, user_id: int = Depends(get_current_user_id)):
                 """
                 SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
                        u.username, u.avatar_url,
-                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked,
+                       p.comments_preview
                 FROM posts p
                 JOIN users u ON u.id = p.author_id
                 WHERE p.id = ?
@@ -2489,11 +2926,13 @@ async def get_post(post_id: int, user_id: int = Depends(get_current_user_id)):
                 row = {
                     "id": r[0], "author_id": r[1], "content": r[2], "images": r[3],
                     "likes_count": r[4], "comments_count": r[5], "created_at": r[6],
-                    "username": r[7], "avatar_url": r[8], "liked": bool(r[9])
+                    "username": r[7], "avatar_url": r[8], "liked": bool(r[9]),
+                    "comments_preview": r[10]
                 }
     
     async with get_db() as conn2:
         tags_map = await get_tags_for_posts(conn2, get_db_type(), [post_id])
+        previews = await load_comments_previews(conn2, get_db_type(), [row])
     post_tags = tags_map.get(post_id, [])
 
     return {
@@ -2505,81 +2944,140 @@ async def get_post(post_id: int, user_id: int = Depends(get_current_user_id)):
         "images": json.loads(row["images"]) if row["images"] else [],
         "likes": row["likes_count"],
         "comments": row["comments_count"],
+        "comments_preview": previews.get(post_id, []),
         "liked": row["liked"],
         "created_at": row["created_at"],
         "tags": post_tags
     }
 
 @api_router.get("/posts/{post_id}/comments", response_model=List[CommentResponse])
-async def get_post_comments(post_id: int, user_id: int = Depends(get_current_user_id)):
-    """Список комментариев к посту."""
+async def get_post_comments(
+    post_id: int,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(COMMENTS_PAGE_LIMIT, ge=1, le=COMMENTS_PAGE_MAX_LIMIT),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Комментарии к посту (включая ответы) от старых к новым, не больше limit.
+    Следующая страница — after_id=id последнего. Дерево веток — /posts/{post_id}/threads."""
     db_type = get_db_type()
     async with get_db() as conn:
         if db_type == 'postgresql':
             rows = await conn.fetch(
-                """SELECT c.id, c.post_id, c.user_id, c.content, c.created_at, u.username, u.avatar_url
+                """SELECT c.id, c.post_id, c.user_id, c.content, c.created_at, u.username, u.avatar_url,
+                          c.parent_id, c.depth, c.reply_count
                    FROM post_comments c JOIN users u ON u.id = c.user_id
-                   WHERE c.post_id = $1 ORDER BY c.created_at ASC""",
-                post_id
+                   WHERE c.post_id = $1 AND c.id > $2 ORDER BY c.id LIMIT $3""",
+                post_id, after_id or 0, limit
             )
-            out = [{"id": r["id"], "post_id": r["post_id"], "user_id": r["user_id"], "username": r["username"], "avatar_url": r["avatar_url"], "content": r["content"], "created_at": r["created_at"]} for r in rows]
+            out = [dict(r) for r in rows]
         else:
             async with conn.execute(
-                """SELECT c.id, c.post_id, c.user_id, c.content, c.created_at, u.username, u.avatar_url
+                """SELECT c.id, c.post_id, c.user_id, c.content, c.created_at, u.username, u.avatar_url,
+                          c.parent_id, c.depth, c.reply_count
                    FROM post_comments c JOIN users u ON u.id = c.user_id
-                   WHERE c.post_id = ? ORDER BY c.created_at ASC""",
-                (post_id,)
+                   WHERE c.post_id = ? AND c.id > ? ORDER BY c.id LIMIT ?""",
+                (post_id, after_id or 0, limit)
             ) as cursor:
                 rows = await cursor.fetchall()
-            out = [{"id": r[0], "post_id": r[1], "user_id": r[2], "content": r[3], "created_at": r[4], "username": r[5], "avatar_url": r[6]} for r in rows]
+            out = [{"id": r[0], "post_id": r[1], "user_id": r[2], "content": r[3], "created_at": r[4], "username": r[5], "avatar_url": r[6], "parent_id": r[7], "depth": r[8], "reply_count": r[9]} for r in rows]
     return [CommentResponse(**x) for x in out]
 
 @api_router.post("/posts/{post_id}/comments", response_model=CommentResponse)
 async def add_post_comment(post_id: int, data: CommentCreate, user_id: int = Depends(get_current_user_id)):
-    """Добавить комментарий к посту."""
-    if not data.content or not data.content.strip():
+    """Добавить комментарий к посту. В той же транзакции обновляются comments_count и comments_preview;
+    время для ответа берётся из выборки для превью (новый комментарий в ней первый)."""
+    content = (data.content or "").strip()
+    if not content:
         raise HTTPException(status_code=400, detail="Content required")
+    preview_sql = """SELECT c.id, c.user_id, c.content, c.created_at FROM post_comments c
+                     WHERE c.post_id = {ph} ORDER BY c.id DESC LIMIT """ + str(COMMENTS_PREVIEW_SIZE)
     db_type = get_db_type()
     async with get_db() as conn:
         if db_type == 'postgresql':
-            post_exists = await conn.fetchval("SELECT id FROM posts WHERE id = $1", post_id)
-            if not post_exists:
-                raise HTTPException(status_code=404, detail="Post not found")
-            cid = await conn.fetchval(
-                "INSERT INTO post_comments (post_id, user_id, content) VALUES ($1, $2, $3) RETURNING id",
-                post_id, user_id, data.content.strip()
-            )
-            await conn.execute("UPDATE posts SET comments_count = comments_count + 1 WHERE id = $1", post_id)
-            row = await conn.fetchrow(
-                "SELECT c.id, c.post_id, c.user_id, c.content, c.created_at, u.username, u.avatar_url FROM post_comments c JOIN users u ON u.id = c.user_id WHERE c.id = $1",
-                cid
-            )
-            row = dict(row)
+            async with conn.transaction():
+                # Блокировка строки поста упорядочивает параллельные комментарии: превью не теряет ни один
+                if not await conn.fetchval("SELECT id FROM posts WHERE id = $1 FOR UPDATE", post_id):
+                    raise HTTPException(status_code=404, detail="Post not found")
+                try:
+                    cid, parent_id, depth = await insert_comment(conn, db_type, post_id, user_id, content, data.parent_id)
+                except LookupError:
+                    raise HTTPException(status_code=404, detail="Comment not found")
+                latest = [tuple(r) for r in await conn.fetch(preview_sql.format(ph="$1"), post_id)]
+                await conn.execute(
+                    "UPDATE posts SET comments_count = comments_count + 1, comments_preview = $2 WHERE id = $1",
+                    post_id, build_comments_preview(latest)
+                )
+            author = await conn.fetchrow("SELECT username, avatar_url FROM users WHERE id = $1", user_id)
         else:
             async with conn.execute("SELECT id FROM posts WHERE id = ?", (post_id,)) as cursor:
                 if not await cursor.fetchone():
                     raise HTTPException(status_code=404, detail="Post not found")
+            try:
+                cid, parent_id, depth = await insert_comment(conn, db_type, post_id, user_id, content, data.parent_id)
+            except LookupError:
+                raise HTTPException(status_code=404, detail="Comment not found")
+            async with conn.execute(preview_sql.format(ph="?"), (post_id,)) as cursor:
+                latest = await cursor.fetchall()
             await conn.execute(
-                "INSERT INTO post_comments (post_id, user_id, content) VALUES (?, ?, ?)",
-                (post_id, user_id, data.content.strip())
+                "UPDATE posts SET comments_count = comments_count + 1, comments_preview = ? WHERE id = ?",
+                (build_comments_preview(latest), post_id)
             )
-            await conn.execute("UPDATE posts SET comments_count = comments_count + 1 WHERE id = ?", (post_id,))
             await conn.commit()
-            cur = await conn.execute(
-                "SELECT id FROM post_comments WHERE post_id = ? AND user_id = ? ORDER BY created_at DESC LIMIT 1",
-                (post_id, user_id)
-            )
-            r = await cur.fetchone()
-            cid = r[0] if r else None
-            async with conn.execute(
-                "SELECT c.id, c.post_id, c.user_id, c.content, c.created_at, u.username, u.avatar_url FROM post_comments c JOIN users u ON u.id = c.user_id WHERE c.id = ?",
-                (cid,)
-            ) as cursor:
-                r = await cursor.fetchone()
-            row = {"id": r[0], "post_id": r[1], "user_id": r[2], "content": r[3], "created_at": r[4], "username": r[5], "avatar_url": r[6]} if r else None
-    if not row:
-        raise HTTPException(status_code=500, detail="Comment not created")
-    return CommentResponse(**row)
+            async with conn.execute("SELECT username, avatar_url FROM users WHERE id = ?", (user_id,)) as cursor:
+                author = await cursor.fetchone()
+    created_at = next(r[3] for r in latest if r[0] == cid)
+    return CommentResponse(id=cid, post_id=post_id, user_id=user_id, username=author[0], avatar_url=author[1],
+                           content=content, created_at=created_at, parent_id=parent_id, depth=depth)
+
+
+def _thread_item(c: dict) -> dict:
+    """Комментарий ветки для ответа API; курсор продолжения ответов — по path последнего показанного."""
+    replies = c.pop("replies", None)
+    path = c.pop("path")
+    if replies is not None:
+        last = replies[-1]["path"] if replies else path + "."
+        c["replies_cursor"] = encode_cursor([last]) if c["reply_count"] > len(replies) else None
+        c["replies"] = [_thread_item(r) for r in replies]
+    return c
+
+
+@api_router.get("/posts/{post_id}/threads")
+async def get_post_threads(
+    post_id: int,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=PAGINATION_MAX_LIMIT),
+    replies: int = Query(3, ge=0, le=THREAD_REPLIES_MAX),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Корневые комментарии поста (от старых к новым) и первые replies ответов каждой ветки
+    в порядке обхода дерева (depth, parent_id — для отступов). reply_count — ответов во всей ветке;
+    остальные — /comments/{id}/replies?cursor=replies_cursor. Следующая страница — after_id=next_after_id."""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        roots, has_more = await load_threads(conn, db_type, post_id, after_id or 0, limit, replies)
+    return {
+        "items": [_thread_item(r) for r in roots],
+        "next_after_id": roots[-1]["id"] if has_more else None,
+    }
+
+
+@api_router.get("/comments/{comment_id}/replies")
+async def get_comment_replies(
+    comment_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Ответы на комментарий (всё поддерево) в порядке обхода дерева, страницами по limit."""
+    after = decode_cursor(cursor, (str,))
+    db_type = get_db_type()
+    async with get_db() as conn:
+        try:
+            rows, has_more = await load_replies(conn, db_type, comment_id, after[0] if after else None, limit)
+        except LookupError:
+            raise HTTPException(status_code=404, detail="Comment not found")
+    next_cursor = encode_cursor([rows[-1]["path"]]) if has_more else None
+    return {"items": [_thread_item(r) for r in rows], "next_cursor": next_cursor}
 
 # ===================== Tags & Subscriptions API =====================
 class TagCreate(BaseModel):
@@ -2661,6 +3159,8 @@ async def subscribe_tag(tag_id: int, user_id: int = Depends(get_current_user_id)
                 (user_id, tag_id)
             )
             await conn.commit()
+    recommendation_engine.set_subscription(user_id, tag_id, True)
+    recommendation_cache.pop(user_id)
     return {"subscribed": True}
 
 
@@ -2674,6 +3174,8 @@ async def unsubscribe_tag(tag_id: int, user_id: int = Depends(get_current_user_i
         else:
             await conn.execute("DELETE FROM user_tag_subscriptions WHERE user_id = ? AND tag_id = ?", (user_id, tag_id))
             await conn.commit()
+    recommendation_engine.set_subscription(user_id, tag_id, False)
+    recommendation_cache.pop(user_id)
     return {"subscribed": False}
 
 
@@ -2698,6 +3200,162 @@ async def my_subscriptions(user_id: int = Depends(get_current_user_id)):
 
 
 # ===================== Recommendations API =====================
+async def _posts_by_ids(conn, db_type: str, user_id: int, post_ids: List[int]) -> List[dict]:
+    """Строки постов (с автором и флагом liked) в порядке post_ids; удалённые пропускаются."""
+    if not post_ids:
+        return []
+    if db_type == 'postgresql':
+        rows = await conn.fetch(
+            """
+            SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
+                   u.username, u.avatar_url,
+                   EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked,
+            p.comments_preview
+            FROM posts p
+            JOIN users u ON u.id = p.author_id
+            WHERE p.id = ANY($2::int[])
+            """,
+            user_id, post_ids
+        )
+        by_id = {r["id"]: dict(r) for r in rows}
+    else:
+        async with conn.execute(
+            f"""
+            SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
+                   u.username, u.avatar_url,
+                   EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked,
+            p.comments_preview
+            FROM posts p
+            JOIN users u ON u.id = p.author_id
+            WHERE p.id IN ({",".join(["?"] * len(post_ids))})
+            """,
+            (user_id, *post_ids)
+        ) as cursor:
+            by_id = {
+                r[0]: {"id": r[0], "author_id": r[1], "content": r[2], "images": r[3], "likes_count": r[4], "comments_count": r[5], "created_at": r[6], "username": r[7], "avatar_url": r[8], "liked": bool(r[9]), "comments_preview": r[10]}
+                for r in await cursor.fetchall()
+            }
+    return [by_id[pid] for pid in post_ids if pid in by_id]
+
+
+async def _recommended_posts_sql(conn, db_type: str, user_id: int, limit: int) -> List[dict]:
+    """Рекомендации одним SQL-запросом — запасной путь, пока движок не загружен или нет numpy."""
+    # 1) Интересные теги: подписки + теги с лайкнутых постов
+    if db_type == 'postgresql':
+        sub_rows = await conn.fetch("SELECT tag_id FROM user_tag_subscriptions WHERE user_id = $1", user_id)
+        liked_tag_rows = await conn.fetch(
+            "SELECT DISTINCT pt.tag_id FROM post_likes pl JOIN post_tags pt ON pt.post_id = pl.post_id WHERE pl.user_id = $1",
+            user_id
+        )
+    else:
+        async with conn.execute("SELECT tag_id FROM user_tag_subscriptions WHERE user_id = ?", (user_id,)) as cursor:
+            sub_rows = await cursor.fetchall()
+        async with conn.execute(
+            "SELECT DISTINCT pt.tag_id FROM post_likes pl JOIN post_tags pt ON pt.post_id = pl.post_id WHERE pl.user_id = ?",
+            (user_id,)
+        ) as cursor:
+            liked_tag_rows = await cursor.fetchall()
+    interest_tag_ids = set()
+    for r in (sub_rows or []):
+        interest_tag_ids.add(r["tag_id"] if db_type == 'postgresql' else r[0])
+    for r in (liked_tag_rows or []):
+        interest_tag_ids.add(r["tag_id"] if db_type == 'postgresql' else r[0])
+    interest_tag_ids = list(interest_tag_ids)
+
+    # 2) Кандидаты: посты не свои, не лайкнутые, (от друзей ИЛИ с совпадающими тегами)
+    rows = []
+    if db_type == 'postgresql':
+        if interest_tag_ids:
+            n = len(interest_tag_ids)
+            tag_ph1 = ",".join(["$" + str(i+3) for i in range(n)])
+            tag_ph2 = ",".join(["$" + str(i+3+n) for i in range(n)])
+            limit_idx = 3 + 2 * n
+            params = [user_id, user_id] + interest_tag_ids + interest_tag_ids + [limit]
+            friends_pg, _ = friend_ids_subquery("$2")
+            q = f"""
+                SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
+                       u.username, u.avatar_url,
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked,
+                       (SELECT COUNT(*) FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({tag_ph1})) as match_count
+                FROM posts p
+                JOIN users u ON u.id = p.author_id
+                WHERE p.author_id != $2
+                  AND NOT EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $2)
+                  AND (
+                    p.author_id IN ({friends_pg})
+                    OR EXISTS(SELECT 1 FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({tag_ph2}))
+                  )
+                ORDER BY match_count DESC, p.created_at DESC
+                LIMIT ${limit_idx}
+            """
+            rows_pg = await conn.fetch(q, *params)
+            rows = [dict(r) for r in rows_pg]
+        else:
+            friends_pg, _ = friend_ids_subquery("$1")
+            rows_pg = await conn.fetch(
+                f"""
+                SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
+                       u.username, u.avatar_url,
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked
+                FROM posts p
+                JOIN users u ON u.id = p.author_id
+                WHERE p.author_id != $1
+                  AND p.author_id IN ({friends_pg})
+                ORDER BY p.created_at DESC
+                LIMIT $2
+                """,
+                user_id, limit
+            )
+            rows = [dict(r) for r in rows_pg]
+    else:
+        if interest_tag_ids:
+            placeholders = ",".join(["?" for _ in interest_tag_ids])
+            friends_sql, friends_n = friend_ids_subquery("?")
+            params = (user_id,) + tuple(interest_tag_ids) + (user_id,) * (2 + friends_n) + tuple(interest_tag_ids) + (limit,)
+            async with conn.execute(
+                f"""
+                SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
+                       u.username, u.avatar_url,
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked,
+                       (SELECT COUNT(*) FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({placeholders})) as match_count
+                FROM posts p
+                JOIN users u ON u.id = p.author_id
+                WHERE p.author_id != ? AND NOT EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?)
+                  AND (p.author_id IN ({friends_sql})
+                       OR EXISTS(SELECT 1 FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({placeholders})))
+                ORDER BY match_count DESC, p.created_at DESC
+                LIMIT ?
+                """,
+                params
+            ) as cursor:
+                rows_data = await cursor.fetchall()
+            rows = [
+                {"id": r[0], "author_id": r[1], "content": r[2], "images": r[3], "likes_count": r[4], "comments_count": r[5], "created_at": r[6], "username": r[7], "avatar_url": r[8], "liked": bool(r[9]), "match_count": r[10] or 0}
+                for r in rows_data
+            ]
+        else:
+            friends_sql, friends_n = friend_ids_subquery("?")
+            async with conn.execute(
+                f"""
+                SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
+                       u.username, u.avatar_url,
+                       EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked
+                FROM posts p
+                JOIN users u ON u.id = p.author_id
+                WHERE p.author_id != ? AND p.author_id IN ({friends_sql})
+                ORDER BY p.created_at DESC
+                LIMIT ?
+                """,
+                (user_id, user_id) + (user_id,) * friends_n + (limit,)
+            ) as cursor:
+                rows_data = await cursor.fetchall()
+            rows = [
+                {"id": r[0], "author_id": r[1], "content": r[2], "images": r[3], "likes_count": r[4], "comments_count": r[5], "created_at": r[6], "username": r[7], "avatar_url": r[8], "liked": bool(r[9])}
+                for r in rows_data
+            ]
+    return rows
+
+
 @api_router.get("/recommendations/posts")
 async def get_recommended_posts(
     user_id: int = Depends(get_current_user_id),
@@ -2706,123 +3364,29 @@ async def get_recommended_posts(
     """
     Рекомендации постов по интересам:
     - теги, на которые подписан пользователь;
-    - теги постов, которые пользователь лайкнул.
-    Посты ранжируются по количеству совпадающих тегов и по дате.
+    - теги постов, которые пользователь лайкнул (с затуханием по давности лайка);
+    - посты друзей получают бонус.
+    Скоры считает движок recommendations.TagAffinityEngine; готовый список держится в кэше
+    (TTL, stale-while-revalidate), активным пользователям его заранее пересчитывает планировщик.
+    Уже лайкнутые посты отфильтровываются при чтении.
     """
     db_type = get_db_type()
+    # Один раз: фоновая загрузка может сделать движок готовым между await-ами ниже
+    use_engine = NUMPY_AVAILABLE and recommendation_engine.ready
+    if use_engine:
+        ranked = await cached_recommendations(user_id)
     async with get_db() as conn:
-        # 1) Интересные теги: подписки + теги с лайкнутых постов
-        if db_type == 'postgresql':
-            sub_rows = await conn.fetch("SELECT tag_id FROM user_tag_subscriptions WHERE user_id = $1", user_id)
-            liked_tag_rows = await conn.fetch(
-                "SELECT DISTINCT pt.tag_id FROM post_likes pl JOIN post_tags pt ON pt.post_id = pl.post_id WHERE pl.user_id = $1",
-                user_id
-            )
-        else:
-            async with conn.execute("SELECT tag_id FROM user_tag_subscriptions WHERE user_id = ?", (user_id,)) as cursor:
-                sub_rows = await cursor.fetchall()
-            async with conn.execute(
-                "SELECT DISTINCT pt.tag_id FROM post_likes pl JOIN post_tags pt ON pt.post_id = pl.post_id WHERE pl.user_id = ?",
-                (user_id,)
-            ) as cursor:
-                liked_tag_rows = await cursor.fetchall()
-        interest_tag_ids = set()
-        for r in (sub_rows or []):
-            interest_tag_ids.add(r["tag_id"] if db_type == 'postgresql' else r[0])
-        for r in (liked_tag_rows or []):
-            interest_tag_ids.add(r["tag_id"] if db_type == 'postgresql' else r[0])
-        interest_tag_ids = list(interest_tag_ids)
-
-        # 2) Кандидаты: посты не свои, не лайкнутые, (от друзей ИЛИ с совпадающими тегами)
-        rows = []
-        if db_type == 'postgresql':
-            if interest_tag_ids:
-                n = len(interest_tag_ids)
-                tag_ph1 = ",".join(["$" + str(i+3) for i in range(n)])
-                tag_ph2 = ",".join(["$" + str(i+3+n) for i in range(n)])
-                limit_idx = 3 + 2 * n
-                params = [user_id, user_id] + interest_tag_ids + interest_tag_ids + [limit]
-                q = f"""
-                    SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
-                           u.username, u.avatar_url,
-                           EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked,
-                           (SELECT COUNT(*) FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({tag_ph1})) as match_count
-                    FROM posts p
-                    JOIN users u ON u.id = p.author_id
-                    WHERE p.author_id != $2
-                      AND NOT EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $2)
-                      AND (
-                        p.author_id IN (SELECT CASE WHEN requester_id = $2 THEN addressee_id ELSE requester_id END FROM friendships WHERE (requester_id = $2 OR addressee_id = $2) AND status = 'accepted')
-                        OR EXISTS(SELECT 1 FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({tag_ph2}))
-                      )
-                    ORDER BY match_count DESC, p.created_at DESC
-                    LIMIT ${limit_idx}
-                """
-                rows_pg = await conn.fetch(q, *params)
-                rows = [dict(r) for r in rows_pg]
-            else:
-                rows_pg = await conn.fetch(
-                    """
-                    SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
-                           u.username, u.avatar_url,
-                           EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = $1) as liked
-                    FROM posts p
-                    JOIN users u ON u.id = p.author_id
-                    WHERE p.author_id != $1
-                      AND p.author_id IN (SELECT CASE WHEN requester_id = $1 THEN addressee_id ELSE requester_id END FROM friendships WHERE (requester_id = $1 OR addressee_id = $1) AND status = 'accepted')
-                    ORDER BY p.created_at DESC
-                    LIMIT $2
-                    """,
-                    user_id, limit
-                )
-                rows = [dict(r) for r in rows_pg]
+        if use_engine:
+            liked = recommendation_engine.liked_post_ids(user_id)
+            candidates = [pid for pid in ranked if pid not in liked][:limit * 2]
+            rows = await _posts_by_ids(conn, db_type, user_id, candidates)
+            rows = [r for r in rows if not r["liked"]][:limit]
         else:
-            if interest_tag_ids:
-                placeholders = ",".join(["?" for _ in interest_tag_ids])
-                params = (user_id, user_id) + tuple(interest_tag_ids) + (user_id, user_id, user_id) + tuple(interest_tag_ids) + (limit,)
-                async with conn.execute(
-                    f"""
-                    SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
-                           u.username, u.avatar_url,
-                           EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked,
-                           (SELECT COUNT(*) FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({placeholders})) as match_count
-                    FROM posts p
-                    JOIN users u ON u.id = p.author_id
-                    WHERE p.author_id != ? AND NOT EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?)
-                      AND (p.author_id IN (SELECT CASE WHEN requester_id = ? THEN addressee_id ELSE requester_id END FROM friendships WHERE (requester_id = ? OR addressee_id = ?) AND status = 'accepted')
-                           OR EXISTS(SELECT 1 FROM post_tags pt WHERE pt.post_id = p.id AND pt.tag_id IN ({placeholders})))
-                    ORDER BY match_count DESC, p.created_at DESC
-                    LIMIT ?
-                    """,
-                    params
-                ) as cursor:
-                    rows_data = await cursor.fetchall()
-                rows = [
-                    {"id": r[0], "author_id": r[1], "content": r[2], "images": r[3], "likes_count": r[4], "comments_count": r[5], "created_at": r[6], "username": r[7], "avatar_url": r[8], "liked": bool(r[9]), "match_count": r[10] or 0}
-                    for r in rows_data
-                ]
-            else:
-                async with conn.execute(
-                    """
-                    SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.comments_count, p.created_at,
-                           u.username, u.avatar_url,
-                           EXISTS(SELECT 1 FROM post_likes pl WHERE pl.post_id = p.id AND pl.user_id = ?) as liked
-                    FROM posts p
-                    JOIN users u ON u.id = p.author_id
-                    WHERE p.author_id != ? AND p.author_id IN (SELECT CASE WHEN requester_id = ? THEN addressee_id ELSE requester_id END FROM friendships WHERE (requester_id = ? OR addressee_id = ?) AND status = 'accepted')
-                    ORDER BY p.created_at DESC
-                    LIMIT ?
-                    """,
-                    (user_id, user_id, user_id, user_id, user_id, limit)
-                ) as cursor:
-                    rows_data = await cursor.fetchall()
-                rows = [
-                    {"id": r[0], "author_id": r[1], "content": r[2], "images": r[3], "likes_count": r[4], "comments_count": r[5], "created_at": r[6], "username": r[7], "avatar_url": r[8], "liked": bool(r[9])}
-                    for r in rows_data
-                ]
+            rows = await _recommended_posts_sql(conn, db_type, user_id, limit)
 
         post_ids = [r["id"] for r in rows]
         tags_map = await get_tags_for_posts(conn, db_type, post_ids)
+        previews = await load_comments_previews(conn, db_type, rows)
 
     return [
         {
@@ -2834,6 +3398,7 @@ async def get_recommended_posts(
             "images": json.loads(r["images"]) if r["images"] else [],
             "likes": r["likes_count"],
             "comments": r["comments_count"],
+            "comments_preview": previews.get(r["id"], []),
             "liked": r["liked"],
             "created_at": r["created_at"],
             "tags": tags_map.get(r["id"], [])
@@ -2926,6 +3491,7 @@ async def list_conversations(user_id: int = Depends(get_current_user_id)):
             for key in ("created_at", "last_message_at"):
                 if key in r and r[key] is not None and hasattr(r[key], "isoformat"):
                     r[key] = _datetime_to_iso_utc(r[key])
+            r["other_status"] = presence.status(r["other_user_id"]) if r.get("other_user_id") else None
         return rows
 
 
@@ -3028,8 +3594,56 @@ async def get_or_create_conversation_with(data: ConversationWithUser, user_id: i
         return {"conversation_id": conversation_id, "conversation": conv}
 
 
+_MESSAGE_COLUMNS = "id, sender_id, content, created_at, voice_url, voice_duration_seconds, voice_transcription, delivered_at, read_at"
+
+
+async def _message_window(conn, db_type: str, conversation_id: int, before: Optional[int], after: Optional[int],
+                          around: Optional[int], limit: int) -> List[dict]:
+    """Окно истории по id (индекс conversation_id, id), всегда по возрастанию.
+    before — последние limit сообщений до id; after — первые limit после id; around — id в середине окна."""
+    parts = []  # (условие по id, порядок, сколько, опорный id)
+    if around is not None:
+        parts.append(("id < {}", "DESC", limit // 2, around))
+        parts.append(("id >= {}", "ASC", limit - limit // 2, around))
+    elif before is not None:
+        parts.append(("id < {}", "DESC", limit, before))
+    else:
+        parts.append(("id > {}", "ASC", limit, after))
+    names = [c.strip() for c in _MESSAGE_COLUMNS.split(",")]
+    rows = []
+    for cond, order, n, pivot in parts:
+        if n <= 0:
+            continue
+        if db_type == 'postgresql':
+            chunk = await conn.fetch(
+                f"SELECT {_MESSAGE_COLUMNS} FROM messages WHERE conversation_id = $1 AND {cond.format('$2')} "
+                f"ORDER BY id {order} LIMIT $3",
+                conversation_id, pivot, n
+            )
+            chunk = [dict(r) for r in chunk]
+        else:
+            async with conn.execute(
+                f"SELECT {_MESSAGE_COLUMNS} FROM messages WHERE conversation_id = ? AND {cond.format('?')} "
+                f"ORDER BY id {order} LIMIT ?",
+                (conversation_id, pivot, n)
+            ) as cursor:
+                chunk = [dict(zip(names, r)) for r in await cursor.fetchall()]
+        rows.extend(chunk)
+    rows.sort(key=lambda r: r["id"])
+    return rows
+
+
 @api_router.get("/conversations/{conversation_id}/messages")
-async def get_messages(conversation_id: int, user_id: int = Depends(get_current_user_id)):
+async def get_messages(
+    conversation_id: int,
+    before: Optional[int] = Query(None, description="Сообщения старше этого id (листание вверх)"),
+    after: Optional[int] = Query(None, description="Сообщения новее этого id"),
+    around: Optional[int] = Query(None, description="Окно вокруг id (переход из поиска)"),
+    limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    user_id: int = Depends(get_current_user_id),
+):
+    """История чата. Без before/after/around — как раньше (до 500 сообщений);
+    с ними — окно из limit сообщений по id, всегда по возрастанию."""
     db_type = get_db_type()
     async with get_db() as conn:
             # Ensure membership
@@ -3061,7 +3675,9 @@ async def get_messages(conversation_id: int, user_id: int = Depends(get_current_
             )
             await conn.commit()
         
-        if db_type == 'postgresql':
+        if before is not None or after is not None or around is not None:
+            rows = await _message_window(conn, db_type, conversation_id, before, after, around, limit)
+        elif db_type == 'postgresql':
             rows = await conn.fetch(
                 """SELECT id, sender_id, content, created_at, voice_url, voice_duration_seconds, voice_transcription, delivered_at, read_at
                    FROM messages WHERE conversation_id=$1 ORDER BY created_at ASC LIMIT 500""",
@@ -3141,6 +3757,92 @@ async def mark_conversation_read(conversation_id: int, user_id: int = Depends(ge
     return {"status": "ok"}
 
 
+@api_router.get("/messages/search")
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    conversation_id: Optional[int] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=50),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Поиск по своим сообщениям (только чаты, где вы участник), новые сверху.
+    В каждом результате — snippet: HTML-экранированный текст с <mark>…</mark>; открыть место в истории:
+    GET /conversations/{conversation_id}/messages?around={id}."""
+    after = decode_cursor(cursor, (int,))
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            params = [q, user_id, f"StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxWords=24, MinWords=8, MaxFragments=1"]
+            where = ["to_tsvector('russian', m.content) @@ websearch_to_tsquery('russian', $1)"]
+            if conversation_id is not None:
+                params.append(conversation_id)
+                where.append(f"m.conversation_id = ${len(params)}")
+            if after:
+                params.append(int(after[0]))
+                where.append(f"m.id < ${len(params)}")
+            params.append(limit + 1)
+            rows = await conn.fetch(
+                f"""
+                SELECT h.id, h.conversation_id, h.sender_id, h.created_at,
+                       ts_headline('russian', h.content, websearch_to_tsquery('russian', $1), $3) AS snippet
+                FROM (
+                    SELECT m.id, m.conversation_id, m.sender_id, m.created_at, m.content
+                    FROM messages m
+                    JOIN conversation_participants cp ON cp.conversation_id = m.conversation_id AND cp.user_id = $2
+                    WHERE {" AND ".join(where)}
+                    ORDER BY m.id DESC
+                    LIMIT ${len(params)}
+                ) h
+                ORDER BY h.id DESC
+                """,
+                *params
+            )
+            rows = [dict(r) for r in rows]
+        else:
+            match = fts5_query(q)
+            if not match:
+                return {"results": [], "next_cursor": None}
+            if await sqlite_fts_ready(conn, "messages"):
+                source = "messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+                snippet = "snippet(messages_fts, 0, ?, ?, '…', 16)"
+                where = ["messages_fts MATCH ?"]
+                params = [SNIPPET_START, SNIPPET_STOP, match]
+            else:
+                source = "messages m"
+                snippet = "substr(m.content, 1, 160)"
+                where = ["m.content LIKE ?"]
+                params = [f"%{q.strip()}%"]
+            where.append("m.conversation_id IN (SELECT conversation_id FROM conversation_participants WHERE user_id = ?)")
+            params.append(user_id)
+            if conversation_id is not None:
+                where.append("m.conversation_id = ?")
+                params.append(conversation_id)
+            if after:
+                where.append("m.id < ?")
+                params.append(int(after[0]))
+            params.append(limit + 1)
+            async with conn.execute(
+                f"""SELECT m.id, m.conversation_id, m.sender_id, m.created_at, {snippet}
+                    FROM {source}
+                    WHERE {" AND ".join(where)}
+                    ORDER BY m.id DESC LIMIT ?""",
+                params
+            ) as cur:
+                rows = [
+                    {"id": r[0], "conversation_id": r[1], "sender_id": r[2], "created_at": r[3], "snippet": r[4]}
+                    for r in await cur.fetchall()
+                ]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]["id"]])
+    for r in rows:
+        r["snippet"] = render_snippet(r["snippet"])
+        if hasattr(r["created_at"], "isoformat"):
+            r["created_at"] = _datetime_to_iso_utc(r["created_at"])
+    return {"results": rows, "next_cursor": next_cursor}
+
+
 @api_router.post("/messages/send")
 async def send_message(data: MessageSend, user_id: int = Depends(get_current_user_id)):
     has_content = (data.content and data.content.strip()) or data.voice_base64
@@ -3243,6 +3945,7 @@ async def send_message(data: MessageSend, user_id: int = Depends(get_current_use
             ) as cursor:
                 participants_data = await cursor.fetchall()
                 participants = [{"user_id": r[0]} for r in participants_data]
+        metrics.record("messages")
         
         # Создаём уведомления для всех участников диалога
         for participant in participants:
@@ -3449,180 +4152,119 @@ async def get_friend_requests(user_id: int = Depends(get_current_user_id)):
         return {"incoming": incoming, "outgoing": outgoing}
 
 @api_router.get("/friends/suggestions")
-async def get_friend_suggestions(user_id: int = Depends(get_current_user_id)):
-    """Получить рекомендации друзей (пользователи, с которыми еще нет связи)"""
-    db_type = get_db_type()
-    async with get_db() as conn:
-        if db_type == 'postgresql':
-            rows = await conn.fetch(
-                """
-                SELECT u.id, u.username, u.email, u.avatar_url
-                FROM users u
-                WHERE u.id != $1
-                  AND u.id NOT IN (
-                      SELECT CASE WHEN requester_id = $1 THEN addressee_id ELSE requester_id END
-                      FROM friendships
-                      WHERE requester_id = $1 OR addressee_id = $1
-                  )
-                ORDER BY u.created_at DESC
-                LIMIT 20
-                """,
-                user_id
-            )
-            rows = [dict(r) for r in rows]
-        else:  # sqlite
-            async with conn.execute(
-                """
-                SELECT u.id, u.username, u.email, u.avatar_url
-                FROM users u
-                WHERE u.id != ?
-                  AND u.id NOT IN (
-                      SELECT CASE WHEN requester_id = ? THEN addressee_id ELSE requester_id END
-                      FROM friendships
-                      WHERE requester_id = ? OR addressee_id = ?
-                  )
-                ORDER BY u.created_at DESC
-                LIMIT 20
-                """,
-                (user_id, user_id, user_id, user_id)
-            ) as cursor:
-                rows_data = await cursor.fetchall()
-                rows = [
-                    {
-                        "id": r[0],
-                        "username": r[1],
-                        "email": r[2],
-                        "avatar_url": r[3]
-                    }
-                    for r in rows_data
-                ]
-        return rows
+async def get_friend_suggestions(
+    limit: int = Query(20, ge=1, le=50),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Рекомендации друзей: друзья друзей по числу общих друзей, плюс общие группы и подписки на теги.
+    В ответе — mutual_friends, shared_groups, shared_tags. Если связей нет — новые пользователи, как раньше."""
+    return await friend_suggestions(user_id, limit)
 
 # ===================== Admin API (prefix /api, path /admin/...) =====================
 @api_router.get("/admin/stats")
 async def admin_stats(_admin_id: int = Depends(get_current_admin)):
-    """Полная статистика для админки: пользователи, посты, активность, сообщества."""
-    db_type = get_db_type()
-    async with get_db() as conn:
-        if db_type == 'postgresql':
-            total_users = await conn.fetchval("SELECT COUNT(*) FROM users")
-            users_today = await conn.fetchval(
-                "SELECT COUNT(*) FROM users WHERE created_at >= CURRENT_DATE")
-            users_week = await conn.fetchval(
-                "SELECT COUNT(*) FROM users WHERE created_at >= CURRENT_DATE - INTERVAL '7 days'")
-            users_month = await conn.fetchval(
-                "SELECT COUNT(*) FROM users WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'")
-            banned_count = await conn.fetchval("SELECT COUNT(*) FROM users WHERE is_banned = TRUE")
-            admin_count = await conn.fetchval("SELECT COUNT(*) FROM users WHERE is_admin = TRUE")
-            total_posts = await conn.fetchval("SELECT COUNT(*) FROM posts")
-            posts_today = await conn.fetchval(
-                "SELECT COUNT(*) FROM posts WHERE created_at >= CURRENT_DATE")
-            posts_week = await conn.fetchval(
-                "SELECT COUNT(*) FROM posts WHERE created_at >= CURRENT_DATE - INTERVAL '7 days'")
-            total_messages = await conn.fetchval("SELECT COUNT(*) FROM messages")
-            messages_today = await conn.fetchval(
-                "SELECT COUNT(*) FROM messages WHERE created_at >= CURRENT_DATE")
-            total_friendships = await conn.fetchval(
-                "SELECT COUNT(*) FROM friendships WHERE status = 'accepted'")
-            total_notifications = await conn.fetchval("SELECT COUNT(*) FROM notifications")
-            unread_notifications = await conn.fetchval(
-                "SELECT COUNT(*) FROM notifications WHERE is_read = FALSE")
-            communities_count = await conn.fetchval(
-                "SELECT COUNT(*) FROM users WHERE community_name IS NOT NULL AND community_name != ''")
-            active_last_24h = await conn.fetchval("""
-                SELECT COUNT(DISTINCT u.id) FROM users u
-                WHERE EXISTS (SELECT 1 FROM posts p WHERE p.author_id = u.id AND p.created_at >= NOW() - INTERVAL '24 hours')
-                   OR EXISTS (SELECT 1 FROM messages m WHERE m.sender_id = u.id AND m.created_at >= NOW() - INTERVAL '24 hours')
-            """)
-        else:
-            async def _fetchval(conn, sql, params=()):
-                cur = await conn.execute(sql, params if params else ())
-                row = await cur.fetchone()
-                return row[0] if row else 0
-            total_users = await _fetchval(conn, "SELECT COUNT(*) FROM users")
-            users_today = await _fetchval(conn, "SELECT COUNT(*) FROM users WHERE date(created_at) >= date('now')")
-            users_week = await _fetchval(conn, "SELECT COUNT(*) FROM users WHERE created_at >= datetime('now', '-7 days')")
-            users_month = await _fetchval(conn, "SELECT COUNT(*) FROM users WHERE created_at >= datetime('now', '-30 days')")
-            banned_count = await _fetchval(conn, "SELECT COUNT(*) FROM users WHERE is_banned = 1")
-            admin_count = await _fetchval(conn, "SELECT COUNT(*) FROM users WHERE is_admin = 1")
-            total_posts = await _fetchval(conn, "SELECT COUNT(*) FROM posts")
-            posts_today = await _fetchval(conn, "SELECT COUNT(*) FROM posts WHERE date(created_at) >= date('now')")
-            posts_week = await _fetchval(conn, "SELECT COUNT(*) FROM posts WHERE created_at >= datetime('now', '-7 days')")
-            total_messages = await _fetchval(conn, "SELECT COUNT(*) FROM messages")
-            messages_today = await _fetchval(conn, "SELECT COUNT(*) FROM messages WHERE date(created_at) >= date('now')")
-            total_friendships = await _fetchval(conn, "SELECT COUNT(*) FROM friendships WHERE status = 'accepted'")
-            total_notifications = await _fetchval(conn, "SELECT COUNT(*) FROM notifications")
-            unread_notifications = await _fetchval(conn, "SELECT COUNT(*) FROM notifications WHERE is_read = 0")
-            communities_count = await _fetchval(conn, "SELECT COUNT(*) FROM users WHERE community_name IS NOT NULL AND community_name != ''")
-            active_last_24h = await _fetchval(conn, """
-                SELECT COUNT(DISTINCT u.id) FROM users u
-                WHERE EXISTS (SELECT 1 FROM posts p WHERE p.author_id = u.id AND p.created_at >= datetime('now', '-24 hours'))
-                   OR EXISTS (SELECT 1 FROM messages m WHERE m.sender_id = u.id AND m.created_at >= datetime('now', '-24 hours'))
-            """)
+    """Полная статистика для админки: пользователи, посты, активность, сообщества.
+    Читается из предрасчитанных счётчиков и дневных бакетов (stats.py); «сегодня» и
+    «активные за 24 часа» отстают не более чем на STATS_ROLLUP_SECONDS."""
+    data = await read_stats()
+    c, daily = data["counters"], data["daily"]
+    users_d = daily.get("users", {})
+    posts_d = daily.get("posts", {})
+    messages_d = daily.get("messages", {})
     return {
         "users": {
-            "total": total_users,
-            "registered_today": users_today,
-            "registered_this_week": users_week,
-            "registered_this_month": users_month,
-            "active_last_24h": active_last_24h or 0,
-            "banned": banned_count,
-            "admins": admin_count,
+            "total": c.get("users_total", 0),
+            "registered_today": users_d.get("today", 0),
+            "registered_this_week": users_d.get("week", 0),
+            "registered_this_month": users_d.get("month", 0),
+            "active_last_24h": c.get("active_last_24h", 0),
+            "banned": c.get("users_banned", 0),
+            "admins": c.get("users_admin", 0),
         },
         "posts": {
-            "total": total_posts,
-            "today": posts_today,
-            "this_week": posts_week,
+            "total": c.get("posts_total", 0),
+            "today": posts_d.get("today", 0),
+            "this_week": posts_d.get("week", 0),
         },
-        "messages": {"total": total_messages, "today": messages_today},
-        "friendships": {"accepted": total_friendships},
-        "notifications": {"total": total_notifications, "unread": unread_notifications},
-        "communities": communities_count,
+        "messages": {"total": c.get("messages_total", 0), "today": messages_d.get("today", 0)},
+        "friendships": {"accepted": c.get("friendships_accepted", 0)},
+        "notifications": {"total": c.get("notifications_total", 0), "unread": c.get("notifications_unread", 0)},
+        "communities": c.get("users_communities", 0),
     }
 
 
+@api_router.get("/admin/metrics")
+async def admin_metrics(
+    metric: Optional[List[str]] = Query(None),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    step: Optional[str] = Query(None),
+    _admin_id: int = Depends(get_current_admin),
+):
+    """Временные ряды активности: registrations, logins, posts, messages, likes, active_users.
+    start / end — ISO-время (по умолчанию последние 24 часа), step — 1m, 5m, 15m, 1h, 6h, 1d
+    (по умолчанию — наименьший, дающий не больше 1000 точек). Точки — [epoch начала интервала, значение]."""
+    names = metric or list(METRICS)
+    unknown = [m for m in names if m not in METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные метрики: {', '.join(unknown)}")
+    if step is not None and step not in STEPS:
+        raise HTTPException(status_code=400, detail=f"step должен быть одним из: {', '.join(STEPS)}")
+    # Время без часового пояса считаем UTC, как и везде в API
+    end_ts = int((end if end.tzinfo else end.replace(tzinfo=timezone.utc)).timestamp()) if end else int(time.time())
+    start_ts = int((start if start.tzinfo else start.replace(tzinfo=timezone.utc)).timestamp()) if start else end_ts - 86400
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start должен быть раньше end")
+    step_seconds = pick_step(start_ts, end_ts, step)
+    if (end_ts - start_ts) // step_seconds > 5000:
+        raise HTTPException(status_code=400, detail="Слишком много точек: увеличьте step или сократите диапазон")
+    step_seconds, series = await query_series(names, start_ts, end_ts, step_seconds)
+    return {"start": start_ts, "end": end_ts, "step": step_seconds, "series": series}
+
+
 @api_router.get("/admin/users")
 async def admin_list_users(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
     search: Optional[str] = None,
+    cursor: Optional[str] = None,
     _admin_id: int = Depends(get_current_admin),
 ):
-    """Список всех пользователей (только админ)."""
+    """Список всех пользователей (только админ), по id. Следующая страница — cursor=next_cursor."""
+    offset = _admin_offset(skip, cursor)
+    after = decode_cursor(cursor, (int,))
     db_type = get_db_type()
+    where, params = [], []
+    if search:
+        if db_type == 'postgresql':
+            params.append(f"%{search}%")
+            where.append(f"(username ILIKE ${len(params)} OR email ILIKE ${len(params)})")
+        else:
+            params += [f"%{search}%", f"%{search}%"]
+            where.append("(username LIKE ? OR email LIKE ?)")
+    if after:
+        cond, cond_params = keyset_condition(["id"], after, db_type, len(params) + 1)
+        where.append(cond)
+        params += cond_params
+    sql = ("SELECT id, username, email, avatar_url, is_admin, is_banned, is_official, is_moderator, created_at FROM users"
+           + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id"
+           + _limit_offset_sql(db_type, params, limit, offset))
     async with get_db() as conn:
         if db_type == 'postgresql':
-            if search:
-                rows = await conn.fetch(
-                    """SELECT id, username, email, avatar_url, is_admin, is_banned, is_official, is_moderator, created_at
-                       FROM users WHERE username ILIKE $1 OR email ILIKE $1 ORDER BY id LIMIT $2 OFFSET $3""",
-                    f"%{search}%", limit, skip
-                )
-            else:
-                rows = await conn.fetch(
-                    "SELECT id, username, email, avatar_url, is_admin, is_banned, is_official, is_moderator, created_at FROM users ORDER BY id LIMIT $1 OFFSET $2",
-                    limit, skip
-                )
+            rows = await conn.fetch(sql, *params)
             out = [dict(r) for r in rows]
         else:
-            if search:
-                async with conn.execute(
-                    """SELECT id, username, email, avatar_url, is_admin, is_banned, is_official, is_moderator, created_at
-                       FROM users WHERE username LIKE ? OR email LIKE ? ORDER BY id LIMIT ? OFFSET ?""",
-                    (f"%{search}%", f"%{search}%", limit, skip)
-                ) as cursor:
-                    rows = await cursor.fetchall()
-            else:
-                async with conn.execute(
-                    "SELECT id, username, email, avatar_url, is_admin, is_banned, is_official, is_moderator, created_at FROM users ORDER BY id LIMIT ? OFFSET ?",
-                    (limit, skip)
-                ) as cursor:
-                    rows = await cursor.fetchall()
+            async with conn.execute(sql, params) as cursor_:
+                rows = await cursor_.fetchall()
             out = [
                 {"id": r[0], "username": r[1], "email": r[2], "avatar_url": r[3], "is_admin": bool(r[4]) if len(r) > 4 else False, "is_banned": bool(r[5]) if len(r) > 5 else False, "is_official": bool(r[6]) if len(r) > 6 else False, "is_moderator": bool(r[7]) if len(r) > 7 else False, "created_at": r[8] if len(r) > 8 else None}
                 for r in rows
             ]
-    return {"users": out, "skip": skip, "limit": limit}
+    next_cursor = None
+    if len(out) > limit:
+        out = out[:limit]
+        next_cursor = encode_cursor([out[-1]["id"]])
+    return {"users": out, "skip": offset, "limit": limit, "next_cursor": next_cursor}
 
 @api_router.get("/admin/users/{user_id}")
 async def admin_get_user(user_id: int, _admin_id: int = Depends(get_current_admin)):
@@ -3673,33 +4315,43 @@ async def admin_update_user(user_id: int, data: AdminUserUpdate, _admin_id: int
             sql = "UPDATE users SET " + ", ".join(set_parts) + " WHERE id = ?"
             await conn.execute(sql, tuple(values))
             await conn.commit()
+        if data.is_banned is not None:
+            await refresh_user_in_index(conn, db_type, user_id)
     return {"ok": True}
 
 @api_router.get("/admin/posts")
 async def admin_list_posts(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = None,
     _admin_id: int = Depends(get_current_admin),
 ):
-    """Все посты для модерации."""
+    """Все посты для модерации, новые сверху. Следующая страница — cursor=next_cursor."""
+    offset = _admin_offset(skip, cursor)
+    after = decode_cursor(cursor, (CURSOR_TIME, int))
     db_type = get_db_type()
+    where, params = "", []
+    if after:
+        where, params = keyset_condition(
+            ["p.created_at", "p.id"], [cursor_datetime(after[0], db_type), after[1]], db_type, desc=True
+        )
+        where = " WHERE " + where
+    sql = ("""SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.created_at, u.username
+              FROM posts p JOIN users u ON p.author_id = u.id""" + where
+           + " ORDER BY p.created_at DESC, p.id DESC" + _limit_offset_sql(db_type, params, limit, offset))
     async with get_db() as conn:
         if db_type == 'postgresql':
-            rows = await conn.fetch(
-                """SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.created_at, u.username
-                   FROM posts p JOIN users u ON p.author_id = u.id ORDER BY p.created_at DESC LIMIT $1 OFFSET $2""",
-                limit, skip
-            )
+            rows = await conn.fetch(sql, *params)
             out = [{"id": r["id"], "author_id": r["author_id"], "author_username": r["username"], "content": r["content"], "images": json.loads(r["images"]) if isinstance(r["images"], str) else (r["images"] or []), "likes_count": r["likes_count"], "created_at": r["created_at"]} for r in rows]
         else:
-            async with conn.execute(
-                """SELECT p.id, p.author_id, p.content, p.images, p.likes_count, p.created_at, u.username
-                   FROM posts p JOIN users u ON p.author_id = u.id ORDER BY p.created_at DESC LIMIT ? OFFSET ?""",
-                (limit, skip)
-            ) as cursor:
-                rows = await cursor.fetchall()
+            async with conn.execute(sql, params) as cursor_:
+                rows = await cursor_.fetchall()
             out = [{"id": r[0], "author_id": r[1], "content": r[2], "images": json.loads(r[3]) if r[3] else [], "likes_count": r[4], "created_at": r[5], "author_username": r[6]} for r in rows]
-    return {"posts": out, "skip": skip, "limit": limit}
+    next_cursor = None
+    if len(out) > limit:
+        out = out[:limit]
+        next_cursor = encode_cursor([out[-1]["created_at"], out[-1]["id"]])
+    return {"posts": out, "skip": offset, "limit": limit, "next_cursor": next_cursor}
 
 @api_router.delete("/admin/posts/{post_id}")
 async def admin_delete_post(post_id: int, _admin_id: int = Depends(get_current_admin)):
@@ -3711,35 +4363,39 @@ async def admin_delete_post(post_id: int, _admin_id: int = Depends(get_current_a
         else:
             await conn.execute("DELETE FROM posts WHERE id = ?", (post_id,))
             await conn.commit()
+    recommendation_engine.remove_post(post_id)
     return {"ok": True}
 
 @api_router.get("/admin/communities")
 async def admin_list_communities(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = None,
     _admin_id: int = Depends(get_current_admin),
 ):
-    """Пользователи с заполненным сообществом (community_name)."""
+    """Пользователи с заполненным сообществом (community_name), по id. Следующая страница — cursor=next_cursor."""
+    offset = _admin_offset(skip, cursor)
+    after = decode_cursor(cursor, (int,))
     db_type = get_db_type()
+    where, params = "community_name IS NOT NULL AND community_name != ''", []
+    if after:
+        cond, params = keyset_condition(["id"], after, db_type)
+        where += " AND " + cond
+    sql = (f"""SELECT id, username, email, avatar_url, community_name, community_description
+               FROM users WHERE {where} ORDER BY id""" + _limit_offset_sql(db_type, params, limit, offset))
     async with get_db() as conn:
         if db_type == 'postgresql':
-            rows = await conn.fetch(
-                """SELECT id, username, email, avatar_url, community_name, community_description
-                   FROM users WHERE community_name IS NOT NULL AND community_name != '' ORDER BY id LIMIT $1 OFFSET $2""",
-                limit, skip
-            )
+            rows = await conn.fetch(sql, *params)
             out = [dict(r) for r in rows]
         else:
-            async with conn.execute(
-                """SELECT id, username, email, avatar_url, community_name, community_description
-                   FROM users WHERE community_name IS NOT NULL AND community_name != '' ORDER BY id LIMIT ? OFFSET ?""",
-                (limit, skip)
-            ) as cursor:
-                rows = await cursor.fetchall()
+            async with conn.execute(sql, params) as cursor_:
+                rows = await cursor_.fetchall()
             out = [{"id": r[0], "username": r[1], "email": r[2], "avatar_url": r[3], "community_name": r[4], "community_description": r[5] if len(r) > 5 else None} for r in rows]
-    return {"communities": out, "skip": skip, "limit": limit}
-
-    return {"communities": out, "skip": skip, "limit": limit}
+    next_cursor = None
+    if len(out) > limit:
+        out = out[:limit]
+        next_cursor = encode_cursor([out[-1]["id"]])
+    return {"communities": out, "skip": offset, "limit": limit, "next_cursor": next_cursor}
 
 
 # ===================== Admin: удаление юзеров, жалобы, история банов =====================
@@ -3760,6 +4416,7 @@ async def admin_delete_user(user_id: int, admin_id: int = Depends(get_current_ad
                     raise HTTPException(status_code=404, detail="Пользователь не найден")
             await conn.execute("DELETE FROM users WHERE id=?", (user_id,))
             await conn.commit()
+    username_index.remove(user_id)
     return {"ok": True}
 
 
@@ -3771,21 +4428,12 @@ class ReportCreate(BaseModel):
 
 @api_router.post("/reports")
 async def create_report(data: ReportCreate, user_id: int = Depends(get_current_user_id)):
-    """Отправить жалобу на пост или комментарий."""
-    db_type = get_db_type()
-    async with get_db() as conn:
-        if db_type == 'postgresql':
-            await conn.execute(
-                "INSERT INTO reports (reporter_id, target_type, target_id, reason) VALUES ($1,$2,$3,$4)",
-                user_id, data.target_type, data.target_id, data.reason
-            )
-        else:
-            await conn.execute(
-                "INSERT INTO reports (reporter_id, target_type, target_id, reason) VALUES (?,?,?,?)",
-                (user_id, data.target_type, data.target_id, data.reason)
-            )
-            await conn.commit()
-    return {"ok": True}
+    """Отправить жалобу на пост или комментарий. Повторная жалоба на ту же цель не создаёт новой
+    (duplicate: true); больше REPORTS_PER_HOUR жалоб в час — 429."""
+    result = await submit_report(user_id, data.target_type, data.target_id, data.reason)
+    if result == "rate_limited":
+        raise HTTPException(status_code=429, detail="Слишком много жалоб. Попробуйте позже.")
+    return {"ok": True, "duplicate": result == "duplicate"}
 
 
 @api_router.get("/admin/reports")
@@ -3793,34 +4441,40 @@ async def admin_list_reports(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
     status: str = Query("pending"),
+    cursor: Optional[str] = None,
     admin_id: int = Depends(get_current_admin),
 ):
-    """Список жалоб для модерации."""
+    """Список жалоб для модерации, новые сверху. Следующая страница — cursor=next_cursor."""
+    offset = _admin_offset(skip, cursor)
+    after = decode_cursor(cursor, (CURSOR_TIME, int))
     db_type = get_db_type()
+    params = [status]
+    where = "r.status = $1" if db_type == 'postgresql' else "r.status = ?"
+    if after:
+        cond, cond_params = keyset_condition(
+            ["r.created_at", "r.id"], [cursor_datetime(after[0], db_type), after[1]], db_type, 2, desc=True
+        )
+        where += " AND " + cond
+        params += cond_params
+    sql = (f"""SELECT r.id, r.target_type, r.target_id, r.reason, r.status, r.created_at,
+                      u.username AS reporter_username
+               FROM reports r
+               LEFT JOIN users u ON u.id = r.reporter_id
+               WHERE {where} ORDER BY r.created_at DESC, r.id DESC""" + _limit_offset_sql(db_type, params, limit, offset))
     async with get_db() as conn:
         if db_type == 'postgresql':
-            rows = await conn.fetch(
-                """SELECT r.id, r.target_type, r.target_id, r.reason, r.status, r.created_at,
-                          u.username AS reporter_username
-                   FROM reports r
-                   LEFT JOIN users u ON u.id = r.reporter_id
-                   WHERE r.status = $1 ORDER BY r.created_at DESC LIMIT $2 OFFSET $3""",
-                status, limit, skip
-            )
+            rows = await conn.fetch(sql, *params)
             out = [dict(r) for r in rows]
         else:
-            async with conn.execute(
-                """SELECT r.id, r.target_type, r.target_id, r.reason, r.status, r.created_at,
-                          u.username AS reporter_username
-                   FROM reports r
-                   LEFT JOIN users u ON u.id = r.reporter_id
-                   WHERE r.status = ? ORDER BY r.created_at DESC LIMIT ? OFFSET ?""",
-                (status, limit, skip)
-            ) as cur:
+            async with conn.execute(sql, params) as cur:
                 rows = await cur.fetchall()
             out = [{"id": r[0], "target_type": r[1], "target_id": r[2], "reason": r[3],
                     "status": r[4], "created_at": str(r[5]), "reporter_username": r[6]} for r in rows]
-    return {"reports": out, "skip": skip, "limit": limit}
+    next_cursor = None
+    if len(out) > limit:
+        out = out[:limit]
+        next_cursor = encode_cursor([out[-1]["created_at"], out[-1]["id"]])
+    return {"reports": out, "skip": offset, "limit": limit, "next_cursor": next_cursor}
 
 
 class ReportReview(BaseModel):
@@ -3830,25 +4484,54 @@ class ReportReview(BaseModel):
 @api_router.patch("/admin/reports/{report_id}")
 async def admin_review_report(report_id: int, data: ReportReview, admin_id: int = Depends(get_current_admin)):
     """Рассмотреть жалобу: dismissed или actioned."""
-    if data.status not in ("dismissed", "actioned"):
+    if data.status not in REPORT_REVIEW_STATUSES:
         raise HTTPException(status_code=400, detail="status должен быть dismissed или actioned")
     now = datetime.utcnow()
     db_type = get_db_type()
     async with get_db() as conn:
         if db_type == 'postgresql':
-            await conn.execute(
-                "UPDATE reports SET status=$1, reviewed_by=$2, reviewed_at=$3 WHERE id=$4",
-                data.status, admin_id, now, report_id
-            )
+            async with conn.transaction():
+                await conn.execute(
+                    "UPDATE reports SET status=$1, reviewed_by=$2, reviewed_at=$3 WHERE id=$4",
+                    data.status, admin_id, now, report_id
+                )
+                await sync_targets_for_reports(conn, db_type, [report_id], data.status, admin_id, now)
         else:
             await conn.execute(
                 "UPDATE reports SET status=?, reviewed_by=?, reviewed_at=? WHERE id=?",
                 (data.status, admin_id, now.isoformat(), report_id)
             )
+            await sync_targets_for_reports(conn, db_type, [report_id], data.status, admin_id, now)
             await conn.commit()
     return {"ok": True}
 
 
+@api_router.get("/admin/report-targets")
+async def admin_report_queue(
+    status: str = Query("pending"),
+    target_type: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    _admin_id: int = Depends(get_current_admin),
+):
+    """Очередь модерации: цели жалоб (по одной на пост / комментарий), самые приоритетные сверху.
+    У каждой — число пожаловавшихся, первая и последняя жалоба, гистограмма причин.
+    Следующая страница — cursor=next_cursor."""
+    after = decode_cursor(cursor, (int, int))
+    items, next_key = await list_queue(status, after, limit, target_type)
+    return {"targets": items, "limit": limit, "next_cursor": encode_cursor(next_key) if next_key else None}
+
+
+@api_router.patch("/admin/report-targets/{report_target_id}")
+async def admin_review_report_target(report_target_id: int, data: ReportReview, admin_id: int = Depends(get_current_admin)):
+    """Решение по цели целиком: dismissed или actioned для неё и всех её жалоб в ожидании."""
+    if data.status not in REPORT_REVIEW_STATUSES:
+        raise HTTPException(status_code=400, detail="status должен быть dismissed или actioned")
+    if not await review_target(report_target_id, data.status, admin_id):
+        raise HTTPException(status_code=404, detail="Цель жалоб не найдена")
+    return {"ok": True}
+
+
 class BanInput(BaseModel):
     reason: Optional[str] = None
     expires_at: Optional[str] = None  # ISO datetime или None = перманентный
@@ -3879,6 +4562,7 @@ async def admin_ban_user(user_id: int, data: BanInput, admin_id: int = Depends(g
                 (user_id, admin_id, data.reason, expires.isoformat() if expires else None, now.isoformat())
             )
             await conn.commit()
+    username_index.remove(user_id)
     return {"ok": True}
 
 
@@ -3901,62 +4585,134 @@ async def admin_unban_user(user_id: int, admin_id: int = Depends(get_current_adm
                 (user_id, admin_id, now.isoformat())
             )
             await conn.commit()
+        await refresh_user_in_index(conn, db_type, user_id)
     return {"ok": True}
 
 
+class ModerationAction(BaseModel):
+    action: str  # ban | unban | delete_post | review_report
+    target_id: int  # id пользователя, поста или жалобы
+    reason: Optional[str] = None  # ban
+    expires_at: Optional[str] = None  # ban: ISO datetime или None = перманентный
+    status: Optional[str] = None  # review_report: dismissed | actioned
+
+
+class BulkModerationInput(BaseModel):
+    actions: List[ModerationAction] = Field(..., min_length=1, max_length=BULK_MODERATION_MAX)
+
+
+@api_router.post("/admin/moderation/bulk")
+async def admin_bulk_moderation(data: BulkModerationInput, admin_id: int = Depends(get_current_admin)):
+    """Пакет модерационных действий в одной транзакции: всё или ничего.
+    При ошибке — 400 с detail.errors: [{index, error}] по номерам действий."""
+    try:
+        applied = await apply_bulk(data.actions, admin_id)
+    except BulkModerationError as e:
+        raise HTTPException(status_code=400, detail={"errors": e.errors})
+    return {"ok": True, "applied": applied}
+
+
 @api_router.get("/admin/ban-history")
 async def admin_ban_history(
     user_id: Optional[int] = Query(None),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    cursor: Optional[str] = None,
     admin_id: int = Depends(get_current_admin),
 ):
-    """История банов. Можно фильтровать по user_id."""
+    """История банов, новые сверху. Можно фильтровать по user_id. Следующая страница — cursor=next_cursor."""
+    offset = _admin_offset(skip, cursor)
+    after = decode_cursor(cursor, (CURSOR_TIME, int))
     db_type = get_db_type()
+    where, params = [], []
+    if user_id:
+        params.append(user_id)
+        where.append("bh.user_id = $1" if db_type == 'postgresql' else "bh.user_id = ?")
+    if after:
+        cond, cond_params = keyset_condition(
+            ["bh.created_at", "bh.id"], [cursor_datetime(after[0], db_type), after[1]], db_type, len(params) + 1, desc=True
+        )
+        where.append(cond)
+        params += cond_params
+    sql = ("""SELECT bh.id, bh.user_id, u.username, bh.action, bh.reason, bh.expires_at, bh.created_at,
+                     a.username AS admin_username
+              FROM ban_history bh
+              LEFT JOIN users u ON u.id = bh.user_id
+              LEFT JOIN users a ON a.id = bh.admin_id"""
+           + (" WHERE " + " AND ".join(where) if where else "")
+           + " ORDER BY bh.created_at DESC, bh.id DESC" + _limit_offset_sql(db_type, params, limit, offset))
     async with get_db() as conn:
         if db_type == 'postgresql':
-            if user_id:
-                rows = await conn.fetch(
-                    """SELECT bh.id, bh.user_id, u.username, bh.action, bh.reason, bh.expires_at, bh.created_at,
-                              a.username AS admin_username
-                       FROM ban_history bh
-                       LEFT JOIN users u ON u.id = bh.user_id
-                       LEFT JOIN users a ON a.id = bh.admin_id
-                       WHERE bh.user_id=$1 ORDER BY bh.created_at DESC LIMIT $2 OFFSET $3""",
-                    user_id, limit, skip
-                )
-            else:
-                rows = await conn.fetch(
-                    """SELECT bh.id, bh.user_id, u.username, bh.action, bh.reason, bh.expires_at, bh.created_at,
-                              a.username AS admin_username
-                       FROM ban_history bh
-                       LEFT JOIN users u ON u.id = bh.user_id
-                       LEFT JOIN users a ON a.id = bh.admin_id
-                       ORDER BY bh.created_at DESC LIMIT $1 OFFSET $2""",
-                    limit, skip
-                )
+            rows = await conn.fetch(sql, *params)
             out = [dict(r) for r in rows]
         else:
-            q = """SELECT bh.id, bh.user_id, u.username, bh.action, bh.reason, bh.expires_at, bh.created_at,
-                          a.username FROM ban_history bh
-                   LEFT JOIN users u ON u.id=bh.user_id
-                   LEFT JOIN users a ON a.id=bh.admin_id"""
-            params = []
-            if user_id:
-                q += " WHERE bh.user_id=?"
-                params.append(user_id)
-            q += " ORDER BY bh.created_at DESC LIMIT ? OFFSET ?"
-            params += [limit, skip]
-            async with conn.execute(q, params) as cur:
+            async with conn.execute(sql, params) as cur:
                 rows = await cur.fetchall()
             out = [{"id": r[0], "user_id": r[1], "username": r[2], "action": r[3],
                     "reason": r[4], "expires_at": str(r[5]) if r[5] else None,
                     "created_at": str(r[6]), "admin_username": r[7]} for r in rows]
-    return {"ban_history": out, "skip": skip, "limit": limit}
+    next_cursor = None
+    if len(out) > limit:
+        out = out[:limit]
+        next_cursor = encode_cursor([out[-1]["created_at"], out[-1]["id"]])
+    return {"ban_history": out, "skip": offset, "limit": limit, "next_cursor": next_cursor}
+
+
+@api_router.get("/admin/export/{kind}")
+async def admin_export(
+    kind: str,
+    format: str = Query("csv"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    status: Optional[str] = None,
+    is_banned: Optional[bool] = None,
+    is_admin: Optional[bool] = None,
+    _admin_id: int = Depends(get_current_admin),
+):
+    """Полная выгрузка users / posts / reports / ban_history в CSV или NDJSON потоком (без лимита).
+    since / until — по created_at; user_id — автор поста, автор жалобы или забаненный;
+    status — для жалоб; is_banned / is_admin — для пользователей.
+    X-Total-Count — ожидаемое число строк, если оно известно без подсчёта (выгрузка без фильтров)."""
+    if kind not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Неизвестная выгрузка: {kind}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format должен быть одним из: {', '.join(EXPORT_FORMATS)}")
+    filters = {"user_id": user_id, "status": status, "is_banned": is_banned, "is_admin": is_admin}
+    try:
+        where, params = build_filters(kind, filters, since, until, get_db_type())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {
+        "Content-Disposition": f'attachment; filename="{kind}-{datetime.utcnow().strftime("%Y%m%d-%H%M%S")}.{format}"',
+        "Cache-Control": "no-store",
+    }
+    total = await total_rows(kind, bool(where))
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    return StreamingResponse(stream_export(kind, format, where, params), media_type=EXPORT_FORMATS[format], headers=headers)
 
 
 # ===================== Groups API =====================
 
+# Запись группы по slug и роль участника (group_id, user_id) -> role кэшируются в процессе:
+# каждая страница группы — несколько запросов к /groups/{slug}/..., и все начинают с этих двух выборок.
+# Эндпоинты, меняющие группу или состав, сбрасывают записи после коммита, но только в своём воркере,
+# поэтому кэш — лишь для чтения страниц; проверки прав в изменяющих эндпоинтах и доступ к закрытой
+# группе читают группу (is_private, owner_id) и роль из БД (fresh=True).
+# Отсутствие роли не кэшируется: вступивший в другом воркере сразу видит закрытую группу.
+GROUP_CACHE_TTL_SECONDS = int(os.getenv("GROUP_CACHE_TTL_SECONDS", "30"))
+group_cache = TTLCache(ttl=GROUP_CACHE_TTL_SECONDS, maxsize=10000)
+group_role_cache = TTLCache(ttl=GROUP_CACHE_TTL_SECONDS, maxsize=100000)
+
+
+def _invalidate_group(slug: str, group_id: Optional[int] = None) -> None:
+    """Сбросить запись группы; с group_id — ещё и все закэшированные роли в ней."""
+    group_cache.pop(slug)
+    if group_id is not None:
+        group_role_cache.invalidate_where(lambda key: key[0] == group_id)
+
+
 def _slugify(text: str) -> str:
     """Простой slugify: оставляем буквы, цифры, дефисы."""
     import unicodedata
@@ -3990,62 +4746,160 @@ def _group_row(r: dict) -> dict:
     }
 
 
-async def _get_group_by_slug(conn, slug: str, db_type: str):
+async def _get_group_by_slug(conn, slug: str, db_type: str, fresh: bool = False):
+    """Запись группы или None; fresh=True — мимо кэша (проверки прав, is_private и owner_id при изменениях
+    и при доступе к закрытой группе), запись в кэше при этом обновляется."""
+    if not fresh:
+        cached = group_cache.get(slug)
+        if cached is not None:
+            return cached
     if db_type == 'postgresql':
-        return await conn.fetchrow("SELECT * FROM groups WHERE slug=$1", slug)
+        r = await conn.fetchrow("SELECT * FROM groups WHERE slug=$1", slug)
+        g = dict(r) if r else None
     else:
-        async with conn.execute("SELECT id,name,slug,description,avatar_url,cover_url,is_private,owner_id,created_at FROM groups WHERE slug=?", (slug,)) as cur:
+        async with conn.execute("SELECT id,name,slug,description,avatar_url,cover_url,is_private,owner_id,created_at,members_count FROM groups WHERE slug=?", (slug,)) as cur:
             r = await cur.fetchone()
+        g = None
         if r:
-            return {"id": r[0], "name": r[1], "slug": r[2], "description": r[3],
-                    "avatar_url": r[4], "cover_url": r[5], "is_private": r[6],
-                    "owner_id": r[7], "created_at": r[8]}
-        return None
+            g = {"id": r[0], "name": r[1], "slug": r[2], "description": r[3],
+                 "avatar_url": r[4], "cover_url": r[5], "is_private": r[6],
+                 "owner_id": r[7], "created_at": r[8], "members_count": r[9]}
+    # Промахи не кэшируются: иначе только что созданная группа отдавала бы 404 до истечения TTL
+    if g is not None:
+        group_cache.set(slug, g)
+    else:
+        group_cache.pop(slug)
+    return g
 
 
-async def _get_member_role(conn, group_id: int, user_id: int, db_type: str):
+async def _get_member_role(conn, group_id: int, user_id: int, db_type: str, fresh: bool = False):
+    """Роль пользователя в группе или None; fresh=True — мимо кэша (для проверок прав при изменениях)."""
+    if not fresh:
+        role = group_role_cache.get((group_id, user_id))
+        if role is not None:
+            return role
     if db_type == 'postgresql':
         row = await conn.fetchrow("SELECT role FROM group_members WHERE group_id=$1 AND user_id=$2", group_id, user_id)
     else:
         async with conn.execute("SELECT role FROM group_members WHERE group_id=? AND user_id=?", (group_id, user_id)) as cur:
             row = await cur.fetchone()
         row = {"role": row[0]} if row else None
-    return row["role"] if row else None
+    role = row["role"] if row else None
+    if role is None:
+        group_role_cache.pop((group_id, user_id))
+    else:
+        group_role_cache.set((group_id, user_id), role)
+    return role
+
+
+async def _add_group_member(conn, db_type: str, group_id: int, user_id: int, role: str = "member") -> None:
+    """Добавить участника (если ещё не состоит) и увеличить groups.members_count."""
+    if db_type == 'postgresql':
+        await conn.execute(
+            """WITH ins AS (
+                   INSERT INTO group_members (group_id, user_id, role) VALUES ($1, $2, $3)
+                   ON CONFLICT DO NOTHING RETURNING 1
+               )
+               UPDATE groups SET members_count = members_count + (SELECT COUNT(*) FROM ins) WHERE id = $1""",
+            group_id, user_id, role
+        )
+    else:
+        cur = await conn.execute(
+            "INSERT OR IGNORE INTO group_members (group_id, user_id, role) VALUES (?, ?, ?)", (group_id, user_id, role)
+        )
+        if cur.rowcount:
+            await conn.execute("UPDATE groups SET members_count = members_count + 1 WHERE id = ?", (group_id,))
+
+
+async def _remove_group_member(conn, db_type: str, group_id: int, user_id: int) -> None:
+    """Удалить участника (если состоит) и уменьшить groups.members_count."""
+    if db_type == 'postgresql':
+        await conn.execute(
+            """WITH del AS (
+                   DELETE FROM group_members WHERE group_id = $1 AND user_id = $2 RETURNING 1
+               )
+               UPDATE groups SET members_count = members_count - (SELECT COUNT(*) FROM del) WHERE id = $1""",
+            group_id, user_id
+        )
+    else:
+        cur = await conn.execute("DELETE FROM group_members WHERE group_id = ? AND user_id = ?", (group_id, user_id))
+        if cur.rowcount:
+            await conn.execute("UPDATE groups SET members_count = members_count - 1 WHERE id = ?", (group_id,))
+
+
+async def _member_roles(conn, db_type: str, group_ids: List[int], user_id: Optional[int]) -> dict:
+    """Роли пользователя в пачке групп одним запросом: group_id -> role."""
+    if not user_id or not group_ids:
+        return {}
+    if db_type == 'postgresql':
+        rows = await conn.fetch(
+            "SELECT group_id, role FROM group_members WHERE user_id = $1 AND group_id = ANY($2::int[])",
+            user_id, group_ids
+        )
+        return {r["group_id"]: r["role"] for r in rows}
+    async with conn.execute(
+        f"SELECT group_id, role FROM group_members WHERE user_id = ? AND group_id IN ({','.join('?' * len(group_ids))})",
+        (user_id, *group_ids)
+    ) as cur:
+        return {r[0]: r[1] for r in await cur.fetchall()}
+
+
+GROUP_SLUG_ATTEMPTS = 5
+
+
+async def _slug_suffix_range(conn, db_type: str, base: str) -> Tuple[Optional[int], Optional[int]]:
+    """Наименьший и наибольший занятые номера для основы slug; (None, None) — основа ещё не занята."""
+    if db_type == 'postgresql':
+        row = await conn.fetchrow("SELECT MIN(slug_suffix), MAX(slug_suffix) FROM groups WHERE slug_base = $1", base)
+        return row[0], row[1]
+    async with conn.execute("SELECT MIN(slug_suffix), MAX(slug_suffix) FROM groups WHERE slug_base = ?", (base,)) as cur:
+        row = await cur.fetchone()
+        return row[0], row[1]
 
 
 @api_router.post("/groups")
 async def create_group(data: GroupCreate, user_id: int = Depends(get_current_user_id)):
-    base_slug = _slugify(data.name) or f"group-{user_id}"
-    slug = base_slug
+    """Slug — основа из имени, если она свободна, иначе следующий номер после наибольшего занятого
+    (один запрос к индексу).
+    slug_base / slug_suffix хранятся разбором итогового slug (split_group_slug), как при заполнении
+    старых строк: группа «Room 1» — это основа room и номер 1, и следующая «Room» их учитывает.
+    Конфликт уникальности (параллельное создание) — повтор со следующим номером."""
+    base_slug = (_slugify(data.name) or f"group-{user_id}")[:GROUP_SLUG_BASE_MAX].rstrip("-") or f"group-{user_id}"
     db_type = get_db_type()
     async with get_db() as conn:
-        # Уникальность slug
-        counter = 1
-        while True:
+        suffix = -1
+        for _ in range(GROUP_SLUG_ATTEMPTS):
+            low, top = await _slug_suffix_range(conn, db_type, base_slug)
+            # Голая основа — только первой попыткой и если номера 0 нет; иначе и после любого конфликта —
+            # сразу следующий после наибольшего (основа «python-3» сама занята как python / 3 и в MAX не видна)
+            if suffix < 0 and (low is None or low > 0):
+                suffix = 0
+            else:
+                suffix = max(suffix + 1, (top or 0) + 1)
+            slug = f"{base_slug}-{suffix}" if suffix else base_slug
+            slug_base, slug_suffix = split_group_slug(slug)
             if db_type == 'postgresql':
-                exists = await conn.fetchval("SELECT 1 FROM groups WHERE slug=$1", slug)
+                async with conn.transaction():
+                    gid = await conn.fetchval(
+                        """INSERT INTO groups (name,slug,slug_base,slug_suffix,description,is_private,owner_id)
+                           VALUES($1,$2,$3,$4,$5,$6,$7) ON CONFLICT (slug) DO NOTHING RETURNING id""",
+                        data.name, slug, slug_base, slug_suffix, data.description, data.is_private, user_id
+                    )
+                    if gid:
+                        await _add_group_member(conn, db_type, gid, user_id, "owner")
             else:
-                async with conn.execute("SELECT 1 FROM groups WHERE slug=?", (slug,)) as cur:
-                    exists = await cur.fetchone()
-            if not exists:
-                break
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        if db_type == 'postgresql':
-            gid = await conn.fetchval(
-                "INSERT INTO groups (name,slug,description,is_private,owner_id) VALUES($1,$2,$3,$4,$5) RETURNING id",
-                data.name, slug, data.description, data.is_private, user_id
-            )
-            await conn.execute("INSERT INTO group_members (group_id,user_id,role) VALUES($1,$2,'owner')", gid, user_id)
-        else:
-            cur = await conn.execute(
-                "INSERT INTO groups (name,slug,description,is_private,owner_id) VALUES(?,?,?,?,?)",
-                (data.name, slug, data.description, int(data.is_private), user_id)
-            )
-            gid = cur.lastrowid
-            await conn.execute("INSERT INTO group_members (group_id,user_id,role) VALUES(?,?,'owner')", (gid, user_id))
-            await conn.commit()
-    return {"id": gid, "slug": slug, "name": data.name}
+                cur = await conn.execute(
+                    """INSERT INTO groups (name,slug,slug_base,slug_suffix,description,is_private,owner_id)
+                       VALUES(?,?,?,?,?,?,?) ON CONFLICT (slug) DO NOTHING""",
+                    (data.name, slug, slug_base, slug_suffix, data.description, int(data.is_private), user_id)
+                )
+                gid = cur.lastrowid if cur.rowcount else None
+                if gid:
+                    await _add_group_member(conn, db_type, gid, user_id, "owner")
+                    await conn.commit()
+            if gid:
+                return {"id": gid, "slug": slug, "name": data.name}
+    raise HTTPException(status_code=409, detail="Не удалось подобрать адрес группы, попробуйте ещё раз")
 
 
 @api_router.get("/groups")
@@ -4055,47 +4909,38 @@ async def list_groups(
     limit: int = Query(20, ge=1, le=50),
     user_id: Optional[int] = Depends(get_current_user_id),
 ):
+    """Каталог групп: одна выборка страницы (members_count хранится в groups) и один запрос ролей."""
     db_type = get_db_type()
     async with get_db() as conn:
         if db_type == 'postgresql':
             if q:
                 rows = await conn.fetch(
-                    """SELECT g.*, (SELECT COUNT(*) FROM group_members WHERE group_id=g.id) AS members_count,
-                              (SELECT role FROM group_members WHERE group_id=g.id AND user_id=$3) AS my_role
-                       FROM groups g WHERE g.name ILIKE $1 ORDER BY g.created_at DESC LIMIT $2 OFFSET $4""",
-                    f"%{q}%", limit, user_id, skip
+                    "SELECT g.* FROM groups g WHERE g.name ILIKE $1 ORDER BY g.created_at DESC LIMIT $2 OFFSET $3",
+                    f"%{q}%", limit, skip
                 )
             else:
                 rows = await conn.fetch(
-                    """SELECT g.*, (SELECT COUNT(*) FROM group_members WHERE group_id=g.id) AS members_count,
-                              (SELECT role FROM group_members WHERE group_id=g.id AND user_id=$1) AS my_role
-                       FROM groups g ORDER BY g.created_at DESC LIMIT $2 OFFSET $3""",
-                    user_id, limit, skip
+                    "SELECT g.* FROM groups g ORDER BY g.created_at DESC LIMIT $1 OFFSET $2",
+                    limit, skip
                 )
-            out = [_group_row(dict(r)) for r in rows]
+            groups = [dict(r) for r in rows]
         else:
+            cols = "id,name,slug,description,avatar_url,cover_url,is_private,owner_id,created_at,members_count"
             if q:
                 async with conn.execute(
-                    "SELECT id,name,slug,description,avatar_url,cover_url,is_private,owner_id,created_at FROM groups WHERE name LIKE ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                    f"SELECT {cols} FROM groups WHERE name LIKE ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
                     (f"%{q}%", limit, skip)
                 ) as cur:
                     rows = await cur.fetchall()
             else:
                 async with conn.execute(
-                    "SELECT id,name,slug,description,avatar_url,cover_url,is_private,owner_id,created_at FROM groups ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                    f"SELECT {cols} FROM groups ORDER BY created_at DESC LIMIT ? OFFSET ?",
                     (limit, skip)
                 ) as cur:
                     rows = await cur.fetchall()
-            out = []
-            for r in rows:
-                async with conn.execute("SELECT COUNT(*) FROM group_members WHERE group_id=?", (r[0],)) as mc:
-                    cnt = (await mc.fetchone())[0]
-                async with conn.execute("SELECT role FROM group_members WHERE group_id=? AND user_id=?", (r[0], user_id)) as rc:
-                    role_row = await rc.fetchone()
-                out.append({"id": r[0], "name": r[1], "slug": r[2], "description": r[3],
-                             "avatar_url": r[4], "cover_url": r[5], "is_private": bool(r[6]),
-                             "owner_id": r[7], "created_at": str(r[8]),
-                             "members_count": cnt, "my_role": role_row[0] if role_row else None})
+            groups = [dict(zip(cols.split(","), r)) for r in rows]
+        roles = await _member_roles(conn, db_type, [g["id"] for g in groups], user_id)
+    out = [_group_row({**g, "my_role": roles.get(g["id"])}) for g in groups]
     return {"groups": out}
 
 
@@ -4106,15 +4951,8 @@ async def get_group(slug: str, user_id: Optional[int] = Depends(get_current_user
         g = await _get_group_by_slug(conn, slug, db_type)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
-        gid = g["id"]
-        if db_type == 'postgresql':
-            cnt = await conn.fetchval("SELECT COUNT(*) FROM group_members WHERE group_id=$1", gid)
-            my_role = await _get_member_role(conn, gid, user_id, db_type) if user_id else None
-        else:
-            async with conn.execute("SELECT COUNT(*) FROM group_members WHERE group_id=?", (gid,)) as mc:
-                cnt = (await mc.fetchone())[0]
-            my_role = await _get_member_role(conn, gid, user_id, db_type) if user_id else None
-        info = _group_row({**dict(g), "members_count": cnt, "my_role": my_role})
+        my_role = await _get_member_role(conn, g["id"], user_id, db_type) if user_id else None
+        info = _group_row({**dict(g), "my_role": my_role})
     return info
 
 
@@ -4122,10 +4960,10 @@ async def get_group(slug: str, user_id: Optional[int] = Depends(get_current_user
 async def update_group(slug: str, data: GroupUpdate, user_id: int = Depends(get_current_user_id)):
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
-        role = await _get_member_role(conn, g["id"], user_id, db_type)
+        role = await _get_member_role(conn, g["id"], user_id, db_type, fresh=True)
         if role not in ("owner", "moderator"):
             raise HTTPException(status_code=403, detail="Нет прав")
         fields = {k: v for k, v in data.model_dump().items() if v is not None}
@@ -4141,6 +4979,7 @@ async def update_group(slug: str, data: GroupUpdate, user_id: int = Depends(get_
             vals = list(fields.values()) + [gid]
             await conn.execute(f"UPDATE groups SET {', '.join(parts)} WHERE id=?", vals)
             await conn.commit()
+    _invalidate_group(slug)
     return {"ok": True}
 
 
@@ -4148,19 +4987,19 @@ async def update_group(slug: str, data: GroupUpdate, user_id: int = Depends(get_
 async def join_group(slug: str, user_id: int = Depends(get_current_user_id)):
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
         gid = g["id"]
-        role = await _get_member_role(conn, gid, user_id, db_type)
+        role = await _get_member_role(conn, gid, user_id, db_type, fresh=True)
         if role:
             raise HTTPException(status_code=400, detail="Вы уже состоите в группе")
         if not g["is_private"]:
-            if db_type == 'postgresql':
-                await conn.execute("INSERT INTO group_members (group_id,user_id,role) VALUES($1,$2,'member') ON CONFLICT DO NOTHING", gid, user_id)
-            else:
-                await conn.execute("INSERT OR IGNORE INTO group_members (group_id,user_id,role) VALUES(?,?,'member')", (gid, user_id))
+            await _add_group_member(conn, db_type, gid, user_id)
+            if db_type != 'postgresql':
                 await conn.commit()
+            _invalidate_group(slug)
+            group_role_cache.pop((gid, user_id))
             return {"status": "joined"}
         else:
             if db_type == 'postgresql':
@@ -4181,56 +5020,92 @@ async def join_group(slug: str, user_id: int = Depends(get_current_user_id)):
 async def leave_group(slug: str, user_id: int = Depends(get_current_user_id)):
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
         gid = g["id"]
         if g["owner_id"] == user_id:
             raise HTTPException(status_code=400, detail="Владелец не может покинуть группу. Передайте владение или удалите группу.")
-        if db_type == 'postgresql':
-            await conn.execute("DELETE FROM group_members WHERE group_id=$1 AND user_id=$2", gid, user_id)
-        else:
-            await conn.execute("DELETE FROM group_members WHERE group_id=? AND user_id=?", (gid, user_id))
+        await _remove_group_member(conn, db_type, gid, user_id)
+        if db_type != 'postgresql':
             await conn.commit()
+    _invalidate_group(slug)
+    group_role_cache.pop((gid, user_id))
     return {"ok": True}
 
 
+GROUP_ROLES = ("owner", "moderator", "member")
+
+
 @api_router.get("/groups/{slug}/members")
-async def group_members(slug: str, user_id: Optional[int] = Depends(get_current_user_id)):
+async def group_members(
+    slug: str,
+    role: Optional[str] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    count_only: bool = Query(False),
+    user_id: Optional[int] = Depends(get_current_user_id),
+):
+    """Участники группы по времени вступления, страницами по limit (cursor=next_cursor из ответа).
+    role — только owner / moderator / member; count_only — вернуть только {"count"}."""
+    if role is not None and role not in GROUP_ROLES:
+        raise HTTPException(status_code=400, detail="role: owner, moderator или member")
+    after = decode_cursor(cursor, (CURSOR_TIME, int))
     db_type = get_db_type()
+    pg = db_type == 'postgresql'
     async with get_db() as conn:
         g = await _get_group_by_slug(conn, slug, db_type)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
         gid = g["id"]
-        if db_type == 'postgresql':
-            rows = await conn.fetch(
-                """SELECT u.id, u.username, u.avatar_url, gm.role, gm.joined_at
-                   FROM group_members gm JOIN users u ON u.id=gm.user_id
-                   WHERE gm.group_id=$1 ORDER BY gm.joined_at""",
-                gid
+        params: list = [gid]
+        where = ["gm.group_id = " + ("$1" if pg else "?")]
+        if role:
+            params.append(role)
+            where.append("gm.role = " + (f"${len(params)}" if pg else "?"))
+        if count_only:
+            if not role:
+                return {"count": g["members_count"]}
+            sql = f"SELECT COUNT(*) FROM group_members gm WHERE {' AND '.join(where)}"
+            if pg:
+                return {"count": await conn.fetchval(sql, *params)}
+            async with conn.execute(sql, params) as cur:
+                return {"count": (await cur.fetchone())[0]}
+        if after:
+            cond, cond_params = keyset_condition(
+                ["gm.joined_at", "gm.user_id"], [cursor_datetime(after[0], db_type), after[1]], db_type, len(params) + 1
             )
-            out = [dict(r) for r in rows]
+            where.append(cond)
+            params += cond_params
+        params.append(limit + 1)
+        # Страница выбирается по индексу (group_id, [role,] joined_at, user_id), users — только для неё
+        sql = f"""SELECT u.id, u.username, u.avatar_url, gm.role, gm.joined_at
+                  FROM (SELECT gm.user_id, gm.role, gm.joined_at FROM group_members gm
+                        WHERE {' AND '.join(where)} ORDER BY gm.joined_at, gm.user_id
+                        LIMIT {f"${len(params)}" if pg else "?"}) gm
+                  JOIN users u ON u.id = gm.user_id
+                  ORDER BY gm.joined_at, gm.user_id"""
+        if pg:
+            out = [dict(r) for r in await conn.fetch(sql, *params)]
         else:
-            async with conn.execute(
-                """SELECT u.id, u.username, u.avatar_url, gm.role, gm.joined_at
-                   FROM group_members gm JOIN users u ON u.id=gm.user_id
-                   WHERE gm.group_id=? ORDER BY gm.joined_at""",
-                (gid,)
-            ) as cur:
+            async with conn.execute(sql, params) as cur:
                 rows = await cur.fetchall()
             out = [{"id": r[0], "username": r[1], "avatar_url": r[2], "role": r[3], "joined_at": str(r[4])} for r in rows]
-    return {"members": out}
+    next_cursor = None
+    if len(out) > limit:
+        out = out[:limit]
+        next_cursor = encode_cursor([out[-1]["joined_at"], out[-1]["id"]])
+    return {"members": out, "next_cursor": next_cursor}
 
 
 @api_router.get("/groups/{slug}/requests")
 async def group_join_requests(slug: str, user_id: int = Depends(get_current_user_id)):
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
-        role = await _get_member_role(conn, g["id"], user_id, db_type)
+        role = await _get_member_role(conn, g["id"], user_id, db_type, fresh=True)
         if role not in ("owner", "moderator"):
             raise HTTPException(status_code=403, detail="Нет прав")
         gid = g["id"]
@@ -4264,10 +5139,10 @@ async def review_join_request(slug: str, request_id: int, data: JoinRequestActio
         raise HTTPException(status_code=400, detail="action: accept или reject")
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
-        role = await _get_member_role(conn, g["id"], user_id, db_type)
+        role = await _get_member_role(conn, g["id"], user_id, db_type, fresh=True)
         if role not in ("owner", "moderator"):
             raise HTTPException(status_code=403, detail="Нет прав")
         gid = g["id"]
@@ -4282,14 +5157,18 @@ async def review_join_request(slug: str, request_id: int, data: JoinRequestActio
         req_user_id = row["user_id"]
         new_status = "accepted" if data.action == "accept" else "rejected"
         if db_type == 'postgresql':
-            await conn.execute("UPDATE group_join_requests SET status=$1 WHERE id=$2", new_status, request_id)
-            if data.action == "accept":
-                await conn.execute("INSERT INTO group_members (group_id,user_id,role) VALUES($1,$2,'member') ON CONFLICT DO NOTHING", gid, req_user_id)
+            async with conn.transaction():
+                await conn.execute("UPDATE group_join_requests SET status=$1 WHERE id=$2", new_status, request_id)
+                if data.action == "accept":
+                    await _add_group_member(conn, db_type, gid, req_user_id)
         else:
             await conn.execute("UPDATE group_join_requests SET status=? WHERE id=?", (new_status, request_id))
             if data.action == "accept":
-                await conn.execute("INSERT OR IGNORE INTO group_members (group_id,user_id,role) VALUES(?,?,'member')", (gid, req_user_id))
+                await _add_group_member(conn, db_type, gid, req_user_id)
             await conn.commit()
+    if data.action == "accept":
+        _invalidate_group(slug)
+        group_role_cache.pop((gid, req_user_id))
     return {"ok": True}
 
 
@@ -4299,7 +5178,7 @@ async def update_member_role(slug: str, target_user_id: int, role: str, user_id:
         raise HTTPException(status_code=400, detail="role: member или moderator")
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
         if g["owner_id"] != user_id:
@@ -4310,6 +5189,7 @@ async def update_member_role(slug: str, target_user_id: int, role: str, user_id:
         else:
             await conn.execute("UPDATE group_members SET role=? WHERE group_id=? AND user_id=?", (role, gid, target_user_id))
             await conn.commit()
+    group_role_cache.pop((gid, target_user_id))
     return {"ok": True}
 
 
@@ -4317,20 +5197,20 @@ async def update_member_role(slug: str, target_user_id: int, role: str, user_id:
 async def kick_member(slug: str, target_user_id: int, user_id: int = Depends(get_current_user_id)):
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
-        role = await _get_member_role(conn, g["id"], user_id, db_type)
+        role = await _get_member_role(conn, g["id"], user_id, db_type, fresh=True)
         if role not in ("owner", "moderator"):
             raise HTTPException(status_code=403, detail="Нет прав")
         if target_user_id == g["owner_id"]:
             raise HTTPException(status_code=400, detail="Нельзя исключить владельца")
         gid = g["id"]
-        if db_type == 'postgresql':
-            await conn.execute("DELETE FROM group_members WHERE group_id=$1 AND user_id=$2", gid, target_user_id)
-        else:
-            await conn.execute("DELETE FROM group_members WHERE group_id=? AND user_id=?", (gid, target_user_id))
+        await _remove_group_member(conn, db_type, gid, target_user_id)
+        if db_type != 'postgresql':
             await conn.commit()
+    _invalidate_group(slug)
+    group_role_cache.pop((gid, target_user_id))
     return {"ok": True}
 
 
@@ -4345,10 +5225,10 @@ async def create_group_post(slug: str, content: str = None, media_url: str = Non
             pass
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
-        role = await _get_member_role(conn, g["id"], user_id, db_type)
+        role = await _get_member_role(conn, g["id"], user_id, db_type, fresh=True)
         if not role:
             raise HTTPException(status_code=403, detail="Вы не состоите в группе")
         gid = g["id"]
@@ -4367,54 +5247,205 @@ async def create_group_post(slug: str, content: str = None, media_url: str = Non
     return {"id": pid, "group_id": gid}
 
 
+def _group_post_item(r: dict, with_group: bool = False) -> dict:
+    item = {
+        "id": r["id"], "content": r["content"], "media_url": r["media_url"], "created_at": r["created_at"],
+        "author_id": r["author_id"], "author_username": r["author_username"], "author_avatar": r["author_avatar"],
+        "likes": r["likes_count"], "comments": r["comments_count"], "liked": bool(r["liked"]),
+    }
+    if with_group:
+        item["group"] = {"id": r["group_id"], "name": r["group_name"], "slug": r["group_slug"]}
+    return item
+
+
+async def _group_post_context(conn, db_type: str, slug: str, post_id: int, user_id: int) -> dict:
+    """Группа поста; 404 — нет группы или поста в ней, 403 — закрытая группа, а пользователь не участник."""
+    g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
+    if not g:
+        raise HTTPException(status_code=404, detail="Группа не найдена")
+    if g["is_private"] and not await _get_member_role(conn, g["id"], user_id, db_type, fresh=True):
+        raise HTTPException(status_code=403, detail="Группа закрытая")
+    if db_type == 'postgresql':
+        exists = await conn.fetchval("SELECT 1 FROM group_posts WHERE id=$1 AND group_id=$2", post_id, g["id"])
+    else:
+        async with conn.execute("SELECT 1 FROM group_posts WHERE id=? AND group_id=?", (post_id, g["id"])) as cur:
+            exists = await cur.fetchone()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Пост не найден")
+    return g
+
+
 @api_router.get("/groups/{slug}/posts")
 async def get_group_posts(
     slug: str,
-    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
     limit: int = Query(20, ge=1, le=50),
     user_id: Optional[int] = Depends(get_current_user_id),
 ):
+    """Посты группы от новых к старым. Следующая страница — cursor=next_cursor из ответа."""
+    after = decode_cursor(cursor, (CURSOR_TIME, int))
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
         gid = g["id"]
         if g["is_private"]:
-            role = await _get_member_role(conn, gid, user_id, db_type) if user_id else None
+            role = await _get_member_role(conn, gid, user_id, db_type, fresh=True) if user_id else None
             if not role:
                 raise HTTPException(status_code=403, detail="Группа закрытая")
+        rows = await load_group_posts(conn, db_type, gid, after, limit, user_id)
+    key = next_key(rows, limit)
+    return {
+        "posts": [_group_post_item(r) for r in rows[:limit]],
+        "group": {"id": gid, "name": g["name"], "slug": g["slug"]},
+        "next_cursor": encode_cursor(key) if key else None,
+    }
+
+
+@api_router.get("/feed/groups")
+async def get_groups_feed(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=50),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Лента постов всех групп, где состоит пользователь, от новых к старым.
+    Следующая страница — cursor=next_cursor из ответа."""
+    after = decode_cursor(cursor, (CURSOR_TIME, int))
+    db_type = get_db_type()
+    async with get_db() as conn:
+        rows = await load_group_feed(conn, db_type, user_id, after, limit)
+    key = next_key(rows, limit)
+    return {
+        "posts": [_group_post_item(r, with_group=True) for r in rows[:limit]],
+        "next_cursor": encode_cursor(key) if key else None,
+    }
+
+
+@api_router.post("/groups/{slug}/posts/{post_id}/like")
+async def like_group_post(slug: str, post_id: int, user_id: int = Depends(get_current_user_id)):
+    """Поставить/убрать лайк посту группы"""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        await _group_post_context(conn, db_type, slug, post_id, user_id)
         if db_type == 'postgresql':
-            rows = await conn.fetch(
-                """SELECT gp.id, gp.content, gp.media_url, gp.created_at,
-                          u.id AS author_id, u.username AS author_username, u.avatar_url AS author_avatar
-                   FROM group_posts gp JOIN users u ON u.id=gp.author_id
-                   WHERE gp.group_id=$1 ORDER BY gp.created_at DESC LIMIT $2 OFFSET $3""",
-                gid, limit, skip
-            )
-            out = [dict(r) for r in rows]
+            async with conn.transaction():
+                result = await toggle_like(conn, db_type, post_id, user_id, table="group_posts")
         else:
-            async with conn.execute(
-                """SELECT gp.id, gp.content, gp.media_url, gp.created_at,
-                          u.id, u.username, u.avatar_url
-                   FROM group_posts gp JOIN users u ON u.id=gp.author_id
-                   WHERE gp.group_id=? ORDER BY gp.created_at DESC LIMIT ? OFFSET ?""",
-                (gid, limit, skip)
-            ) as cur:
-                rows = await cur.fetchall()
-            out = [{"id": r[0], "content": r[1], "media_url": r[2], "created_at": str(r[3]),
-                    "author_id": r[4], "author_username": r[5], "author_avatar": r[6]} for r in rows]
-    return {"posts": out, "group": {"id": gid, "name": g["name"], "slug": g["slug"]}}
+            result = await toggle_like(conn, db_type, post_id, user_id, table="group_posts")
+            await conn.commit()
+    if result is None:
+        raise HTTPException(status_code=404, detail="Пост не найден")
+    liked, changed, likes, post_author = result
+    if liked and changed:
+        metrics.record("likes")
+        if post_author != user_id:
+            await create_notification(
+                user_id=post_author,
+                notif_type="group_post_like",
+                actor_id=user_id,
+                target_id=post_id,
+                target_type="group_post",
+                content="поставил(а) лайк вашему посту в группе"
+            )
+    return {"liked": liked, "likes": likes}
+
+
+@api_router.post("/groups/{slug}/posts/{post_id}/comments", response_model=CommentResponse)
+async def add_group_post_comment(slug: str, post_id: int, data: CommentCreate, user_id: int = Depends(get_current_user_id)):
+    """Комментарий или ответ к посту группы; comments_count поста обновляется в той же транзакции."""
+    content = (data.content or "").strip()
+    if not content:
+        raise HTTPException(status_code=400, detail="Content required")
+    db_type = get_db_type()
+    async with get_db() as conn:
+        await _group_post_context(conn, db_type, slug, post_id, user_id)
+        try:
+            if db_type == 'postgresql':
+                async with conn.transaction():
+                    cid, parent_id, depth = await insert_comment(
+                        conn, db_type, post_id, user_id, content, data.parent_id, table="group_post_comments"
+                    )
+                    await conn.execute("UPDATE group_posts SET comments_count = comments_count + 1 WHERE id = $1", post_id)
+                row = await conn.fetchrow(
+                    """SELECT c.created_at, u.username, u.avatar_url
+                       FROM group_post_comments c JOIN users u ON u.id = c.user_id WHERE c.id = $1""",
+                    cid
+                )
+            else:
+                cid, parent_id, depth = await insert_comment(
+                    conn, db_type, post_id, user_id, content, data.parent_id, table="group_post_comments"
+                )
+                await conn.execute("UPDATE group_posts SET comments_count = comments_count + 1 WHERE id = ?", (post_id,))
+                await conn.commit()
+                async with conn.execute(
+                    """SELECT c.created_at, u.username, u.avatar_url
+                       FROM group_post_comments c JOIN users u ON u.id = c.user_id WHERE c.id = ?""",
+                    (cid,)
+                ) as cur:
+                    r = await cur.fetchone()
+                row = dict(zip(["created_at", "username", "avatar_url"], r))
+        except LookupError:
+            raise HTTPException(status_code=404, detail="Comment not found")
+    return CommentResponse(id=cid, post_id=post_id, user_id=user_id, username=row["username"], avatar_url=row["avatar_url"],
+                           content=content, created_at=row["created_at"], parent_id=parent_id, depth=depth)
+
+
+@api_router.get("/groups/{slug}/posts/{post_id}/threads")
+async def get_group_post_threads(
+    slug: str,
+    post_id: int,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=PAGINATION_MAX_LIMIT),
+    replies: int = Query(3, ge=0, le=THREAD_REPLIES_MAX),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Ветки комментариев поста группы — как /posts/{post_id}/threads."""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        await _group_post_context(conn, db_type, slug, post_id, user_id)
+        roots, has_more = await load_threads(
+            conn, db_type, post_id, after_id or 0, limit, replies, table="group_post_comments"
+        )
+    return {
+        "items": [_thread_item(r) for r in roots],
+        "next_after_id": roots[-1]["id"] if has_more else None,
+    }
+
+
+@api_router.get("/groups/{slug}/posts/{post_id}/comments/{comment_id}/replies")
+async def get_group_comment_replies(
+    slug: str,
+    post_id: int,
+    comment_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=PAGINATION_MAX_LIMIT),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Ответы на комментарий к посту группы — как /comments/{comment_id}/replies."""
+    after = decode_cursor(cursor, (str,))
+    db_type = get_db_type()
+    async with get_db() as conn:
+        await _group_post_context(conn, db_type, slug, post_id, user_id)
+        try:
+            rows, has_more = await load_replies(
+                conn, db_type, comment_id, after[0] if after else None, limit,
+                table="group_post_comments", post_id=post_id
+            )
+        except LookupError:
+            raise HTTPException(status_code=404, detail="Comment not found")
+    next_cursor = encode_cursor([rows[-1]["path"]]) if has_more else None
+    return {"items": [_thread_item(r) for r in rows], "next_cursor": next_cursor}
 
 
 @api_router.delete("/groups/{slug}/posts/{post_id}")
 async def delete_group_post(slug: str, post_id: int, user_id: int = Depends(get_current_user_id)):
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
-        role = await _get_member_role(conn, g["id"], user_id, db_type)
+        role = await _get_member_role(conn, g["id"], user_id, db_type, fresh=True)
         if db_type == 'postgresql':
             post = await conn.fetchrow("SELECT author_id FROM group_posts WHERE id=$1 AND group_id=$2", post_id, g["id"])
         else:
@@ -4437,7 +5468,7 @@ async def delete_group_post(slug: str, post_id: int, user_id: int = Depends(get_
 async def delete_group(slug: str, user_id: int = Depends(get_current_user_id)):
     db_type = get_db_type()
     async with get_db() as conn:
-        g = await _get_group_by_slug(conn, slug, db_type)
+        g = await _get_group_by_slug(conn, slug, db_type, fresh=True)
         if not g:
             raise HTTPException(status_code=404, detail="Группа не найдена")
         if g["owner_id"] != user_id:
@@ -4447,6 +5478,7 @@ async def delete_group(slug: str, user_id: int = Depends(get_current_user_id)):
         else:
             await conn.execute("DELETE FROM groups WHERE id=?", (g["id"],))
             await conn.commit()
+    _invalidate_group(slug, g["id"])
     return {"ok": True}
 
 
@@ -4497,3 +5529,4 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+startup_profile.mark("объявление моделей и роутов")
@@ -0,0 +1,340 @@
+"""
+Социальный граф в памяти процесса
+Компактные списки смежности по таблице friendships: принятые дружбы и заявки в обе стороны.
+Рекомендации и подсказки берут связи отсюда, а не сканируют friendships
+с условием requester_id = ? OR addressee_id = ?.
+Загружается при старте, обновляется хуками из эндпоинтов дружбы и периодически перечитывается
+(чтобы подхватить изменения из других воркеров). До перезагрузки граф воркера может отставать,
+поэтому проверки при записи и списки заявок читают БД, а граф — только ускоритель чтения.
+На его основе строятся рекомендации друзей: друзья друзей с числом общих друзей,
+плюс общие группы и подписки на теги.
+"""
+import asyncio
+import logging
+import os
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from cache import TTLCache
+from database import get_db, get_db_type
+
+logger = logging.getLogger(__name__)
+
+SOCIAL_GRAPH_RELOAD_SECONDS = int(os.getenv("SOCIAL_GRAPH_RELOAD_SECONDS", "300"))
+# Читать друзей из симметричной friend_edges (индекс по PK) вместо OR/CASE по friendships
+USE_FRIEND_EDGES = os.getenv("USE_FRIEND_EDGES", "1") == "1"
+# Веса сигналов в скоре рекомендации друга
+SUGGEST_MUTUAL_WEIGHT = float(os.getenv("SUGGEST_MUTUAL_WEIGHT", "1.0"))
+SUGGEST_GROUP_WEIGHT = float(os.getenv("SUGGEST_GROUP_WEIGHT", "0.5"))
+SUGGEST_TAG_WEIGHT = float(os.getenv("SUGGEST_TAG_WEIGHT", "0.25"))
+# Сколько кандидатов из общих групп рассматривать (большие группы иначе дают тысячи «знакомых»)
+SUGGEST_GROUP_CANDIDATES = int(os.getenv("SUGGEST_GROUP_CANDIDATES", "500"))
+SUGGEST_CACHE_TTL_SECONDS = int(os.getenv("SUGGEST_CACHE_TTL_SECONDS", "600"))
+# Сколько рекомендаций считаем и кладём в кэш за раз
+SUGGEST_CACHE_SIZE = int(os.getenv("SUGGEST_CACHE_SIZE", "50"))
+
+
+def friend_ids_subquery(ph: str) -> Tuple[str, int]:
+    """Подзапрос «id друзей пользователя ph» и сколько раз в нём встречается параметр
+    (для SQLite с позиционными ? это число параметров, которые нужно передать)."""
+    if USE_FRIEND_EDGES:
+        return f"SELECT friend_id FROM friend_edges WHERE user_id = {ph}", 1
+    return (
+        f"SELECT CASE WHEN requester_id = {ph} THEN addressee_id ELSE requester_id END FROM friendships "
+        f"WHERE (requester_id = {ph} OR addressee_id = {ph}) AND status = 'accepted'",
+        3,
+    )
+
+
+def _insort(lists: Dict[int, array], key: int, value: int) -> None:
+    arr = lists.get(key)
+    if arr is None:
+        lists[key] = array("i", [value])
+        return
+    i = bisect_left(arr, value)
+    if i == len(arr) or arr[i] != value:
+        arr.insert(i, value)
+
+
+def _discard(lists: Dict[int, array], key: int, value: int) -> None:
+    arr = lists.get(key)
+    if not arr:
+        return
+    i = bisect_left(arr, value)
+    if i < len(arr) and arr[i] == value:
+        del arr[i]
+        if not arr:
+            del lists[key]
+
+
+def _contains(lists: Dict[int, array], key: int, value: int) -> bool:
+    arr = lists.get(key)
+    if not arr:
+        return False
+    i = bisect_left(arr, value)
+    return i < len(arr) and arr[i] == value
+
+
+def _freeze(raw: Dict[int, List[int]]) -> Dict[int, array]:
+    return {k: array("i", sorted(set(v))) for k, v in raw.items()}
+
+
+_EMPTY = array("i")
+
+
+class SocialGraph:
+    """Списки смежности: user_id -> отсортированный array('i') id.
+
+    friends — принятые дружбы (симметрично), incoming / outgoing — входящие и исходящие
+    заявки в статусе pending. Массив int32 занимает ~4 байта на связь против ~60 у set,
+    проверка связи — бинарный поиск.
+    """
+
+    def __init__(self):
+        self._friends: Dict[int, array] = {}
+        self._incoming: Dict[int, array] = {}
+        self._outgoing: Dict[int, array] = {}
+        self.ready = False
+        # Пока load() читает БД, хуки копятся здесь и повторяются на новых списках
+        self._pending: Optional[List[tuple]] = None
+
+    def _record(self, *event) -> None:
+        if self._pending is not None:
+            self._pending.append(event)
+
+    def friends(self, user_id: int) -> array:
+        return self._friends.get(user_id, _EMPTY)
+
+    def incoming(self, user_id: int) -> array:
+        return self._incoming.get(user_id, _EMPTY)
+
+    def outgoing(self, user_id: int) -> array:
+        return self._outgoing.get(user_id, _EMPTY)
+
+    def are_friends(self, a: int, b: int) -> bool:
+        return _contains(self._friends, a, b)
+
+    def relation(self, user_id: int, other_id: int) -> Optional[str]:
+        """'accepted', 'outgoing' (user_id отправил заявку), 'incoming' или None."""
+        if _contains(self._friends, user_id, other_id):
+            return "accepted"
+        if _contains(self._outgoing, user_id, other_id):
+            return "outgoing"
+        if _contains(self._incoming, user_id, other_id):
+            return "incoming"
+        return None
+
+    def related(self, user_id: int) -> Set[int]:
+        """Все, с кем у пользователя есть связь: друзья и заявки в обе стороны."""
+        return set(self.friends(user_id)) | set(self.incoming(user_id)) | set(self.outgoing(user_id))
+
+    def add_request(self, requester_id: int, addressee_id: int) -> None:
+        self._record("add_request", requester_id, addressee_id)
+        _insort(self._outgoing, requester_id, addressee_id)
+        _insort(self._incoming, addressee_id, requester_id)
+
+    def add_friendship(self, a: int, b: int) -> None:
+        """Принятие заявки: pending-связь в любую сторону заменяется дружбой."""
+        self._record("add_friendship", a, b)
+        self._drop_requests(a, b)
+        _insort(self._friends, a, b)
+        _insort(self._friends, b, a)
+
+    def remove_friendship(self, a: int, b: int) -> None:
+        """Удаление из друзей, отмена или отклонение заявки — пара больше ничем не связана."""
+        self._record("remove_friendship", a, b)
+        self._drop_requests(a, b)
+        _discard(self._friends, a, b)
+        _discard(self._friends, b, a)
+
+    def _drop_requests(self, a: int, b: int) -> None:
+        _discard(self._outgoing, a, b)
+        _discard(self._incoming, b, a)
+        _discard(self._outgoing, b, a)
+        _discard(self._incoming, a, b)
+
+    def mutual_counts(self, user_id: int) -> Counter:
+        """Друзья друзей -> число общих друзей (без самого пользователя и его друзей)."""
+        mine = self.friends(user_id)
+        counts: Counter = Counter()
+        for f in mine:
+            counts.update(self._friends.get(f, ()))
+        counts.pop(user_id, None)
+        for f in mine:
+            counts.pop(f, None)
+        return counts
+
+    async def load(self) -> None:
+        """Перечитать friendships. Хуки, пришедшие во время запроса, повторяются на новых списках
+        (они идемпотентны), иначе изменения этого воркера терялись бы до следующей перезагрузки."""
+        db_type = get_db_type()
+        events: List[tuple] = []
+        self._pending = events
+        try:
+            async with get_db() as conn:
+                if db_type == 'postgresql':
+                    rows = await conn.fetch("SELECT requester_id, addressee_id, status FROM friendships")
+                    triples = [(r["requester_id"], r["addressee_id"], r["status"]) for r in rows]
+                else:
+                    async with conn.execute("SELECT requester_id, addressee_id, status FROM friendships") as cur:
+                        triples = await cur.fetchall()
+        finally:
+            self._pending = None
+        friends: Dict[int, List[int]] = {}
+        incoming: Dict[int, List[int]] = {}
+        outgoing: Dict[int, List[int]] = {}
+        accepted = 0
+        for a, b, status in triples:
+            if status == 'accepted':
+                friends.setdefault(a, []).append(b)
+                friends.setdefault(b, []).append(a)
+                accepted += 1
+            elif status == 'pending':
+                outgoing.setdefault(a, []).append(b)
+                incoming.setdefault(b, []).append(a)
+        self._friends = _freeze(friends)
+        self._incoming = _freeze(incoming)
+        self._outgoing = _freeze(outgoing)
+        for method, *args in events:
+            getattr(self, method)(*args)
+        self.ready = True
+        logger.info(
+            "Социальный граф загружен: %d пользователей, %d дружб, %d заявок",
+            len(self._friends), accepted, len(triples) - accepted
+        )
+
+
+social_graph = SocialGraph()
+suggestions_cache = TTLCache(ttl=SUGGEST_CACHE_TTL_SECONDS, maxsize=50000)
+
+
+def invalidate_suggestions(*user_ids: int) -> None:
+    for uid in user_ids:
+        suggestions_cache.pop(uid)
+
+
+async def run_social_graph_reload() -> None:
+    """Загрузить граф при старте и периодически перечитывать его."""
+    while True:
+        try:
+            await social_graph.load()
+        except Exception as e:
+            logger.warning("Не удалось загрузить социальный граф: %s", e)
+        await asyncio.sleep(SOCIAL_GRAPH_RELOAD_SECONDS)
+
+
+async def friend_suggestions(user_id: int, limit: int = 20) -> List[dict]:
+    """Рекомендации друзей с числом общих друзей, общих групп и общих тегов (кэшируется на пользователя)."""
+    cached = suggestions_cache.get(user_id)
+    if cached is not None:
+        return cached[:limit]
+
+    mutual = social_graph.mutual_counts(user_id)
+    db_type = get_db_type()
+    async with get_db() as conn:
+        # Любая связь (в том числе заявка в любую сторону) исключает кандидата
+        related = social_graph.related(user_id) if social_graph.ready else None
+        if db_type == 'postgresql':
+            if related is None:
+                rel = await conn.fetch(
+                    "SELECT requester_id, addressee_id FROM friendships WHERE requester_id = $1 OR addressee_id = $1",
+                    user_id
+                )
+                related = {r["addressee_id"] if r["requester_id"] == user_id else r["requester_id"] for r in rel}
+            group_rows = await conn.fetch(
+                """SELECT gm2.user_id, COUNT(*) AS shared FROM group_members gm1
+                   JOIN group_members gm2 ON gm2.group_id = gm1.group_id AND gm2.user_id != gm1.user_id
+                   WHERE gm1.user_id = $1 GROUP BY gm2.user_id ORDER BY shared DESC LIMIT $2""",
+                user_id, SUGGEST_GROUP_CANDIDATES
+            )
+            shared_groups = {r["user_id"]: r["shared"] for r in group_rows}
+        else:
+            if related is None:
+                async with conn.execute(
+                    "SELECT requester_id, addressee_id FROM friendships WHERE requester_id = ? OR addressee_id = ?",
+                    (user_id, user_id)
+                ) as cur:
+                    related = {b if a == user_id else a for a, b in await cur.fetchall()}
+            async with conn.execute(
+                """SELECT gm2.user_id, COUNT(*) AS shared FROM group_members gm1
+                   JOIN group_members gm2 ON gm2.group_id = gm1.group_id AND gm2.user_id != gm1.user_id
+                   WHERE gm1.user_id = ? GROUP BY gm2.user_id ORDER BY shared DESC LIMIT ?""",
+                (user_id, SUGGEST_GROUP_CANDIDATES)
+            ) as cur:
+                shared_groups = {r[0]: r[1] for r in await cur.fetchall()}
+
+        candidates = (set(mutual) | set(shared_groups)) - related - {user_id}
+        shared_tags: Dict[int, int] = {}
+        if candidates:
+            cand = list(candidates)
+            if db_type == 'postgresql':
+                rows = await conn.fetch(
+                    """SELECT s2.user_id, COUNT(*) AS shared FROM user_tag_subscriptions s1
+                       JOIN user_tag_subscriptions s2 ON s2.tag_id = s1.tag_id
+                       WHERE s1.user_id = $1 AND s2.user_id = ANY($2::int[]) GROUP BY s2.user_id""",
+                    user_id, cand
+                )
+                shared_tags = {r["user_id"]: r["shared"] for r in rows}
+            else:
+                async with conn.execute(
+                    f"""SELECT s2.user_id, COUNT(*) FROM user_tag_subscriptions s1
+                        JOIN user_tag_subscriptions s2 ON s2.tag_id = s1.tag_id
+                        WHERE s1.user_id = ? AND s2.user_id IN ({",".join(["?"] * len(cand))}) GROUP BY s2.user_id""",
+                    (user_id, *cand)
+                ) as cur:
+                    shared_tags = {r[0]: r[1] for r in await cur.fetchall()}
+
+        def score(uid: int) -> float:
+            return (SUGGEST_MUTUAL_WEIGHT * mutual.get(uid, 0)
+                    + SUGGEST_GROUP_WEIGHT * shared_groups.get(uid, 0)
+                    + SUGGEST_TAG_WEIGHT * shared_tags.get(uid, 0))
+
+        ranked = sorted(candidates, key=lambda uid: (-score(uid), -mutual.get(uid, 0), uid))[:SUGGEST_CACHE_SIZE]
+
+        # Пользователи без общих связей — как раньше, самые новые (чтобы у новичков список не был пустым)
+        if len(ranked) < SUGGEST_CACHE_SIZE:
+            exclude = related | set(ranked) | {user_id}
+            if db_type == 'postgresql':
+                rows = await conn.fetch(
+                    "SELECT id FROM users WHERE id != ALL($1::int[]) AND is_banned IS NOT TRUE ORDER BY created_at DESC LIMIT $2",
+                    list(exclude), SUGGEST_CACHE_SIZE - len(ranked)
+                )
+                ranked += [r["id"] for r in rows]
+            else:
+                async with conn.execute(
+                    f"""SELECT id FROM users WHERE id NOT IN ({",".join(["?"] * len(exclude))})
+                        AND (is_banned = 0 OR is_banned IS NULL) ORDER BY created_at DESC LIMIT ?""",
+                    (*exclude, SUGGEST_CACHE_SIZE - len(ranked))
+                ) as cur:
+                    ranked += [r[0] for r in await cur.fetchall()]
+
+        if db_type == 'postgresql':
+            rows = await conn.fetch(
+                "SELECT id, username, email, avatar_url FROM users WHERE id = ANY($1::int[]) AND is_banned IS NOT TRUE",
+                ranked
+            )
+            users = {r["id"]: dict(r) for r in rows}
+        else:
+            users = {}
+            if ranked:
+                async with conn.execute(
+                    f"""SELECT id, username, email, avatar_url FROM users
+                        WHERE id IN ({",".join(["?"] * len(ranked))}) AND (is_banned = 0 OR is_banned IS NULL)""",
+                    ranked
+                ) as cur:
+                    users = {r[0]: {"id": r[0], "username": r[1], "email": r[2], "avatar_url": r[3]}
+                             for r in await cur.fetchall()}
+
+    out = []
+    for uid in ranked:
+        u = users.get(uid)
+        if not u:
+            continue
+        u["mutual_friends"] = mutual.get(uid, 0)
+        u["shared_groups"] = shared_groups.get(uid, 0)
+        u["shared_tags"] = shared_tags.get(uid, 0)
+        out.append(u)
+    suggestions_cache.set(user_id, out)
+    return out[:limit]
@@ -0,0 +1,53 @@
+"""
+Профиль холодного старта воркера
+С STARTUP_PROFILE=1 пишет в лог, сколько заняла каждая фаза: импорты server.py (сторонние библиотеки,
+модули приложения, объявление моделей и роутов), миграции, запуск фоновых задач. Отсчёт начинается
+с импорта этого модуля — server.py импортирует его первым.
+Подробно по отдельным модулям: python -X importtime -c "import server" 2> importtime.log
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class StartupProfile:
+    """Фазы (имя, секунды) в порядке выполнения."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, name: str) -> None:
+        """Закрыть фазу name: всё, что выполнялось с предыдущей отметки."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @contextmanager
+    def phase(self, name: str):
+        """Измерить блок; время с предыдущей отметки до него записывается как «прочее»."""
+        now = time.perf_counter()
+        if now - self._last > 0.001:
+            self.phases.append(("прочее", now - self._last))
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self.phases.append((name, self._last - now))
+
+    def report(self) -> None:
+        if not STARTUP_PROFILE:
+            return
+        total = time.perf_counter() - self.started
+        lines = [f"  {name:<40} {seconds * 1000:8.1f} мс" for name, seconds in self.phases]
+        logger.info("Профиль старта воркера %s: %.0f мс\n%s", os.getpid(), total * 1000, "\n".join(lines))
+
+
+startup_profile = StartupProfile()
@@ -0,0 +1,172 @@
+"""
+Статистика для админки
+Итоги (пользователи, посты, сообщения, дружбы, уведомления...) лежат в stats_counters и
+поддерживаются триггерами на вставку / удаление / изменение строк (см. STATS_COUNTERS в database.py);
+в PostgreSQL приращения копятся в слотах stats_counter_shards и суммируются при чтении.
+Регистрации, посты и сообщения по дням — в stats_daily; их, как и «активных за 24 часа»,
+пересчитывает фоновая задача по индексу created_at только за последние дни.
+Раз в STATS_RECONCILE_SECONDS счётчики сверяются точным COUNT(*), чтобы исправить возможный дрейф.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict
+
+from database import STATS_COUNTER_VALUE_PG, STATS_COUNTERS, get_db, get_db_type
+
+logger = logging.getLogger(__name__)
+
+STATS_ROLLUP_SECONDS = int(os.getenv("STATS_ROLLUP_SECONDS", "300"))
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", "86400"))
+# Сколько дней пересчитывать при первом запуске (статистика админки смотрит на 30 дней назад)
+STATS_BACKFILL_DAYS = 31
+
+# metric в stats_daily -> таблица с created_at
+DAILY_METRICS = {"users": "users", "posts": "posts", "messages": "messages"}
+
+
+async def rollup_daily(days: int = 2) -> None:
+    """Пересчитать дневные бакеты за последние days дней (включая сегодня) и «активных за 24 часа»."""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            empty = not await conn.fetchval("SELECT 1 FROM stats_daily LIMIT 1")
+            days = STATS_BACKFILL_DAYS if empty else days
+            for metric, table in DAILY_METRICS.items():
+                await conn.execute(
+                    f"""INSERT INTO stats_daily (day, metric, value)
+                        SELECT created_at::date, $1, COUNT(*) FROM {table}
+                        WHERE created_at >= CURRENT_DATE - ($2 - 1) * INTERVAL '1 day'
+                        GROUP BY created_at::date
+                        ON CONFLICT (day, metric) DO UPDATE SET value = EXCLUDED.value""",
+                    metric, days
+                )
+            active = await conn.fetchval("""
+                SELECT COUNT(*) FROM (
+                    SELECT author_id FROM posts WHERE created_at >= NOW() - INTERVAL '24 hours'
+                    UNION
+                    SELECT sender_id FROM messages WHERE created_at >= NOW() - INTERVAL '24 hours'
+                ) a
+            """)
+            await conn.execute(
+                """INSERT INTO stats_counters (name, value, updated_at) VALUES ('active_last_24h', $1, NOW())
+                   ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()""",
+                active
+            )
+        else:
+            async with conn.execute("SELECT 1 FROM stats_daily LIMIT 1") as cur:
+                empty = await cur.fetchone() is None
+            days = STATS_BACKFILL_DAYS if empty else days
+            since = f"-{days - 1} days"
+            for metric, table in DAILY_METRICS.items():
+                await conn.execute(
+                    f"""INSERT OR REPLACE INTO stats_daily (day, metric, value)
+                        SELECT date(created_at), ?, COUNT(*) FROM {table}
+                        WHERE created_at >= date('now', ?)
+                        GROUP BY date(created_at)""",
+                    (metric, since)
+                )
+            async with conn.execute("""
+                SELECT COUNT(*) FROM (
+                    SELECT author_id FROM posts WHERE created_at >= datetime('now', '-24 hours')
+                    UNION
+                    SELECT sender_id FROM messages WHERE created_at >= datetime('now', '-24 hours')
+                )
+            """) as cur:
+                active = (await cur.fetchone())[0]
+            await conn.execute(
+                "INSERT OR REPLACE INTO stats_counters (name, value, updated_at) VALUES ('active_last_24h', ?, CURRENT_TIMESTAMP)",
+                (active,)
+            )
+            await conn.commit()
+
+
+async def reconcile_counters() -> Dict[str, int]:
+    """Точно пересчитать счётчики и вернуть найденные расхождения (name -> было - стало)."""
+    db_type = get_db_type()
+    drift: Dict[str, int] = {}
+    async with get_db() as conn:
+        for name, (table, pg_cond, sqlite_cond) in STATS_COUNTERS.items():
+            if db_type == 'postgresql':
+                exact = await conn.fetchval(f"SELECT COUNT(*) FROM {table} r WHERE {pg_cond.format(r='r')}")
+                old = await conn.fetchval(
+                    f"SELECT {STATS_COUNTER_VALUE_PG} FROM stats_counters c WHERE c.name = $1", name
+                )
+                # Слоты не трогаем (их держат пишущие транзакции) — база = точное значение минус слоты
+                await conn.execute(
+                    """INSERT INTO stats_counters (name, value, updated_at)
+                       VALUES ($1, $2 - COALESCE((SELECT SUM(value) FROM stats_counter_shards WHERE name = $1), 0), NOW())
+                       ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()""",
+                    name, exact
+                )
+            else:
+                async with conn.execute(f"SELECT COUNT(*) FROM {table} r WHERE {sqlite_cond.format(r='r')}") as cur:
+                    exact = (await cur.fetchone())[0]
+                async with conn.execute("SELECT value FROM stats_counters WHERE name = ?", (name,)) as cur:
+                    row = await cur.fetchone()
+                    old = row[0] if row else None
+                await conn.execute(
+                    "INSERT OR REPLACE INTO stats_counters (name, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                    (name, exact)
+                )
+            if old is not None and old != exact:
+                drift[name] = old - exact
+        # groups.members_count мог разойтись при каскадном удалении участников (удаление пользователя)
+        fix = """UPDATE groups SET members_count = (SELECT COUNT(*) FROM group_members gm WHERE gm.group_id = groups.id)
+                 WHERE members_count <> (SELECT COUNT(*) FROM group_members gm WHERE gm.group_id = groups.id)"""
+        if db_type == 'postgresql':
+            fixed = int((await conn.execute(fix)).split()[-1])
+        else:
+            fixed = (await conn.execute(fix)).rowcount
+        if fixed:
+            drift["groups_members_count"] = fixed
+        if db_type != 'postgresql':
+            await conn.commit()
+    if drift:
+        logger.warning("Счётчики статистики расходились с данными, исправлено: %s", drift)
+    return drift
+
+
+async def read_stats() -> dict:
+    """Счётчики и суммы по дневным бакетам — два запроса к маленьким таблицам."""
+    db_type = get_db_type()
+    async with get_db() as conn:
+        if db_type == 'postgresql':
+            counters = {r["name"]: r["value"] for r in await conn.fetch(
+                f"SELECT c.name, {STATS_COUNTER_VALUE_PG} AS value FROM stats_counters c"
+            )}
+            rows = await conn.fetch("""
+                SELECT metric,
+                       COALESCE(SUM(value) FILTER (WHERE day >= CURRENT_DATE), 0) AS today,
+                       COALESCE(SUM(value) FILTER (WHERE day >= CURRENT_DATE - 7), 0) AS week,
+                       COALESCE(SUM(value), 0) AS month
+                FROM stats_daily WHERE day >= CURRENT_DATE - 30 GROUP BY metric
+            """)
+            daily = {r["metric"]: dict(r) for r in rows}
+        else:
+            async with conn.execute("SELECT name, value FROM stats_counters") as cur:
+                counters = {r[0]: r[1] for r in await cur.fetchall()}
+            async with conn.execute("""
+                SELECT metric,
+                       SUM(CASE WHEN day >= date('now') THEN value ELSE 0 END),
+                       SUM(CASE WHEN day >= date('now', '-7 days') THEN value ELSE 0 END),
+                       SUM(value)
+                FROM stats_daily WHERE day >= date('now', '-30 days') GROUP BY metric
+            """) as cur:
+                daily = {r[0]: {"today": r[1], "week": r[2], "month": r[3]} for r in await cur.fetchall()}
+    return {"counters": counters, "daily": daily}
+
+
+async def run_stats_jobs() -> None:
+    """Периодически пересчитывать дневные бакеты; раз в STATS_RECONCILE_SECONDS сверять счётчики."""
+    last_reconcile = time.monotonic()
+    while True:
+        try:
+            await rollup_daily()
+            if time.monotonic() - last_reconcile >= STATS_RECONCILE_SECONDS:
+                await reconcile_counters()
+                last_reconcile = time.monotonic()
+        except Exception as e:
+            logger.warning("Ошибка пересчёта статистики: %s", e)
+        await asyncio.sleep(STATS_ROLLUP_SECONDS)
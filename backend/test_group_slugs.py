@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Тест подбора slug групп на временной SQLite-базе. Запуск из папки backend:
+  python test_group_slugs.py
+  python -m pytest test_group_slugs.py
+
+Повторяющиеся имена, в том числе с числом в конце («Python 3» → python-3, основа python, номер 3),
+должны получать новый slug за постоянное число попыток, без 409.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BACKGROUND_TASKS", "off")
+
+import database
+
+database._db_type = "sqlite"
+database._sqlite_path = os.path.join(tempfile.mkdtemp(), "maksum.db")
+
+from fastapi.testclient import TestClient
+import server
+
+REPEATS = server.GROUP_SLUG_ATTEMPTS + 3
+
+
+def _create(c, headers, name):
+    r = c.post("/api/groups", json={"name": name}, headers=headers)
+    assert r.status_code == 200, f"{name!r}: {r.status_code} {r.text}"
+    return r.json()["slug"]
+
+
+def test_repeated_group_names():
+    with TestClient(server.app) as c:
+        creds = {"username": "slug_test", "email": "slug_test@ex.com", "password": "secret123"}
+        assert c.post("/api/auth/register", json=creds).status_code == 200
+        token = c.post("/api/auth/login", json={"username_or_email": creds["username"], "password": creds["password"]})
+        headers = {"Authorization": "Bearer " + token.json()["access_token"]}
+
+        numbered = [_create(c, headers, "Python 3") for _ in range(REPEATS)]
+        assert numbered == ["python-3"] + [f"python-3-{i}" for i in range(1, REPEATS)], numbered
+
+        rooms = [_create(c, headers, f"Room {i}") for i in range(1, 6)]
+        rooms += [_create(c, headers, "Room") for _ in range(2)]
+        assert rooms == ["room-1", "room-2", "room-3", "room-4", "room-5", "room", "room-6"], rooms
+
+        plain = [_create(c, headers, "Music") for _ in range(REPEATS)]
+        assert plain == ["music"] + [f"music-{i}" for i in range(1, REPEATS)], plain
+
+
+if __name__ == "__main__":
+    test_repeated_group_names()
+    print("OK")
@@ -22,35 +22,75 @@ import api from '../../api/axios';
 import { useUser } from '../../context/UserContext';
 import UserBadges from '../Profile/UserBadges';
 
+// Комментарии приходят страницами от старых к новым (after_id — id последнего загруженного)
+const COMMENTS_PAGE_SIZE = 50;
+
+// Объединить списки комментариев без повторов, по возрастанию id
+const mergeComments = (current, added) => {
+  const byId = new Map(current.map((c) => [c.id, c]));
+  added.forEach((c) => byId.set(c.id, c));
+  return [...byId.values()].sort((a, b) => a.id - b.id);
+};
+
 const PostCard = ({ post, onLike, onAuthorClick, onCommentAdded }) => {
   const { user } = useUser();
   const [showComments, setShowComments] = useState(false);
   const [comments, setComments] = useState([]);
   const [commentText, setCommentText] = useState('');
   const [commentsLoading, setCommentsLoading] = useState(false);
+  // id последнего комментария загруженных страниц; null — страниц больше нет
+  const [commentsAfterId, setCommentsAfterId] = useState(null);
+  const [loadingMoreComments, setLoadingMoreComments] = useState(false);
   const [sendingComment, setSendingComment] = useState(false);
   const [liking, setLiking] = useState(false);
 
+  const fetchCommentsPage = async (afterId) => {
+    const res = await api.get(`/posts/${post.id}/comments`, {
+      params: { after_id: afterId, limit: COMMENTS_PAGE_SIZE },
+    });
+    return Array.isArray(res.data) ? res.data : [];
+  };
+
+  const nextAfterId = (page) => (page.length === COMMENTS_PAGE_SIZE ? page[page.length - 1].id : null);
+
   useEffect(() => {
     if (!showComments || !post?.id) return;
     let cancelled = false;
     setCommentsLoading(true);
-    api.get(`/posts/${post.id}/comments`)
-      .then((res) => { if (!cancelled) setComments(Array.isArray(res.data) ? res.data : []); })
-      .catch(() => { if (!cancelled) setComments([]); })
+    fetchCommentsPage(0)
+      .then((page) => {
+        if (cancelled) return;
+        setComments(page);
+        setCommentsAfterId(nextAfterId(page));
+      })
+      .catch(() => { if (!cancelled) { setComments([]); setCommentsAfterId(null); } })
       .finally(() => { if (!cancelled) setCommentsLoading(false); });
     return () => { cancelled = true; };
   }, [showComments, post?.id]);
 
+  const handleLoadMoreComments = async () => {
+    if (commentsAfterId == null || loadingMoreComments) return;
+    setLoadingMoreComments(true);
+    try {
+      const page = await fetchCommentsPage(commentsAfterId);
+      setComments((prev) => mergeComments(prev, page));
+      setCommentsAfterId(nextAfterId(page));
+    } catch (err) {
+      console.error('Error loading comments:', err);
+    } finally {
+      setLoadingMoreComments(false);
+    }
+  };
+
   const handleAddComment = async (e) => {
     e.preventDefault();
     if (!commentText.trim() || sendingComment || !post?.id) return;
     setSendingComment(true);
     try {
-      await api.post(`/posts/${post.id}/comments`, { content: commentText.trim() });
+      // Новый комментарий — из ответа: при недогруженных страницах он был бы за пределами первой
+      const res = await api.post(`/posts/${post.id}/comments`, { content: commentText.trim() });
       setCommentText('');
-      const res = await api.get(`/posts/${post.id}/comments`);
-      setComments(Array.isArray(res.data) ? res.data : []);
+      setComments((prev) => mergeComments(prev, [res.data]));
       onCommentAdded?.();
     } catch (err) {
       console.error('Error adding comment:', err);
@@ -223,6 +263,18 @@ const PostCard = ({ post, onLike, onAuthorClick, onCommentAdded }) => {
                     </li>
                   ))}
                 </ul>
+                {commentsAfterId != null && (
+                  <Button
+                    type="button"
+                    variant="ghost"
+                    size="sm"
+                    className="w-full text-muted-foreground"
+                    disabled={loadingMoreComments}
+                    onClick={handleLoadMoreComments}
+                  >
+                    {loadingMoreComments ? 'Загрузка...' : 'Показать ещё комментарии'}
+                  </Button>
+                )}
                 {user && (
                   <form onSubmit={handleAddComment} className="flex gap-2">
                     <Input